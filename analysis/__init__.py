@@ -0,0 +1,5 @@
+# encoding: utf-8
+from analysis.events import EventStore
+from analysis.tiles import TimeClusterTiles, flatten_files
+
+__all__ = ['EventStore', 'TimeClusterTiles', 'flatten_files']
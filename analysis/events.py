@@ -0,0 +1,224 @@
+# encoding: utf-8
+"""
+columnar store of file events
+
+every file contributes a creation, a modification and an access event, the
+times and the size, first cluster and directory of the files are kept in flat
+columns indexed by path id, and the events of each kind are sorted by time
+once, so that a query over a time window is a pair of binary searches and
+works on a contiguous slice of the sorted index
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+import posixpath
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['KINDS', 'Burst', 'EventStore']
+
+KINDS = ('create', 'modify', 'access')
+
+
+class Burst:
+
+    """many events of a kind within a short time"""
+
+    __slots__ = ['kind', 'first_time', 'last_time', 'count', 'path_ids']
+
+    def __init__(self, kind, first_time, last_time, count, path_ids):
+        self.kind = kind
+        self.first_time = first_time
+        self.last_time = last_time
+        self.count = count
+        self.path_ids = path_ids
+
+    def __repr__(self):
+        return '<Burst %s of %d events at %s..%s>' % (
+            self.kind, self.count, self.first_time, self.last_time)
+
+
+class EventStore:
+
+    def __init__(self, paths, create_times, modify_times, access_times,
+                 sizes, first_clusters):
+        """
+        columns of the files, the path id of a file is its position, missing
+        times are NaN, see `from_files'
+        """
+        self.paths = paths
+        self.times = {'create': create_times, 'modify': modify_times,
+                      'access': access_times}
+        self.sizes = sizes
+        self.first_clusters = first_clusters
+
+        # directories get ids of their own, for rollups
+        self.directories = []
+        directory_ids = {}
+        self.directory_ids = self._column('l', len(paths))
+        for i, path in enumerate(paths):
+            directory = posixpath.dirname(path)
+            if directory not in directory_ids:
+                directory_ids[directory] = len(self.directories)
+                self.directories.append(directory)
+            self.directory_ids[i] = directory_ids[directory]
+
+        # `{kind: (sorted_times, path_ids)}', events without a time are left
+        # out
+        self._index = {kind: self._sort(times)
+                       for kind, times in self.times.items()}
+
+    @classmethod
+    def from_files(cls, files):
+        """store of the files returned by `get_fdt', keyed by path"""
+        nan = float('nan')
+        paths = sorted(files)
+        entries = [files[path] for path in paths]
+
+        def _times(name):
+            values = (getattr(entry, name, None) for entry in entries)
+            return cls._float_column(nan if t is None else t for t in values)
+
+        return cls(paths,
+                   _times('create_timestamp'),
+                   _times('modify_timestamp'),
+                   _times('access_timestamp'),
+                   cls._int_column(entry.file_length for entry in entries),
+                   cls._int_column(entry.first_cluster for entry in entries))
+
+    @staticmethod
+    def _float_column(values):
+        if numpy is not None:
+            return numpy.fromiter(values, numpy.float64)
+        return array('d', values)
+
+    @staticmethod
+    def _int_column(values):
+        if numpy is not None:
+            return numpy.fromiter(values, numpy.int64)
+        return array('q', values)
+
+    @staticmethod
+    def _column(typecode, size):
+        if numpy is not None:
+            return numpy.zeros(size, numpy.int64)
+        return array(typecode, bytes(array(typecode).itemsize * size))
+
+    @staticmethod
+    def _sort(times):
+        if numpy is not None:
+            path_ids = numpy.flatnonzero(~numpy.isnan(times))
+            path_ids = path_ids[numpy.argsort(times[path_ids],
+                                              kind='stable')]
+            return times[path_ids], path_ids
+
+        # NaN is the only value not equal to itself
+        path_ids = sorted((i for i, t in enumerate(times) if t == t),
+                          key=times.__getitem__)
+        return (array('d', (times[i] for i in path_ids)),
+                array('q', path_ids))
+
+    def __len__(self):
+        """number of events"""
+        return sum(len(times) for times, _ in self._index.values())
+
+    def _bounds(self, kind, since, until):
+        if kind not in self._index:
+            raise ValueError('unknown kind %r' % kind)
+        times, path_ids = self._index[kind]
+        if numpy is not None and isinstance(times, numpy.ndarray):
+            return (int(numpy.searchsorted(times, since, 'left')),
+                    int(numpy.searchsorted(times, until, 'right')))
+        return bisect_left(times, since), bisect_right(times, until)
+
+    def range(self, kind, since=float('-inf'), until=float('inf')):
+        """
+        path ids of the files with an event of `kind' within `[since, until]'
+        in the order of the events
+        """
+        lo, hi = self._bounds(kind, since, until)
+        return self._index[kind][1][lo:hi]
+
+    def count(self, kind, since=float('-inf'), until=float('inf')):
+        lo, hi = self._bounds(kind, since, until)
+        return hi - lo
+
+    def bursts(self, kind, window, threshold, since=float('-inf'),
+               until=float('inf')):
+        """
+        the bursts of events of `kind', times where at least `threshold'
+        events happen within `window' seconds, overlapping bursts are merged
+        """
+        lo, hi = self._bounds(kind, since, until)
+        times, path_ids = self._index[kind]
+        times = times[lo:hi]
+
+        if numpy is not None and isinstance(times, numpy.ndarray):
+            # the events from each event on up to `window' seconds later
+            ends = numpy.searchsorted(times, times + window, 'right')
+            starts = numpy.flatnonzero(ends - numpy.arange(len(times)) >=
+                                       threshold)
+            runs = []
+            if len(starts):
+                # how far the windows of the events up to each start reach, a
+                # burst goes on while the next start is within that reach
+                reach = numpy.maximum.accumulate(ends[starts])
+                first = numpy.flatnonzero(
+                    numpy.r_[True, starts[1:] >= reach[:-1]])
+                last = numpy.r_[first[1:] - 1, len(starts) - 1]
+                runs = zip(starts[first].tolist(), reach[last].tolist())
+        else:
+            runs = []
+            for i, t in enumerate(times):
+                end = bisect_right(times, t + window, i)
+                if end - i < threshold:
+                    continue
+                if runs and i < runs[-1][1]:
+                    runs[-1][1] = max(runs[-1][1], end)
+                else:
+                    runs.append([i, end])
+
+        return [Burst(kind, times[start], times[end - 1], end - start,
+                      path_ids[lo + start:lo + end])
+                for start, end in runs]
+
+    def rollup(self, kind, since=float('-inf'), until=float('inf'),
+               recursive=False):
+        """
+        `{directory: (events, bytes)}' of the events of `kind' within
+        `[since, until]' of the files right in each directory, or anywhere
+        under it if `recursive'
+        """
+        path_ids = self.range(kind, since, until)
+
+        if numpy is not None and isinstance(path_ids, numpy.ndarray):
+            directory_ids = self.directory_ids[path_ids]
+            counts = numpy.bincount(directory_ids,
+                                    minlength=len(self.directories))
+            sizes = numpy.bincount(directory_ids, self.sizes[path_ids],
+                                   len(self.directories))
+            found = numpy.flatnonzero(counts)
+            rollup = {self.directories[i]: (int(counts[i]), int(sizes[i]))
+                      for i in found.tolist()}
+        else:
+            rollup = {}
+            for i in path_ids:
+                directory = self.directories[self.directory_ids[i]]
+                count, size = rollup.get(directory, (0, 0))
+                rollup[directory] = count + 1, size + self.sizes[i]
+
+        if recursive:
+            totals = {}
+            for directory, (count, size) in rollup.items():
+                while True:
+                    total_count, total_size = totals.get(directory, (0, 0))
+                    totals[directory] = (total_count + count,
+                                         total_size + size)
+                    if directory == '/':
+                        break
+                    directory = posixpath.dirname(directory)
+            rollup = totals
+
+        return rollup
@@ -0,0 +1,242 @@
+# encoding: utf-8
+"""
+time-cluster chart aggregated into tiles
+
+the clusters of every file are binned by their position on the volume
+against the creation and modification time of the file into a 2D histogram,
+whose cells hold the number of clusters. the histogram is built once at the
+finest zoom level in a vectorized pass over flat arrays of the extents, and
+halved level by level into a pyramid, so that a view of any part of the chart
+at any zoom level is a slice of a precomputed array
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['DEFAULT_TILE_SIZE', 'DEFAULT_LEVELS', 'KINDS', 'flatten_files',
+           'TimeClusterTiles']
+
+# bins along each axis of a tile
+DEFAULT_TILE_SIZE = 128
+
+# zoom levels, level 0 is a single tile and every level doubles the number of
+# tiles along each axis
+DEFAULT_LEVELS = 4
+
+KINDS = ('create', 'modify')
+
+
+def flatten_files(files):
+    """
+    flat arrays of the extents of `files', as returned by `get_fdt', as
+    `(starts, ends, create_times, modify_times)', missing times are NaN
+    """
+    starts, ends, create_times, modify_times = [], [], [], []
+    nan = float('nan')
+    for entry in files.values():
+        create = entry.create_timestamp
+        modify = entry.modify_timestamp
+        create = nan if create is None else create
+        modify = nan if modify is None else modify
+        for start, end in entry.cluster_list:
+            starts.append(start)
+            ends.append(end)
+            create_times.append(create)
+            modify_times.append(modify)
+
+    if numpy is not None:
+        return (numpy.array(starts, numpy.int64),
+                numpy.array(ends, numpy.int64),
+                numpy.array(create_times, numpy.float64),
+                numpy.array(modify_times, numpy.float64))
+    return starts, ends, create_times, modify_times
+
+
+def _data_time_range(create_times, modify_times):
+    if numpy is not None:
+        times = numpy.concatenate([create_times, modify_times])
+        times = times[numpy.isfinite(times)]
+    else:
+        # NaN is the only value not equal to itself
+        times = [t for t in list(create_times) + list(modify_times) if t == t]
+    if not len(times):
+        return 0, 0
+    return min(times), max(times)
+
+
+class TimeClusterTiles:
+
+    """
+    pyramids of time-cluster histograms of the creation and modification
+    times, rows of a tile are time bins and columns cluster bins
+    """
+
+    def __init__(self, starts, ends, create_times, modify_times,
+                 number_of_clusters=None, time_range=None,
+                 tile_size=DEFAULT_TILE_SIZE, levels=DEFAULT_LEVELS):
+        """
+        starts, ends, create_times, modify_times: flat arrays of the extents
+        and the times of their files, see `flatten_files'
+        number_of_clusters: extent of the cluster axis, by default up to the
+        last cluster of any extent
+        time_range: `(first, last)' timestamps of the time axis, by default
+        those of the data, times outside of it are left out
+        """
+        self.tile_size = tile_size
+        self.levels = levels
+        # the histograms are numpy arrays, or lists of rows without numpy
+        self._vectorized = numpy is not None
+        self.size = tile_size << (levels - 1)
+
+        if number_of_clusters is None:
+            number_of_clusters = (max(ends) + 1) if len(ends) else 1
+        self.number_of_clusters = int(number_of_clusters)
+        # clusters per bin at the finest level
+        self.cluster_bin = max(-(-self.number_of_clusters // self.size), 1)
+
+        if time_range is None:
+            time_range = _data_time_range(create_times, modify_times)
+        first, last = time_range
+        self.time_range = (float(first), float(max(last, first + 1)))
+
+        self._pyramids = {
+            'create': self._pyramid(self._histogram(starts, ends,
+                                                    create_times)),
+            'modify': self._pyramid(self._histogram(starts, ends,
+                                                    modify_times)),
+        }
+
+    @classmethod
+    def from_files(cls, files, **kwargs):
+        """tiles of the files returned by `get_fdt'"""
+        return cls(*flatten_files(files), **kwargs)
+
+    def _time_bins(self, times):
+        first, last = self.time_range
+        scale = self.size / (last - first)
+        if numpy is not None:
+            bins = numpy.floor((times - first) * scale)
+            # the last time falls into the last bin
+            bins[times == last] = self.size - 1
+            return bins
+        return [self.size - 1 if t == last else (t - first) * scale // 1
+                for t in times]
+
+    def _histogram(self, starts, ends, times):
+        """clusters per cell at the finest level, as rows of time bins"""
+        size = self.size
+        width = self.cluster_bin
+        time_bins = self._time_bins(times)
+
+        if numpy is None:
+            return self._histogram_loop(starts, ends, time_bins)
+
+        keep = (time_bins >= 0) & (time_bins < size) & \
+            (starts < size * width)
+        rows = time_bins[keep].astype(numpy.int64) * size
+        starts = starts[keep]
+        ends = numpy.minimum(ends[keep], size * width - 1)
+        first_bins = starts // width
+        last_bins = ends // width
+        single = first_bins == last_bins
+
+        cells = size * size
+        # bincount without any weights counts in integers, with some in floats
+        counts = numpy.zeros(cells)
+        # extents within a single bin
+        counts += numpy.bincount(rows[single] + first_bins[single],
+                                 ends[single] - starts[single] + 1, cells)
+
+        # extents over several bins fill their first and last bins partially
+        rows, starts, ends, first_bins, last_bins = (
+            a[~single] for a in (rows, starts, ends, first_bins, last_bins))
+        counts += numpy.bincount(rows + first_bins,
+                                 (first_bins + 1) * width - starts, cells)
+        counts += numpy.bincount(rows + last_bins,
+                                 ends - last_bins * width + 1, cells)
+
+        # and the bins in between entirely, they are summed up from the
+        # differences along each row
+        steps = numpy.bincount(rows + first_bins + 1, None, cells) - \
+            numpy.bincount(rows + last_bins, None, cells)
+        counts += numpy.cumsum(steps.reshape(size, size), axis=1).\
+            ravel() * width
+
+        return numpy.rint(counts).astype(numpy.int64).reshape(size, size)
+
+    def _histogram_loop(self, starts, ends, time_bins):
+        size = self.size
+        width = self.cluster_bin
+        counts = [[0] * size for _ in range(size)]
+        for start, end, row in zip(starts, ends, time_bins):
+            if not row == row or not 0 <= row < size or \
+                    start >= size * width:
+                continue
+            row = counts[int(row)]
+            end = min(end, size * width - 1)
+            b = start // width
+            while b * width <= end:
+                row[b] += min(end, (b + 1) * width - 1) - \
+                    max(start, b * width) + 1
+                b += 1
+        return counts
+
+    def _pyramid(self, finest):
+        """the histogram at every level, from level 0 to the finest"""
+        levels = [finest]
+        for _ in range(self.levels - 1):
+            above = levels[-1]
+            half = len(above) // 2
+            if numpy is not None:
+                levels.append(above.reshape(half, 2, half, 2).sum(axis=(1, 3)))
+            else:
+                levels.append([[above[2 * i][2 * j] + above[2 * i][2 * j + 1] +
+                                above[2 * i + 1][2 * j] +
+                                above[2 * i + 1][2 * j + 1]
+                                for j in range(half)] for i in range(half)])
+        levels.reverse()
+        return levels
+
+    def tiles_per_axis(self, level):
+        return 1 << level
+
+    def tile(self, level, time_tile, cluster_tile, kind=None):
+        """
+        histogram of a tile as `tile_size' rows of time bins of
+        `tile_size' cluster bins, of the creation or modification times or
+        of both if `kind' is None, raises IndexError if there is no such tile
+        """
+        if not 0 <= level < self.levels:
+            raise IndexError('no level %d' % level)
+        n = self.tiles_per_axis(level)
+        if not (0 <= time_tile < n and 0 <= cluster_tile < n):
+            raise IndexError('no tile (%d, %d) at level %d' %
+                             (time_tile, cluster_tile, level))
+        if kind is not None and kind not in KINDS:
+            raise ValueError('unknown kind %r' % kind)
+
+        rows = slice(time_tile * self.tile_size,
+                     (time_tile + 1) * self.tile_size)
+        columns = slice(cluster_tile * self.tile_size,
+                        (cluster_tile + 1) * self.tile_size)
+
+        tiles = [self._pyramids[k][level] for k in KINDS
+                 if kind is None or k == kind]
+        if self._vectorized:
+            return sum(t[rows, columns] for t in tiles)
+        return [[sum(t[i][j] for t in tiles) for j in
+                 range(columns.start, columns.stop)]
+                for i in range(rows.start, rows.stop)]
+
+    def bounds(self, level, time_tile, cluster_tile):
+        """
+        `((first_time, last_time), (first_cluster, last_cluster))' covered
+        by a tile, times are the edges of the bins, clusters inclusive
+        """
+        n = self.tiles_per_axis(level)
+        first, last = self.time_range
+        span = (last - first) / n
+        clusters = self.cluster_bin * (self.size // n)
+        return ((first + time_tile * span, first + (time_tile + 1) * span),
+                (cluster_tile * clusters, (cluster_tile + 1) * clusters - 1))
@@ -0,0 +1,112 @@
+# encoding: utf-8
+"""
+compares decoding directory entries with the construct layouts and with the
+precompiled `struct.Struct' decoders, per record and for a whole directory
+walked by `FAT32._iter_directory', run it with `python -m bench.entry_decoding'
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition
+from drive.fs.fat32.structs import FAT32DirectoryTableEntry, \
+    FAT32LongFilenameEntry
+from stream.buffered_cluster_stream import BufferedClusterStream
+from stream.img_stream import ImageStream
+
+_entry_classes = (FAT32DirectoryTableEntry, FAT32LongFilenameEntry)
+
+
+def _construct_decode(cls, raw):
+    return dict(cls.__struct__.parse(raw))
+
+
+def build_image(path, number_of_files):
+    image = SyntheticFAT32(number_of_files * 2 + 1024)
+    image.add_directory('/BIG')
+    for i in range(number_of_files):
+        # every other name needs long filename entries
+        name = 'file %d.txt' % i if i % 2 else 'F%d.TXT' % i
+        image.add_file('/BIG/' + name, size=1)
+    return image.write(path)
+
+
+def records(partition, cluster_list):
+    """raw 32-byte records of the directory up to its terminator"""
+    with BufferedClusterStream(partition.stream, cluster_list,
+                               partition.abs_c2b,
+                               partition.bytes_per_cluster) as stream:
+        for raw in partition._iter_raw_entries(stream, '/big'):
+            if raw.startswith(b'\x00'):
+                break
+            yield raw
+
+
+def time_per_record(raws):
+    results = {}
+    for name, decode in (('construct', _construct_decode),
+                         ('struct', lambda cls, raw: cls._decode(raw))):
+        t = time.perf_counter()
+        for raw in raws:
+            decode(_entry_classes[raw[0xb] == 0xf], raw)
+        results[name] = (time.perf_counter() - t) / len(raws)
+    return results
+
+
+def time_directory(partition, cluster_list, number_of_entries):
+    def walk():
+        t = time.perf_counter()
+        n = sum(1 for _ in partition._iter_directory('/big', cluster_list))
+        assert n == number_of_entries
+        return (time.perf_counter() - t) / n
+
+    results = {'struct': walk()}
+
+    fast = [cls.__dict__['_decode'] for cls in _entry_classes]
+    try:
+        for cls in _entry_classes:
+            cls._decode = classmethod(_construct_decode)
+        results['construct'] = walk()
+    finally:
+        for cls, decode in zip(_entry_classes, fast):
+            cls._decode = decode
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number-of-files', type=int, default=20000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    try:
+        build_image(path, args.number_of_files)
+
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            files, directories = partition.get_fdt()
+            cluster_list = directories['/big']
+
+            raws = list(records(partition, cluster_list))
+            print('records: %d, files: %d' % (len(raws),
+                                               args.number_of_files))
+
+            for title, results in (
+                    ('decode only', time_per_record(raws)),
+                    ('directory walk', time_directory(
+                        partition, cluster_list, args.number_of_files))):
+                print('%s: construct %0.2fus, struct %0.2fus, '
+                      'speedup: %0.1fx' % (
+                          title, results['construct'] * 1e6,
+                          results['struct'] * 1e6,
+                          results['construct'] / results['struct']))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
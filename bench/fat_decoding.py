@@ -0,0 +1,73 @@
+# encoding: utf-8
+"""
+compares the per-entry and the bulk FAT decoding paths of `FAT32.get_fat' on
+a synthetic partition image, run it with `python -m bench.fat_decoding'
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition
+from stream.img_stream import ImageStream
+
+
+def file_sizes(number_of_files, seed=0):
+    """mostly small files, some medium ones and a few large ones"""
+    rnd = random.Random(seed)
+    for _ in range(number_of_files):
+        r = rnd.random()
+        if r < .7:
+            count = rnd.randint(1, 4)
+        elif r < .95:
+            count = rnd.randint(5, 64)
+        else:
+            count = rnd.randint(65, 2048)
+        yield count, rnd.choice((1, 1, 1, 1, 2, 3, 8))
+
+
+def build_image(path, number_of_files, seed=0):
+    chains = list(file_sizes(number_of_files, seed))
+    # every fragment leaves a free cluster behind, plus 10% free space
+    used = sum(count + fragments for count, fragments in chains)
+    image = SyntheticFAT32(used + used // 10)
+    for count, fragments in chains:
+        image.add_chain(count, fragments)
+    return image.write(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number-of-files', type=int, default=200000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    try:
+        build_image(path, args.number_of_files)
+
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+
+            results = {}
+            for bulk in (False, True):
+                stream.seek(partition.fat_abs_pos, os.SEEK_SET)
+                t = time.perf_counter()
+                results[bulk] = partition.get_fat(bulk=bulk)
+                results[bulk, 'time'] = time.perf_counter() - t
+
+        assert results[False] == results[True]
+        print('entries: %d, chains: %d, EOCs: %d' % (
+            partition.bytes_per_fat // 4, len(results[True][0]),
+            results[True][1]))
+        print('per entry: %0.3fs, bulk: %0.3fs, speedup: %0.1fx' % (
+            results[False, 'time'], results[True, 'time'],
+            results[False, 'time'] / results[True, 'time']))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
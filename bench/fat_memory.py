@@ -0,0 +1,75 @@
+# encoding: utf-8
+"""
+compares the memory held by the dict of cluster lists and by the compact
+`FileAllocationTable' on a synthetic FAT, run it with
+`python -m bench.fat_memory'
+"""
+import argparse
+import random
+import sys
+import time
+
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32.fat import decode_fat_table, build_cluster_chains, \
+    FileAllocationTable
+
+
+def build_fat(number_of_files, seed=0):
+    rnd = random.Random(seed)
+    chains = [(rnd.randint(1, 8), rnd.choice((1, 1, 1, 2, 3)))
+              for _ in range(number_of_files)]
+    used = sum(count + fragments for count, fragments in chains)
+    image = SyntheticFAT32(used + used // 10)
+    for count, fragments in chains:
+        image.add_chain(count, fragments)
+    return image.build()
+
+
+def sizeof_chains(chains):
+    """bytes held by the dict, its lists and the ints inside them"""
+    size = sys.getsizeof(chains)
+    seen = set()
+    for head, cluster_list in chains.items():
+        size += sys.getsizeof(head) + sys.getsizeof(cluster_list)
+        for segment in cluster_list:
+            size += sys.getsizeof(segment)
+            for c in segment:
+                # count every int object once, small ints are shared
+                if id(c) not in seen:
+                    seen.add(id(c))
+                    size += sys.getsizeof(c)
+    return size
+
+
+def measure(build, raw):
+    t = time.perf_counter()
+    obj = build(decode_fat_table(raw))
+    return obj, time.perf_counter() - t
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number-of-files', type=int, default=2000000)
+    args = parser.parse_args()
+
+    raw = build_fat(args.number_of_files)
+    print('FAT entries: %d, FAT size: %0.1f MiB' % (len(raw) // 4,
+                                                    len(raw) / 2 ** 20))
+
+    chains, dict_time = measure(
+        lambda table: build_cluster_chains(table)[0], raw)
+    dict_size = sizeof_chains(chains)
+    del chains
+
+    fat, fat_time = measure(FileAllocationTable, raw)
+    fat_size = fat.nbytes
+
+    print('dict of lists: %0.1f MiB in %0.2fs' % (dict_size / 2 ** 20,
+                                                  dict_time))
+    print('compact table: %0.1f MiB in %0.2fs' % (fat_size / 2 ** 20,
+                                                  fat_time))
+    print('ratio: %0.1f%%' % (fat_size * 100. / dict_size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# encoding: utf-8
+"""
+compares a full scan of a synthetic partition image with an incremental
+rescan after a few files changed, run it with `python -m bench.rescan'
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition
+from stream.img_stream import ImageStream
+
+
+def build_image(number_of_files, files_per_directory=100):
+    image = SyntheticFAT32(number_of_files * 3)
+    for i in range(number_of_files):
+        if i % files_per_directory == 0:
+            directory = '/D%d' % (i // files_per_directory)
+            image.add_directory(directory)
+        image.add_file('%s/F%d.TXT' % (directory, i), size=4096 * (i % 3 + 1))
+    return image
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number-of-files', type=int, default=200000)
+    parser.add_argument('-c', '--changes', type=int, default=20)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    try:
+        image = build_image(args.number_of_files)
+        image.write(path)
+
+        with ImageStream(path) as stream:
+            t = time.perf_counter()
+            partition = get_fat32_partition(stream)
+            partition.get_fdt()
+            full = time.perf_counter() - t
+
+            stream.seek(0, os.SEEK_SET)
+            _, snapshot = get_fat32_partition(stream, lazy=True).rescan()
+
+        step = args.number_of_files // args.changes
+        for i in range(0, args.number_of_files, step):
+            directory = '/D%d' % (i // 100)
+            image.remove('%s/F%d.TXT' % (directory, i))
+            image.add_file('%s/N%d.TXT' % (directory, i), size=8192)
+        image.write(path)
+
+        with ImageStream(path) as stream:
+            t = time.perf_counter()
+            partition = get_fat32_partition(stream, lazy=True)
+            changes, _ = partition.rescan(snapshot)
+            incremental = time.perf_counter() - t
+
+        print('files: %d, %r' % (len(snapshot.files), changes))
+        print('decoded %d of %d directories, %d FAT blocks' % (
+            changes.directories_decoded, len(snapshot.directories),
+            changes.fat_blocks_changed))
+        print('full scan: %0.3fs, rescan: %0.3fs, speedup: %0.1fx' % (
+            full, incremental, full / incremental))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
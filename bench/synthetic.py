@@ -0,0 +1,842 @@
+# encoding: utf-8
+from array import array
+from datetime import datetime
+import os
+from struct import Struct, pack
+import sys
+import tempfile
+import uuid
+import zlib
+
+__all__ = ['SyntheticFAT32', 'SyntheticNTFS', 'SyntheticDisk']
+
+_dos_entry = Struct('<8s3sBBBHHHHHHHI')
+_lfn_entry = Struct('<B10sBBB12sH4s')
+
+_EOC = 0x0fffffff
+
+
+def _fat_date(t):
+    return (t.year - 1980) << 9 | t.month << 5 | t.day
+
+
+def _fat_time(t):
+    return t.hour << 11 | t.minute << 5 | t.second // 2
+
+
+def _short_name_checksum(short_name):
+    sum_ = 0
+    for c in short_name:
+        sum_ = (((sum_ & 1) << 7) + (sum_ >> 1) + c) & 0xff
+    return sum_
+
+
+class _Node:
+
+    __slots__ = ['name', 'is_directory', 'data', 'size', 'fragments',
+                 'deleted', 'time', 'children', 'clusters']
+
+    def __init__(self, name, is_directory, data=b'', size=0, fragments=1,
+                 deleted=False, time=None):
+        self.name = name
+        self.is_directory = is_directory
+        self.data = data
+        self.size = size or len(data)
+        self.fragments = fragments
+        self.deleted = deleted
+        self.time = time or datetime(2014, 4, 1, 12, 30, 20)
+        self.children = []
+        self.clusters = []
+
+
+class SyntheticFAT32:
+
+    """
+    builds FAT32 partition images for tests and benchmarks
+
+    directories and files are added by path, clusters are handed out in the
+    order things are added, and fragmented files leave one free cluster
+    between fragments. data clusters which have no content are left as holes
+    so that images with millions of clusters stay sparse on disk
+    """
+
+    BYTES_PER_SECTOR = 512
+    RESERVED_SECTORS = 32
+
+    def __init__(self, number_of_clusters, sectors_per_cluster=8):
+        self.sectors_per_cluster = sectors_per_cluster
+        self.bytes_per_cluster = self.BYTES_PER_SECTOR * sectors_per_cluster
+
+        self.table = array('I', bytes(4 * (number_of_clusters + 2)))
+        self.table[0] = 0x0ffffff8
+        self.table[1] = 0x0fffffff
+        self._next_free = 2
+
+        self.root = _Node('/', True)
+        self._nodes = {'/': self.root}
+        self._chains = []
+
+    @property
+    def sectors_per_fat(self):
+        return -(-len(self.table) * 4 // self.BYTES_PER_SECTOR)
+
+    @property
+    def bytes_per_fat(self):
+        return self.sectors_per_fat * self.BYTES_PER_SECTOR
+
+    @property
+    def data_section_offset(self):
+        return (self.RESERVED_SECTORS * self.BYTES_PER_SECTOR +
+                2 * self.bytes_per_fat)
+
+    def abs_c2b(self, cluster):
+        return (self.data_section_offset +
+                (cluster - 2) * self.bytes_per_cluster)
+
+    def allocate(self, count, fragments=1):
+        """allocate a cluster chain and link it in the FAT"""
+        count = max(count, 1)
+        fragments = max(min(fragments, count), 1)
+        per_fragment = -(-count // fragments)
+
+        clusters = []
+        while len(clusters) < count:
+            if clusters:
+                # leave a gap so that the next fragment is not contiguous
+                self._next_free += 1
+            n = min(per_fragment, count - len(clusters))
+            clusters.extend(range(self._next_free, self._next_free + n))
+            self._next_free += n
+
+        if self._next_free > len(self.table):
+            raise ValueError('synthetic volume is full')
+
+        for c, next_c in zip(clusters, clusters[1:]):
+            self.table[c] = next_c
+        self.table[clusters[-1]] = _EOC
+
+        return clusters
+
+    def add_chain(self, count, fragments=1):
+        """
+        add a chain which is not referenced by any directory, it is allocated
+        after the directory tree when the image is built
+        """
+        self._chains.append((count, fragments))
+
+    def _add(self, path, node):
+        parent_path, _, name = path.rstrip('/').rpartition('/')
+        parent = self._nodes[parent_path or '/']
+        node.name = name
+        parent.children.append(node)
+        if not node.deleted:
+            self._nodes[path.rstrip('/')] = node
+        return node
+
+    def add_directory(self, path, time=None):
+        return self._add(path, _Node(path, True, time=time))
+
+    def add_file(self, path, data=b'', size=0, fragments=1, deleted=False,
+                 time=None):
+        return self._add(path, _Node(path, False, data=data, size=size,
+                                     fragments=fragments, deleted=deleted,
+                                     time=time))
+
+    def _walk(self, node):
+        yield node
+        for child in node.children:
+            if not child.deleted:
+                for n in self._walk(child):
+                    yield n
+
+    def remove(self, path):
+        """delete a file or directory, its entry is kept marked as deleted and
+        its clusters are freed"""
+        node = self._nodes[path]
+        for n in list(self._walk(node)):
+            for c in n.clusters:
+                self.table[c] = 0
+        node.deleted = True
+        for p in [p for p in self._nodes
+                  if p == path or p.startswith(path + '/')]:
+            del self._nodes[p]
+
+    def move(self, path, new_path):
+        """move a file or directory keeping its clusters"""
+        node = self._nodes[path]
+        parent_path = path.rpartition('/')[0] or '/'
+        self._nodes[parent_path].children.remove(node)
+        for p in [p for p in self._nodes
+                  if p == path or p.startswith(path + '/')]:
+            self._nodes[new_path + p[len(path):]] = self._nodes.pop(p)
+        new_parent_path, _, node.name = new_path.rpartition('/')
+        self._nodes[new_parent_path or '/'].children.append(node)
+
+    def _allocate_tree(self, node):
+        if node.clusters:
+            # allocated by an earlier build, only what was added since is
+            for child in node.children:
+                self._allocate_tree(child)
+        elif node.is_directory:
+            # "." and ".." plus one terminating blank entry
+            number_of_entries = 3 if node is not self.root else 1
+            for child in node.children:
+                number_of_entries += 1 + len(self._lfn_parts(
+                    child.name, child.is_directory))
+            node.clusters = self.allocate(
+                -(-number_of_entries * 32 // self.bytes_per_cluster))
+            for child in node.children:
+                self._allocate_tree(child)
+        else:
+            node.clusters = self.allocate(
+                -(-node.size // self.bytes_per_cluster), node.fragments)
+            if node.deleted:
+                # deleted files leave their clusters free in the FAT
+                for c in node.clusters:
+                    self.table[c] = 0
+
+    @staticmethod
+    def _needs_lfn(name, is_directory):
+        base, dot, ext = name.partition('.')
+        return not (name.isascii() and name == name.upper() and
+                    ' ' not in name and 0 < len(base) <= 8 and
+                    len(ext) <= 3 and '.' not in ext and
+                    not (is_directory and dot))
+
+    @classmethod
+    def _short_name(cls, name, is_directory, index):
+        base, _, ext = name.partition('.')
+        if not cls._needs_lfn(name, is_directory):
+            return (base.ljust(8).encode('ascii'),
+                    ext.ljust(3).encode('ascii'))
+
+        def _clean(s):
+            return ''.join(c for c in s.upper() if c.isascii() and c.isalnum())
+
+        ext = '' if is_directory else _clean(name.rpartition('.')[2]
+                                             if '.' in name else '')
+        alias = '%s~%d' % (_clean(base)[:6] or 'FILE', index)
+        return (alias[:8].ljust(8).encode('ascii'),
+                ext[:3].ljust(3).encode('ascii'))
+
+    @classmethod
+    def _lfn_parts(cls, name, is_directory):
+        if not cls._needs_lfn(name, is_directory):
+            return []
+
+        units = name.encode('utf-16-le')
+        if len(units) % 26:
+            # NUL terminated and padded with 0xffff
+            units += b'\x00\x00'
+            units += b'\xff\xff' * ((26 - len(units) % 26) % 26 // 2)
+
+        return [units[i:i + 26] for i in range(0, len(units), 26)]
+
+    def _dir_entries(self, node, parent):
+        entries = []
+        if node is not self.root:
+            for name, target in ((b'.       ', node),
+                                 (b'..      ', parent)):
+                cluster = 0 if target is self.root else target.clusters[0]
+                entries.append(self._dos_entry(name, b'   ', 0x10, node.time,
+                                               cluster, 0))
+
+        for index, child in enumerate(node.children, 1):
+            short_name, short_ext = self._short_name(child.name,
+                                                     child.is_directory,
+                                                     index)
+            checksum = _short_name_checksum(short_name + short_ext)
+            parts = self._lfn_parts(child.name, child.is_directory)
+            for seq in range(len(parts), 0, -1):
+                part = parts[seq - 1]
+                seq_number = seq | (0x40 if seq == len(parts) else 0)
+                if child.deleted:
+                    seq_number = 0xe5
+                entries.append(_lfn_entry.pack(seq_number, part[:10], 0xf,
+                                               0, checksum, part[10:22], 0,
+                                               part[22:26]))
+            if child.deleted:
+                short_name = b'\xe5' + short_name[1:]
+            entries.append(self._dos_entry(short_name, short_ext,
+                                           0x10 if child.is_directory else
+                                           0x20,
+                                           child.time, child.clusters[0],
+                                           0 if child.is_directory else
+                                           child.size))
+
+        return entries
+
+    @staticmethod
+    def _dos_entry(name, ext, attribute, time, first_cluster, size):
+        return _dos_entry.pack(name, ext, attribute, 0, 0,
+                               _fat_time(time), _fat_date(time),
+                               _fat_date(time), first_cluster >> 16,
+                               _fat_time(time), _fat_date(time),
+                               first_cluster & 0xffff, size)
+
+    def _write_tree(self, f, node, parent):
+        if node.is_directory:
+            self._write_clusters(f, node.clusters,
+                                 b''.join(self._dir_entries(node, parent)))
+            for child in node.children:
+                self._write_tree(f, child, node)
+        elif node.data:
+            self._write_clusters(f, node.clusters, node.data)
+
+    def _write_clusters(self, f, clusters, data):
+        size = self.bytes_per_cluster
+        for i, c in enumerate(clusters):
+            chunk = data[i * size:(i + 1) * size]
+            if not chunk:
+                break
+            f.seek(self.abs_c2b(c))
+            f.write(chunk)
+
+    def boot_sector(self):
+        total_sectors = (self.data_section_offset // self.BYTES_PER_SECTOR +
+                         (len(self.table) - 2) * self.sectors_per_cluster)
+        sector = bytearray(self.BYTES_PER_SECTOR)
+        sector[0:3] = b'\xeb\x58\x90'
+        sector[3:11] = b'MSWIN4.1'
+        sector[11:36] = pack('<HBHBHHBHHHII', self.BYTES_PER_SECTOR,
+                             self.sectors_per_cluster, self.RESERVED_SECTORS,
+                             2, 0, 0, 0xf8, 0, 63, 255, 0, total_sectors)
+        sector[36:64] = pack('<IHHIHH12x', self.sectors_per_fat, 0, 0, 2, 1, 6)
+        sector[64:90] = pack('<BBBI11s8s', 0x80, 0, 0x29, 0x12345678,
+                             b'SYNTHETIC  ', b'FAT32   ')
+        sector[510:512] = b'\x55\xaa'
+        return bytes(sector)
+
+    def fs_info_sector(self):
+        sector = bytearray(self.BYTES_PER_SECTOR)
+        sector[0:4] = b'\x52\x52\x61\x41'
+        sector[484:488] = b'\x72\x72\x41\x61'
+        sector[488:496] = pack('<II', 0xffffffff, 0xffffffff)
+        sector[510:512] = b'\x55\xaa'
+        return bytes(sector)
+
+    def build(self):
+        """
+        allocate clusters for the directory tree, returns the FAT bytes,
+        the image may be changed and built again, files and directories added
+        since are allocated after everything else
+        """
+        if not self.root.clusters:
+            # the root directory has to start at cluster 2
+            self._allocate_tree(self.root)
+            for count, fragments in self._chains:
+                self.allocate(count, fragments)
+        else:
+            self._allocate_tree(self.root)
+
+        table = array('I', self.table)
+        if sys.byteorder == 'big':
+            table.byteswap()
+        raw = table.tobytes()
+        return raw + bytes(self.bytes_per_fat - len(raw))
+
+    def write(self, path):
+        """write the partition image to `path'"""
+        fat = self.build()
+        with open(path, 'wb') as f:
+            f.write(self.boot_sector())
+            f.write(self.fs_info_sector())
+            f.seek(self.RESERVED_SECTORS * self.BYTES_PER_SECTOR)
+            f.write(fat)
+            f.write(fat)
+            self._write_tree(f, self.root, self.root)
+            f.truncate(self.abs_c2b(len(self.table)))
+
+        return path
+
+
+_FILETIME_EPOCH = 116444736000000000
+
+_record_header = Struct('<4sHHQHHHHIIQH2xI')
+_attribute_header = Struct('<IIBBHHH')
+
+
+def _filetime(t):
+    return int((t - datetime(1970, 1, 1)).total_seconds() * 10 ** 7) + \
+        _FILETIME_EPOCH
+
+
+def _count(extent):
+    """clusters of an extent, `(None, count)' is a sparse run"""
+    start, end = extent
+    return end if start is None else end - start + 1
+
+
+def _runlist(extents):
+    """data runs of the extents `[(start, end), ...]'"""
+    runs = b''
+    lcn = 0
+    for start, end in extents:
+        length = _count((start, end)).to_bytes(8, 'little').rstrip(b'\x00')
+        if start is None:
+            runs += bytes([len(length)]) + length
+            continue
+        offset = start - lcn
+        offset = offset.to_bytes((offset.bit_length() + 8) // 8 or 1,
+                                 'little', signed=True)
+        runs += bytes([len(offset) << 4 | len(length)]) + length + offset
+        lcn = start
+    return runs + b'\x00'
+
+
+def _pad8(data):
+    return data + bytes(-len(data) % 8)
+
+
+class _NTFSNode:
+
+    __slots__ = ['record_number', 'name', 'is_directory', 'data',
+                 'fragments', 'deleted', 'split', 'sparse', 'time', 'parent',
+                 'children', 'clusters', 'extension']
+
+    def __init__(self, record_number, name, is_directory, parent, data=b'',
+                 fragments=1, deleted=False, split=False, sparse=False,
+                 time=None):
+        self.record_number = record_number
+        self.name = name
+        self.is_directory = is_directory
+        self.parent = parent
+        self.data = data
+        self.fragments = fragments
+        self.deleted = deleted
+        self.split = split
+        self.sparse = sparse
+        self.time = time or datetime(2014, 4, 1, 12, 30, 20)
+        self.children = []
+        # extents of $DATA, or of the index allocation of a directory
+        self.clusters = []
+        # record number of the extension record holding part of $DATA
+        self.extension = None
+
+
+class SyntheticNTFS:
+
+    """
+    builds NTFS partition images for tests and benchmarks
+
+    only the parts of the $MFT which describe the directory tree are written:
+    $MFT itself, the root directory and the records of what is added, names
+    which are not upper case get a DOS name before their Win32 name. index
+    allocations of directories are allocated but left empty
+    """
+
+    BYTES_PER_SECTOR = 512
+    SECTORS_PER_CLUSTER = 8
+    BYTES_PER_RECORD = 1024
+    MFT_CLUSTER = 4
+    # largest content kept resident in its record
+    MAX_RESIDENT_SIZE = 600
+
+    def __init__(self, number_of_clusters, number_of_records=64,
+                 mft_fragments=1, mft_extension=False):
+        """
+        mft_fragments: number of extents of the $MFT
+        mft_extension: keep the extents of the $MFT after the first one in an
+        extension record of record 0
+        """
+        self.number_of_clusters = number_of_clusters
+        self.bytes_per_cluster = self.BYTES_PER_SECTOR * \
+                                 self.SECTORS_PER_CLUSTER
+        self.number_of_records = number_of_records
+        self.mft_extension = mft_extension
+
+        self._next_free = self.MFT_CLUSTER
+        self.mft_clusters = self.allocate(
+            number_of_records * self.BYTES_PER_RECORD //
+            self.bytes_per_cluster, mft_fragments)
+
+        self.root = _NTFSNode(5, '.', True, None)
+        self.root.parent = self.root
+        self.root.clusters = self.allocate(1)
+        self._nodes = {'/': self.root}
+        self._next_record = 16
+
+    def allocate(self, count, fragments=1):
+        """extents of `count' clusters, with a gap between fragments"""
+        count = max(count, 1)
+        fragments = max(min(fragments, count), 1)
+        per_fragment = -(-count // fragments)
+
+        extents = []
+        left = count
+        while left:
+            if extents:
+                self._next_free += 1
+            n = min(per_fragment, left)
+            extents.append((self._next_free, self._next_free + n - 1))
+            self._next_free += n
+            left -= n
+
+        if self._next_free > self.number_of_clusters:
+            raise ValueError('synthetic volume is full')
+        return extents
+
+    def _new_record(self):
+        record_number = self._next_record
+        self._next_record += 1
+        if record_number >= self.number_of_records:
+            raise ValueError('synthetic $MFT is full')
+        return record_number
+
+    def _add(self, path, is_directory, **kwargs):
+        parent_path, _, name = path.rstrip('/').rpartition('/')
+        parent = self._nodes[parent_path or '/']
+        node = _NTFSNode(self._new_record(), name, is_directory, parent,
+                         **kwargs)
+        parent.children.append(node)
+        self._nodes[path.rstrip('/')] = node
+
+        if is_directory:
+            node.clusters = self.allocate(1)
+        elif len(node.data) > self.MAX_RESIDENT_SIZE and node.sparse:
+            node.clusters = self._allocate_sparse(node.data)
+        elif len(node.data) > self.MAX_RESIDENT_SIZE:
+            node.clusters = self.allocate(
+                -(-len(node.data) // self.bytes_per_cluster), node.fragments)
+            if node.split and len(node.clusters) > 1:
+                node.extension = self._new_record()
+        return node
+
+    def _allocate_sparse(self, data):
+        """extents of `data' where clusters of zeros are sparse runs"""
+        extents = []
+        for i in range(0, len(data), self.bytes_per_cluster):
+            if data[i:i + self.bytes_per_cluster].strip(b'\x00'):
+                extent = self.allocate(1)[0]
+            else:
+                extent = None, 1
+            if not extents:
+                extents.append(extent)
+                continue
+            start, end = extents[-1]
+            if extent[0] is None and start is None:
+                extents[-1] = None, end + 1
+            elif extent[0] is not None and start is not None and \
+                    end + 1 == extent[0]:
+                extents[-1] = start, extent[1]
+            else:
+                extents.append(extent)
+        return extents
+
+    def add_directory(self, path, time=None):
+        return self._add(path, True, time=time)
+
+    def add_file(self, path, data=b'', fragments=1, deleted=False,
+                 split=False, sparse=False, time=None):
+        """
+        split: keep the extents of $DATA after the first one in an extension
+        record
+        sparse: leave out the clusters of zeros as sparse runs, `fragments' is
+        ignored
+        """
+        return self._add(path, False, data=data, fragments=fragments,
+                         deleted=deleted, split=split, sparse=sparse,
+                         time=time)
+
+    def abs_c2b(self, cluster):
+        return cluster * self.bytes_per_cluster
+
+    def boot_sector(self):
+        sector = bytearray(self.BYTES_PER_SECTOR)
+        sector[0:3] = b'\xeb\x52\x90'
+        sector[3:11] = b'NTFS    '
+        sector[11:14] = pack('<HB', self.BYTES_PER_SECTOR,
+                             self.SECTORS_PER_CLUSTER)
+        sector[21] = 0xf8
+        sector[24:28] = pack('<HH', 63, 255)
+        sector[40:80] = pack('<QQQb3xb3xQ', self.number_of_clusters *
+                             self.SECTORS_PER_CLUSTER - 1,
+                             self.MFT_CLUSTER, 2,
+                             -(self.BYTES_PER_RECORD.bit_length() - 1), 1,
+                             0x123456789abcdef0)
+        sector[510:512] = b'\x55\xaa'
+        return bytes(sector)
+
+    @staticmethod
+    def _resident(type_, value):
+        return _attribute_header.pack(type_, 24 + len(_pad8(value)), 0, 0,
+                                      0, 0, 0) + \
+            pack('<IH2x', len(value), 24) + _pad8(value)
+
+    @staticmethod
+    def _non_resident(type_, extents, first_vcn, size, name=''):
+        name = name.encode('utf-16-le')
+        runs_offset = 64 + len(_pad8(name))
+        last_vcn = first_vcn + sum(map(_count, extents)) - 1
+        body = pack('<QQHH4xQQQ', first_vcn, last_vcn, runs_offset, 0,
+                    size, size, size) + _pad8(name) + _pad8(_runlist(extents))
+        return _attribute_header.pack(type_, 16 + len(body), 1,
+                                      len(name) // 2, 64, 0, 0) + body
+
+    @staticmethod
+    def _file_name(parent, name, namespace, time):
+        encoded = name.encode('utf-16-le')
+        return pack('<QQQQQQQIIBB', parent.record_number | 1 << 48,
+                    _filetime(time), _filetime(time), _filetime(time),
+                    _filetime(time), 0, 0, 0, 0, len(encoded) // 2,
+                    namespace) + encoded
+
+    def _record(self, record_number, attributes, flags, base_record=None):
+        body = b''.join(attributes) + pack('<II', 0xffffffff, 0)
+        bytes_in_use = 56 + len(body)
+        record = bytearray(self.BYTES_PER_RECORD)
+        record[:48] = _record_header.pack(
+            b'FILE', 48, self.BYTES_PER_RECORD // 512 + 1, 0, 1, 1, 56,
+            flags, bytes_in_use, self.BYTES_PER_RECORD,
+            0 if base_record is None else base_record | 1 << 48, 8,
+            record_number)
+        record[56:bytes_in_use] = body
+
+        # protect the end of every sector with the update sequence number
+        usn = b'\x01\x00'
+        record[48:50] = usn
+        for i in range(1, self.BYTES_PER_RECORD // 512 + 1):
+            end = i * 512 - 2
+            record[48 + 2 * i:50 + 2 * i] = record[end:end + 2]
+            record[end:end + 2] = usn
+        return bytes(record)
+
+    def _node_records(self, node):
+        time = node.time
+        attributes = [self._resident(0x10, pack('<QQQQ16x', _filetime(time),
+                                                _filetime(time),
+                                                _filetime(time),
+                                                _filetime(time)))]
+        if node is not self.root and node.name != node.name.upper():
+            dos_name = (node.name.upper().replace(' ', '')[:6] + '~1')
+            attributes.append(self._resident(
+                0x30, self._file_name(node.parent, dos_name, 2, time)))
+        attributes.append(self._resident(
+            0x30, self._file_name(node.parent, node.name,
+                                  1 if node is not self.root else 3, time)))
+
+        records = []
+        if node.is_directory:
+            attributes.append(self._non_resident(
+                0xa0, node.clusters, 0, self.bytes_per_cluster, '$I30'))
+        elif not node.clusters:
+            attributes.append(self._resident(0x80, node.data))
+        elif node.extension is None:
+            attributes.append(self._non_resident(0x80, node.clusters, 0,
+                                                 len(node.data)))
+        else:
+            first, rest = node.clusters[:1], node.clusters[1:]
+            attributes.append(self._non_resident(0x80, first, 0,
+                                                 len(node.data)))
+            first_vcn = first[0][1] - first[0][0] + 1
+            records.append((node.extension, self._record(
+                node.extension, [self._non_resident(0x80, rest, first_vcn,
+                                                    0)],
+                0x1, node.record_number)))
+
+        flags = (0 if node.deleted else 0x1) | (0x2 if node.is_directory
+                                                else 0)
+        records.append((node.record_number,
+                        self._record(node.record_number, attributes, flags)))
+        return records
+
+    def _mft_records(self):
+        time = datetime(2014, 4, 1, 12, 30, 20)
+        size = self.number_of_records * self.BYTES_PER_RECORD
+        attributes = [self._resident(0x30, self._file_name(self.root, '$MFT',
+                                                           3, time))]
+        if not self.mft_extension or len(self.mft_clusters) == 1:
+            attributes.append(self._non_resident(0x80, self.mft_clusters, 0,
+                                                 size))
+            return [(0, self._record(0, attributes, 0x1))]
+
+        first, rest = self.mft_clusters[:1], self.mft_clusters[1:]
+        attributes.append(self._non_resident(0x80, first, 0, size))
+        first_vcn = first[0][1] - first[0][0] + 1
+        return [(0, self._record(0, attributes, 0x1)),
+                (1, self._record(1, [self._non_resident(0x80, rest,
+                                                        first_vcn, 0)],
+                                 0x1, 0))]
+
+    def _record_address(self, record_number):
+        vcn, offset = divmod(record_number * self.BYTES_PER_RECORD,
+                             self.bytes_per_cluster)
+        for start, end in self.mft_clusters:
+            if vcn <= end - start:
+                return self.abs_c2b(start + vcn) + offset
+            vcn -= end - start + 1
+
+    def write(self, path):
+        """write the partition image to `path'"""
+        records = self._mft_records()
+        for node in self._nodes.values():
+            records.extend(self._node_records(node))
+
+        with open(path, 'wb') as f:
+            f.write(self.boot_sector())
+            for record_number, record in records:
+                f.seek(self._record_address(record_number))
+                f.write(record)
+            for node in self._nodes.values():
+                if node.is_directory or not node.clusters:
+                    continue
+                pos = 0
+                for start, end in node.clusters:
+                    size = _count((start, end)) * self.bytes_per_cluster
+                    if start is not None:
+                        f.seek(self.abs_c2b(start))
+                        f.write(node.data[pos:pos + size])
+                    pos += size
+            f.truncate(self.abs_c2b(self.number_of_clusters))
+
+        return path
+
+
+class SyntheticDisk:
+
+    """
+    builds disk images from synthetic partitions, primary partitions go into
+    the MBR and logical partitions into a chain of EBRs in an extended
+    partition after them, or all partitions go into a GPT behind a
+    protective MBR
+    """
+
+    BYTES_PER_SECTOR = 512
+    # partitions and EBRs start at multiples of this many sectors
+    ALIGNMENT = 8
+    GPT_ENTRIES = 128
+    GPT_ENTRY_SIZE = 128
+
+    def __init__(self, gpt=False):
+        self.gpt = gpt
+        self.primary = []
+        self.logical = []
+        # sectors of the EBRs, known once the image is written
+        self.ebr_sectors = []
+
+    def add_partition(self, image, type_, name=''):
+        """
+        add `image', a synthetic partition, with the MBR type `type_', or
+        the type GUID `type_' and `name' for a GPT
+        """
+        self.primary.append((image, type_, name))
+
+    def add_logical_partition(self, image, type_):
+        if self.gpt:
+            raise ValueError('a GPT has no logical partitions')
+        self.logical.append((image, type_))
+
+    def _align(self, sector):
+        return -(-sector // self.ALIGNMENT) * self.ALIGNMENT
+
+    @staticmethod
+    def _entry(type_, first_sector, number_of_sectors):
+        return pack('<B3sB3sII', 0, b'\xfe\xff\xff', type_, b'\xfe\xff\xff',
+                    first_sector, number_of_sectors)
+
+    def _table(self, entries):
+        sector = bytearray(self.BYTES_PER_SECTOR)
+        for i, entry in enumerate(entries):
+            sector[0x1be + 16 * i:0x1be + 16 * (i + 1)] = entry
+        sector[510:512] = b'\x55\xaa'
+        return bytes(sector)
+
+    def write(self, path):
+        """write the disk image to `path'"""
+        if self.gpt:
+            return self._write_gpt(path)
+
+        fd, tmp = tempfile.mkstemp(suffix='.img')
+        os.close(fd)
+        try:
+            with open(path, 'wb') as f:
+                entries = []
+                sector = self.ALIGNMENT
+                for image, type_, _ in self.primary:
+                    size = self._write_partition(f, image, tmp, sector)
+                    entries.append(self._entry(type_, sector, size))
+                    sector = self._align(sector + size)
+
+                if self.logical:
+                    extended_start = sector
+                    ebrs = []
+                    for image, type_ in self.logical:
+                        ebr = sector
+                        start = ebr + self.ALIGNMENT
+                        size = self._write_partition(f, image, tmp, start)
+                        ebrs.append((ebr, type_, start - ebr, size))
+                        sector = self._align(start + size)
+                    entries.append(self._entry(0x0f, extended_start,
+                                               sector - extended_start))
+
+                    self.ebr_sectors = [ebr for ebr, _, _, _ in ebrs]
+                    for i, (ebr, type_, offset, size) in enumerate(ebrs):
+                        links = [self._entry(type_, offset, size)]
+                        if i + 1 < len(ebrs):
+                            next_ebr = ebrs[i + 1][0]
+                            links.append(self._entry(
+                                0x05, next_ebr - extended_start,
+                                ebrs[i + 1][2] + ebrs[i + 1][3]))
+                        f.seek(ebr * self.BYTES_PER_SECTOR)
+                        f.write(self._table(links))
+
+                f.seek(0)
+                f.write(self._table(entries))
+                f.truncate(sector * self.BYTES_PER_SECTOR)
+        finally:
+            os.remove(tmp)
+
+        return path
+
+    def _gpt_header(self, lba, backup_lba, entries_lba, last_usable_lba,
+                    entries_crc):
+        header = bytearray(pack(
+            '<8sIIIIQQQQ16sQIII', b'EFI PART', 0x10000, 92, 0, 0, lba,
+            backup_lba, 34, last_usable_lba,
+            uuid.UUID('6d2c1f0a-3a4b-4c5d-8e9f-0a1b2c3d4e5f').bytes_le,
+            entries_lba, self.GPT_ENTRIES, self.GPT_ENTRY_SIZE, entries_crc))
+        header[16:20] = pack('<I', zlib.crc32(header) & 0xffffffff)
+        return bytes(header) + bytes(self.BYTES_PER_SECTOR - len(header))
+
+    def _write_gpt(self, path):
+        table_sectors = self.GPT_ENTRIES * self.GPT_ENTRY_SIZE // \
+                        self.BYTES_PER_SECTOR
+        fd, tmp = tempfile.mkstemp(suffix='.img')
+        os.close(fd)
+        try:
+            with open(path, 'wb') as f:
+                entries = bytearray(self.GPT_ENTRIES * self.GPT_ENTRY_SIZE)
+                sector = self._align(2 + table_sectors)
+                for i, (image, type_, name) in enumerate(self.primary):
+                    size = self._write_partition(f, image, tmp, sector)
+                    entries[i * self.GPT_ENTRY_SIZE:
+                            (i + 1) * self.GPT_ENTRY_SIZE] = pack(
+                        '<16s16sQQQ72s', type_.bytes_le,
+                        uuid.UUID(int=i + 1).bytes_le, sector,
+                        sector + size - 1, 0, name.encode('utf-16-le'))
+                    sector = self._align(sector + size)
+
+                last_lba = sector + table_sectors
+                entries_crc = zlib.crc32(entries) & 0xffffffff
+
+                f.seek(0)
+                f.write(self._table([self._entry(0xee, 1, last_lba)]))
+                f.write(self._gpt_header(1, last_lba, 2, sector - 1,
+                                         entries_crc))
+                f.write(entries)
+                f.seek(sector * self.BYTES_PER_SECTOR)
+                f.write(entries)
+                f.write(self._gpt_header(last_lba, 1, sector, sector - 1,
+                                         entries_crc))
+        finally:
+            os.remove(tmp)
+
+        return path
+
+    def _write_partition(self, f, image, tmp, sector):
+        """copy `image' to `sector', returns its size in sectors"""
+        image.write(tmp)
+        f.seek(sector * self.BYTES_PER_SECTOR)
+        with open(tmp, 'rb') as partition:
+            size = f.write(partition.read())
+        return -(-size // self.BYTES_PER_SECTOR)
@@ -1,4 +1,4 @@
 # encoding: utf-8
 import web
 
-web.httpd.serve_forever()
+web.serve_forever()
@@ -1,36 +1,74 @@
 # encoding: utf-8
 
+import logging
 from drive.fs.fat32 import get_fat32_obj
+from drive.fs.ntfs import get_ntfs_obj
 from drive.keys import *
-from drive.mbr import ClassicalMBR
+from drive.partition_table import read_partition_table
+import os
 from stream import ImageStream
 
+logger = logging.getLogger('disk')
 
-def get_ntfs_obj(entry, stream):
-    pass
 
+def get_basic_data_partition_obj(entry, stream, **kwargs):
+    """
+    GPT basic data partitions may hold either file system, which one is told
+    by the boot sector
+    """
+    stream.seek(entry[k_first_byte_address], os.SEEK_SET)
+    boot_sector = stream.read(512)
 
-def get_extended_partition_obj(entry, stream):
-    pass
+    if boot_sector[3:11] == b'NTFS    ':
+        return get_ntfs_obj(entry, stream, **kwargs)
+    if boot_sector[82:90] == b'FAT32   ':
+        return get_fat32_obj(entry, stream, **kwargs)
+    return None
 
 
-def get_drive_obj(stream):
-    mbr = ClassicalMBR.parse_stream(stream)
+def _ignore(*_, **__):
+    return None
 
-    def get_partition_obj(partition_entry, stream):
-        partition_generator = {
-            k_FAT32: get_fat32_obj,
-            k_NTFS:  get_ntfs_obj,
-            k_ExtendedPartition: get_extended_partition_obj,
-            k_ignored: lambda _, __: None
-        }[partition_entry[k_partition_type]]
 
-        return partition_generator(partition_entry, stream)
+def _get_partition_obj(entry, stream, **kwargs):
+    # e.g. an extended partition nested in an EBR or a protective entry
+    partition_generator = {
+        k_FAT32: get_fat32_obj,
+        k_NTFS:  get_ntfs_obj,
+        k_BasicDataPartition: get_basic_data_partition_obj,
+    }.get(entry[k_partition_type], _ignore)
 
-    partitions = (get_partition_obj(entry, stream)
-                  for entry in mbr[k_PartitionEntries])
+    return partition_generator(entry, stream, **kwargs)
 
-    return partitions
+
+def get_drive_obj(stream, **kwargs):
+    """
+    yield the partition objects of the disk, None for unused entries and
+    unknown types, the logical partitions of an extended partition take its
+    place and are read lazily. if the MBR is a protective one the partitions
+    of the GPT are yielded instead, or those of the MBR if neither copy of the
+    GPT is intact
+
+    kwargs are passed on to the partition classes, e.g. `cache'
+    """
+    table = read_partition_table(stream)
+
+    if table.is_gpt:
+        try:
+            entries = table.gpt_entries(stream)
+        except ValueError as e:
+            logger.warning('%s, reading the partitions of the MBR', e)
+        else:
+            for entry in entries:
+                yield _get_partition_obj(entry, stream, **kwargs)
+            return
+
+    for entry in table.primary_entries:
+        if entry[k_partition_type] == k_ExtendedPartition:
+            for logical_entry in table.logical_entries(stream, entry):
+                yield _get_partition_obj(logical_entry, stream, **kwargs)
+        else:
+            yield _get_partition_obj(entry, stream, **kwargs)
 
 
 if __name__ == '__main__':
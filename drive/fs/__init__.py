@@ -1,5 +1,43 @@
 # encoding: utf-8
+import re
+
+
+def split_path(path):
+    """parts of `path' to compare paths by, case is ignored"""
+    return [part for part in re.split(r'[\\/]+', path.casefold()) if part]
+
+
+def fold_path(path):
+    """
+    `path' to compare paths by, with single slashes and case ignored, the
+    paths of `get_fdt' keep the case of their names
+    """
+    return '/' + '/'.join(split_path(path))
+
 
 class Partition:
     def __init__(self, type_):
         self.type = type_
+        self._fdt = {}
+        # `{folded path: path}' of the files of `fdt'
+        self._folded_files = None
+
+    @property
+    def fdt(self):
+        """`(files, directories)' of `get_fdt' once the tree has been read"""
+        return self._fdt
+
+    @fdt.setter
+    def fdt(self, fdt):
+        self._fdt = fdt
+        self._folded_files = None
+
+    def _find_in_fdt(self, path):
+        """entry of the file at `path' in `fdt' ignoring case, or None"""
+        if not self._fdt:
+            return None
+        files, _ = self._fdt
+        if self._folded_files is None:
+            self._folded_files = {fold_path(p): p for p in files}
+        full_path = self._folded_files.get(fold_path(path))
+        return None if full_path is None else files[full_path]
@@ -1,19 +1,22 @@
 # encoding: utf-8
+from drive.fs.fat32.cache import FAT32IndexCache
+from drive.fs.fat32.incremental import VolumeSnapshot
 from drive.fs.fat32.structs import FAT32
 from drive.keys import *
 import os
 
-__all__ = ['get_fat32_obj', 'get_fat32_partition']
+__all__ = ['get_fat32_obj', 'get_fat32_partition', 'FAT32IndexCache',
+           'VolumeSnapshot']
 
 
-def get_fat32_obj(entry, stream):
+def get_fat32_obj(entry, stream, **kwargs):
     first_byte_addr = entry[k_first_byte_address]
 
     stream.seek(first_byte_addr, os.SEEK_SET)
 
-    return FAT32(stream, preceding_bytes=first_byte_addr)
+    return FAT32(stream, preceding_bytes=first_byte_addr, **kwargs)
 
 
-def get_fat32_partition(stream):
+def get_fat32_partition(stream, **kwargs):
     """use this function if you have partition image"""
-    return FAT32(stream, preceding_bytes=0)
+    return FAT32(stream, preceding_bytes=0, **kwargs)
@@ -0,0 +1,244 @@
+# encoding: utf-8
+from array import array
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+
+__all__ = ['FAT32IndexCache']
+
+
+def _pack_uint32(values):
+    packed = array('I')
+    if packed.itemsize != 4:
+        packed = array('L')
+    packed.extend(values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_uint32(blob):
+    values = array('I')
+    if values.itemsize != 4:
+        values = array('L')
+    values.frombytes(blob)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _pack_cluster_list(cluster_list):
+    return _pack_uint32(c for extent in cluster_list for c in extent)
+
+
+def _unpack_cluster_list(blob):
+    values = _unpack_uint32(blob)
+    return [[values[i], values[i + 1]] for i in range(0, len(values), 2)] \
+        or ()
+
+
+def _directory_digest(partition, cluster_list):
+    """hash of the clusters of a directory"""
+    digest = hashlib.blake2b(digest_size=20)
+    for start, end in cluster_list:
+        digest.update(partition.stream.read_at(
+            partition.abs_c2b(start),
+            (end - start + 1) * partition.bytes_per_cluster))
+    return digest.digest()
+
+
+class FAT32IndexCache:
+
+    """
+    persistent index of decoded FATs and directory tables in a SQLite file
+
+    a volume is identified by the image path, size and modification time, the
+    offset of the partition, and a hash of its boot sector and FAT, so any
+    change to the image misses the cache and the volume is scanned again. the
+    FAT is read and hashed on every open, a hit only saves indexing it and
+    walking the directory tree
+
+    a drive keeps its modification time, and renaming a file leaves the FAT
+    as it is, so the directories of a volume on a drive are stored with a
+    hash of their clusters and the directory table is only loaded if they
+    still hash the same. checking reads every directory again, which saves
+    decoding them but not reading them
+
+    verify: whether to check the directories, by default only for volumes
+    which are not on an image file
+    """
+
+    VERSION = 5
+
+    def __init__(self, path, verify=None):
+        self.path = path
+        self.verify = verify
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._setup()
+
+    def _setup(self):
+        with self._lock, self._db:
+            version, = self._db.execute('PRAGMA user_version').fetchone()
+            if version != self.VERSION:
+                self._db.execute('DROP TABLE IF EXISTS volume')
+                self._db.execute('DROP TABLE IF EXISTS entry')
+                self._db.execute('PRAGMA user_version = %d' % self.VERSION)
+
+            self._db.execute('CREATE TABLE IF NOT EXISTS volume ('
+                             'key TEXT PRIMARY KEY, '
+                             'image TEXT, '
+                             'preceding_bytes INTEGER, '
+                             'number_of_eoc INTEGER, '
+                             'run_starts BLOB, '
+                             'run_ends BLOB, '
+                             'has_fdt INTEGER DEFAULT 0)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS entry ('
+                             'key TEXT, '
+                             'full_path TEXT, '
+                             'is_directory INTEGER, '
+                             'first_cluster INTEGER, '
+                             'cluster_list BLOB, '
+                             'file_length INTEGER, '
+                             'create_timestamp REAL, '
+                             'modify_timestamp REAL, '
+                             'access_timestamp REAL, '
+                             'digest BLOB)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS entry_key '
+                             'ON entry (key)')
+
+    @staticmethod
+    def _image_path(partition):
+        path = getattr(partition.stream, 'img_path', None)
+        return os.path.realpath(path) if path else None
+
+    def _verifies(self, partition):
+        """whether the directories of `partition' are checked"""
+        if self.verify is not None:
+            return self.verify
+        image = self._image_path(partition)
+        # a device keeps its modification time as it is written
+        return not (image and os.path.isfile(image))
+
+    def key(self, partition, raw_fat):
+        """identity of the volume, `raw_fat' is the undecoded FAT1"""
+        digest = hashlib.blake2b(digest_size=20)
+
+        image = self._image_path(partition)
+        if image:
+            st = os.stat(image)
+            digest.update(('%s|%d|%d|' % (image, st.st_size,
+                                          st.st_mtime_ns)).encode('utf-8'))
+        digest.update(b'%d|' % partition.preceding_bytes)
+
+        stream = partition.stream
+        pos = stream.tell()
+        stream.seek(partition.preceding_bytes, os.SEEK_SET)
+        digest.update(stream.read(partition.bytes_per_sector))
+        stream.seek(pos, os.SEEK_SET)
+
+        digest.update(raw_fat)
+
+        return digest.hexdigest()
+
+    def load_fat(self, key):
+        """`(run_starts, run_ends, number_of_eoc)' of the FAT or None"""
+        with self._lock:
+            row = self._db.execute('SELECT run_starts, run_ends, '
+                                   'number_of_eoc FROM volume WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return None
+
+        run_starts, run_ends, number_of_eoc = row
+        return (_unpack_uint32(run_starts), _unpack_uint32(run_ends),
+                number_of_eoc)
+
+    def store_fat(self, key, partition, fat):
+        image = self._image_path(partition)
+        with self._lock, self._db:
+            # an image keeps only its latest index per partition
+            old_keys = [(k,) for k, in self._db.execute(
+                'SELECT key FROM volume WHERE image IS ? AND '
+                'preceding_bytes = ? AND key != ?',
+                (image, partition.preceding_bytes, key))]
+            self._db.executemany('DELETE FROM entry WHERE key = ?', old_keys)
+            self._db.executemany('DELETE FROM volume WHERE key = ?', old_keys)
+
+            self._db.execute('INSERT OR REPLACE INTO volume (key, image, '
+                             'preceding_bytes, number_of_eoc, run_starts, '
+                             'run_ends) VALUES (?, ?, ?, ?, ?, ?)',
+                             (key, image, partition.preceding_bytes,
+                              fat.number_of_eoc,
+                              _pack_uint32(fat.run_starts),
+                              _pack_uint32(fat.run_ends)))
+
+    def load_fdt(self, key, entry_class, partition):
+        """
+        `(files, directories)' as returned by `FAT32.get_fdt' or None, also
+        if a directory of `partition' changed since they were stored and it
+        is checked, see `verify'
+        """
+        with self._lock:
+            row = self._db.execute('SELECT has_fdt FROM volume WHERE key = ?',
+                                   (key,)).fetchone()
+            if not row or not row[0]:
+                return None
+
+            rows = self._db.execute('SELECT full_path, is_directory, '
+                                    'first_cluster, cluster_list, '
+                                    'file_length, create_timestamp, '
+                                    'modify_timestamp, access_timestamp, '
+                                    'digest FROM entry WHERE key = ? '
+                                    'ORDER BY rowid', (key,)).fetchall()
+
+        verify = self._verifies(partition)
+        files, directories = {}, {}
+        for (full_path, is_directory, first_cluster, cluster_list,
+             file_length, create_timestamp, modify_timestamp,
+             access_timestamp, digest) in rows:
+            cluster_list = _unpack_cluster_list(cluster_list)
+            if is_directory:
+                # the first directory which changed misses the cache
+                if verify and (digest is None or digest != _directory_digest(
+                        partition, cluster_list)):
+                    return None
+                directories[full_path] = cluster_list
+            else:
+                files[full_path] = entry_class.from_record(
+                    full_path, False, first_cluster, cluster_list,
+                    file_length, create_timestamp, modify_timestamp,
+                    access_timestamp)
+
+        return files, directories
+
+    def store_fdt(self, key, partition, files, directories):
+        verify = self._verifies(partition)
+        rows = [(key, path, 1, None, _pack_cluster_list(cluster_list),
+                 None, None, None, None,
+                 _directory_digest(partition, cluster_list) if verify
+                 else None)
+                for path, cluster_list in directories.items()]
+        rows.extend((key, path, 0, entry.first_cluster,
+                     _pack_cluster_list(entry.cluster_list),
+                     entry.file_length, entry.create_timestamp,
+                     entry.modify_timestamp, entry.access_timestamp, None)
+                    for path, entry in files.items())
+
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM entry WHERE key = ?', (key,))
+            self._db.executemany('INSERT INTO entry VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._db.execute('UPDATE volume SET has_fdt = 1 WHERE key = ?',
+                             (key,))
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
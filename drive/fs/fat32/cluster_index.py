@@ -0,0 +1,79 @@
+# encoding: utf-8
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, chain
+import threading
+
+__all__ = ['ClusterIndex']
+
+
+def _uint32_array(values=()):
+    values_ = array('I')
+    if values_.itemsize != 4:
+        values_ = array('L')
+    values_.extend(values)
+    return values_
+
+
+class ClusterIndex:
+
+    """
+    interval index of the cluster extents of files and directories, telling
+    which of them owns a cluster with a bisection of the sorted extent starts
+
+    extents can be added at any time, e.g. while the directory tree is being
+    walked, they are merged into the sorted arrays by the next query
+    """
+
+    def __init__(self):
+        self.paths = []
+        self._lock = threading.Lock()
+        # extents added since the last query, as `(start, end, owner)'
+        self._pending = []
+
+        self._starts = _uint32_array()
+        self._ends = _uint32_array()
+        self._owners = _uint32_array()
+        # largest end of the extents up to each position, chains overlapping
+        # each other can own a cluster far behind their start
+        self._max_ends = _uint32_array()
+
+    def add(self, path, cluster_list):
+        """add the extents `[[start, end], ...]' owned by `path'"""
+        with self._lock:
+            owner = len(self.paths)
+            self.paths.append(path)
+            self._pending.extend((start, end, owner)
+                                 for start, end in cluster_list)
+
+    def _merge(self):
+        with self._lock:
+            if self._pending:
+                extents = sorted(chain(zip(self._starts, self._ends,
+                                           self._owners),
+                                       self._pending))
+                self._pending = []
+
+                self._starts = _uint32_array(e[0] for e in extents)
+                self._ends = _uint32_array(e[1] for e in extents)
+                self._owners = _uint32_array(e[2] for e in extents)
+                self._max_ends = _uint32_array(accumulate(self._ends, max))
+
+            return self._starts, self._ends, self._owners, self._max_ends
+
+    def owner_of_cluster(self, cluster):
+        """path owning `cluster', or None if it is free or unreachable"""
+        starts, ends, owners, max_ends = self._merge()
+
+        i = bisect_right(starts, cluster) - 1
+        while i >= 0 and max_ends[i] >= cluster:
+            if ends[i] >= cluster:
+                return self.paths[owners[i]]
+            i -= 1
+
+        return None
+
+    def __len__(self):
+        """number of extents"""
+        starts, _, _, _ = self._merge()
+        return len(starts)
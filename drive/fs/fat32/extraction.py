@@ -0,0 +1,187 @@
+# encoding: utf-8
+"""
+extraction of many files at once
+
+the extents of all requested files are sorted by their physical offset and
+read in a single pass over the image, physically adjacent extents are merged
+into one read, and the data is written out by a pool of workers
+"""
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+import os
+import re
+import threading
+from drive.fs import fold_path
+
+__all__ = ['DEFAULT_MAX_IN_FLIGHT', 'select_entries', 'plan_reads',
+           'extract_entries']
+
+# upper bound of the bytes read but not yet written out
+DEFAULT_MAX_IN_FLIGHT = 1024 * 1024 * 64
+
+_glob_characters = re.compile(r'[*?[]')
+
+# a drive, e.g. `C:', would make `os.path.join' drop the parts before it
+_drive = re.compile(r'^[A-Za-z]:')
+
+
+def _path_parts(path):
+    """
+    parts of `path' to join to the output directory, parts which would
+    leave it, `.', `..' and drives, are dropped, names read from an image
+    may hold any of them
+    """
+    parts = []
+    for part in re.split(r'[\\/]+', path):
+        part = _drive.sub('', part)
+        if part not in ('', '.', '..'):
+            parts.append(part)
+    return parts
+
+
+def _output_path(dest_dir, path):
+    """where the file at `path' is extracted to under `dest_dir'"""
+    output = os.path.join(dest_dir, *_path_parts(path))
+    root = os.path.realpath(dest_dir)
+    # a link in `dest_dir' may still lead out of it
+    if os.path.commonpath([root, os.path.realpath(output)]) != root:
+        raise ValueError('%r would be extracted outside %r' %
+                         (path, dest_dir))
+    return output
+
+
+def select_entries(files, patterns):
+    """
+    entries of `files', as returned by `FAT32.get_fdt', whose paths match any
+    of `patterns', which are paths or glob patterns, case is ignored
+    note that `*' matches `/' as well, so `/docs/*' includes subdirectories
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    exact, globs = set(), []
+    for pattern in patterns:
+        pattern = fold_path(pattern)
+        if _glob_characters.search(pattern):
+            globs.append(pattern)
+        else:
+            exact.add(pattern)
+
+    entries = []
+    for path, entry in files.items():
+        path = fold_path(path)
+        if path in exact or any(fnmatchcase(path, g) for g in globs):
+            entries.append(entry)
+    return entries
+
+
+def plan_reads(entries, abs_c2b, bytes_per_cluster, max_read_size):
+    """
+    reads covering the content of `entries', in the order of their physical
+    offset, as `(address, size, pieces)' where each piece is
+    `(address, size, file_offset, entry)' and lies within the read
+    """
+    pieces = []
+    for entry in entries:
+        left = entry.file_length
+        offset = 0
+        for start, end in entry.cluster_list:
+            address = abs_c2b(start)
+            extent = min((end - start + 1) * bytes_per_cluster, left)
+            # extents larger than a single read are split
+            for i in range(0, extent, max_read_size):
+                size = min(max_read_size, extent - i)
+                pieces.append((address + i, size, offset + i, entry))
+            offset += extent
+            left -= extent
+            if left <= 0:
+                break
+
+    pieces.sort(key=lambda piece: piece[0])
+
+    reads = []
+    for piece in pieces:
+        address, size = piece[0], piece[1]
+        if reads:
+            read_address, read_size, read_pieces = reads[-1]
+            if read_address + read_size == address and \
+                    read_size + size <= max_read_size:
+                reads[-1] = (read_address, read_size + size, read_pieces)
+                read_pieces.append(piece)
+                continue
+        reads.append((address, size, [piece]))
+
+    return reads
+
+
+def extract_entries(stream, entries, dest_dir, abs_c2b, bytes_per_cluster,
+                    max_read_size, workers=4,
+                    max_in_flight=DEFAULT_MAX_IN_FLIGHT, progress=None):
+    """
+    extract the content of `entries' into `dest_dir', keeping their paths
+    and the case of their names, returns a dict of the output path of every entry keyed by its path
+
+    stream: the stream of the partition, read from the calling thread only
+    max_read_size: upper bound of a single read
+    workers: number of threads writing the output files
+    max_in_flight: the reading pauses while this many bytes wait to be
+    written, a single read may exceed it
+    progress: called as `progress(bytes_done, bytes_total)' after every write
+    """
+    outputs = {}
+    for entry in entries:
+        path = _output_path(dest_dir, entry.full_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # created up front, extents of a file are written in any order
+        open(path, 'wb').close()
+        outputs[entry.full_path] = path
+
+    reads = plan_reads(entries, abs_c2b, bytes_per_cluster, max_read_size)
+    total = sum(size for _, size, _ in reads)
+
+    lock = threading.Condition()
+    state = {'in_flight': 0, 'done': 0}
+    errors = []
+
+    def _write(read_address, read_size, data, pieces):
+        try:
+            for address, size, file_offset, entry in pieces:
+                start = address - read_address
+                with open(outputs[entry.full_path], 'r+b') as f:
+                    f.seek(file_offset, os.SEEK_SET)
+                    f.write(data[start:start + size])
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            with lock:
+                state['in_flight'] -= read_size
+                state['done'] += read_size
+                lock.notify_all()
+                if progress is not None:
+                    progress(state['done'], total)
+
+    with ThreadPoolExecutor(workers) as pool:
+        for address, size, pieces in reads:
+            with lock:
+                lock.wait_for(lambda: not state['in_flight'] or
+                              state['in_flight'] + size <= max_in_flight)
+                state['in_flight'] += size
+            if errors:
+                break
+
+            if stream.zero_copy:
+                data = stream.view(address, size)
+            else:
+                data = memoryview(bytearray(size))
+                data = data[:stream.readinto_at(address, data)]
+            # the pieces would be written cut short
+            if len(data) < size:
+                raise IOError('unexpected end of stream when extracting at '
+                              '%d' % (address + len(data)))
+
+            pool.submit(_write, address, size, data, pieces)
+
+    if errors:
+        raise errors[0]
+
+    return outputs
@@ -0,0 +1,566 @@
+# encoding: utf-8
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+import os
+import sys
+import threading
+from misc import gc_paused
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['EOC_MAGIC', 'FAT_READ_CHUNK_SIZE', 'FAT_COMPARE_BLOCK_SIZE',
+           'read_fat_table', 'decode_fat_table', 'count_eoc',
+           'diff_fat_tables',
+           'chain_heads', 'build_cluster_chains', 'FileAllocationTable',
+           'LazyFileAllocationTable']
+
+EOC_MAGIC = 0x0ffffff8
+
+# size of a single read issued when loading the FAT, large enough to keep the
+# number of reads small and small enough not to double the peak memory
+FAT_READ_CHUNK_SIZE = 1024 * 1024 * 16
+
+# size of the blocks of the two FATs compared at a time
+FAT_COMPARE_BLOCK_SIZE = 1024 * 1024
+
+# the upper bits of an entry are reserved
+_ENTRY_MASK = 0x0fffffff
+
+
+def read_fat_table(stream, bytes_per_fat, chunk_size=FAT_READ_CHUNK_SIZE):
+    """
+    read the whole FAT from current stream position in large chunks, returns
+    the raw bytes of the table, or a view of them if the stream is zero-copy
+    """
+    if stream.zero_copy:
+        pos = stream.tell()
+        buf = stream.view(pos, bytes_per_fat)
+        if len(buf) < bytes_per_fat:
+            raise IOError('unexpected end of stream when reading FAT, '
+                          '%d of %d bytes read' % (len(buf), bytes_per_fat))
+        stream.seek(pos + bytes_per_fat, os.SEEK_SET)
+        return buf
+
+    buf = bytearray(bytes_per_fat)
+    view = memoryview(buf)
+    pos = 0
+    while pos < bytes_per_fat:
+        chunk = stream.read(min(chunk_size, bytes_per_fat - pos))
+        if not chunk:
+            raise IOError('unexpected end of stream when reading FAT, '
+                          '%d of %d bytes read' % (pos, bytes_per_fat))
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+    return buf
+
+
+def decode_fat_table(raw):
+    """
+    decode raw FAT bytes as a typed array of little-endian uint32 entries,
+    a numpy array is returned if numpy is available, otherwise `array('I')'
+    """
+    if numpy is not None:
+        return numpy.frombuffer(raw, dtype='<u4')
+
+    table = array('I')
+    if table.itemsize != 4:
+        table = array('L')
+    table.frombytes(raw)
+    if sys.byteorder == 'big':
+        table.byteswap()
+
+    return table
+
+
+def count_eoc(values):
+    """number of entries of `values' which end a chain"""
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        return int(numpy.count_nonzero((values & EOC_MAGIC) == EOC_MAGIC))
+    return sum(1 for c in values if c & EOC_MAGIC == EOC_MAGIC)
+
+
+def _read_block(stream, pos, buf):
+    n = stream.readinto_at(pos, buf)
+    if n < len(buf):
+        raise IOError('unexpected end of stream when reading FAT at %d' %
+                      (pos + n))
+
+
+def diff_fat_tables(stream, first_pos, second_pos, bytes_per_fat,
+                    block_size=FAT_COMPARE_BLOCK_SIZE):
+    """
+    compare two copies of the FAT at absolute positions `first_pos' and
+    `second_pos' block by block on their raw bytes, only blocks which differ
+    are decoded, yields `(cluster, first_entry, second_entry)' of every entry
+    which differs
+    """
+    block_size = max(block_size - block_size % 4, 4)
+    first, second = bytearray(block_size), bytearray(block_size)
+
+    for offset in range(0, bytes_per_fat, block_size):
+        if bytes_per_fat - offset < block_size:
+            first = bytearray(bytes_per_fat - offset)
+            second = bytearray(bytes_per_fat - offset)
+        _read_block(stream, first_pos + offset, first)
+        _read_block(stream, second_pos + offset, second)
+
+        # bytearrays compare with memcmp
+        if first == second:
+            continue
+
+        first_table = decode_fat_table(first)
+        second_table = decode_fat_table(second)
+        if numpy is not None:
+            differ = numpy.flatnonzero(first_table != second_table).tolist()
+        else:
+            differ = [i for i, (a, b) in enumerate(zip(first_table,
+                                                       second_table))
+                      if a != b]
+        for i in differ:
+            yield offset // 4 + i, int(first_table[i]), int(second_table[i])
+
+
+def chain_heads(table, clusters):
+    """
+    `{cluster: head}' of the first cluster of the chain each of `clusters' is
+    on, following the entries of `table' backwards
+    """
+    n = len(table)
+    if numpy is not None and isinstance(table, numpy.ndarray):
+        entries = table & _ENTRY_MASK
+        pointing = numpy.flatnonzero((entries >= 2) & (entries < n))
+        previous = numpy.zeros(n, dtype=numpy.uint32)
+        previous[entries[pointing]] = pointing
+    else:
+        previous = _to_uint32_array([0]) * n
+        for i, entry in enumerate(table):
+            entry &= _ENTRY_MASK
+            if 2 <= entry < n:
+                previous[entry] = i
+
+    heads = {}
+    for cluster in clusters:
+        path, seen = [], set()
+        c = cluster
+        # `seen' stops at cycles of corrupted chains
+        while c not in heads and previous[c] and c not in seen:
+            path.append(c)
+            seen.add(c)
+            c = int(previous[c])
+        head = heads.setdefault(c, c)
+        heads.update((c_, head) for c_ in path)
+
+    return {cluster: heads[cluster] for cluster in clusters}
+
+
+def _build_cluster_chains_numpy(table):
+    n = len(table)
+    index = numpy.arange(2, n, dtype=numpy.int64)
+    entries = table[2:].astype(numpy.int64)
+
+    is_eoc = (entries & EOC_MAGIC) == EOC_MAGIC
+    number_of_eoc = int(numpy.count_nonzero(is_eoc))
+
+    # entries pointing forwards, i.e. the clusters which will be found in
+    # `cluster_head' by the time they are visited
+    forward = ~is_eoc & (entries > index) & (entries < n)
+    referenced = numpy.zeros(n, dtype=bool)
+    referenced[entries[forward]] = True
+    # clusters referenced by anything other than their direct predecessor
+    cross_referenced = numpy.zeros(n, dtype=bool)
+    cross_referenced[entries[forward & (entries != index + 1)]] = True
+
+    sequential = entries == index + 1
+    # entries in the middle of a contiguous run are folded into the run head
+    absorbed = numpy.zeros(n - 2, dtype=bool)
+    absorbed[1:] = sequential[1:] & sequential[:-1]
+    absorbed &= ~cross_referenced[2:]
+
+    # free clusters nobody points to always end up as `[[0, 0]]'
+    free = (entries == 0) & ~referenced[2:]
+
+    events = numpy.flatnonzero(~absorbed & ~free)
+    values = entries[events]
+    ends = numpy.where(sequential[events],
+                       numpy.append(events[1:] + 2, n),
+                       values)
+
+    cluster_head = {}
+    obj = {}
+    for i, lo, hi, eoc in zip((events + 2).tolist(), values.tolist(),
+                              ends.tolist(), is_eoc[events].tolist()):
+        head = cluster_head.pop(i, i)
+
+        if eoc:
+            if head not in obj:
+                obj[head] = [[head, head]]
+            continue
+
+        cluster_list = obj.get(head)
+        if cluster_list is None:
+            obj[head] = [[lo, hi]]
+        else:
+            last_segment = cluster_list[-1]
+            if last_segment[-1] == lo - 1:
+                last_segment[-1] = hi
+            else:
+                cluster_list.append([lo, hi])
+
+        cluster_head[hi] = head
+
+    fat = defaultdict(list, obj)
+    fat.update({i: [[0, 0]] for i in (numpy.flatnonzero(free) + 2).tolist()})
+
+    return fat, number_of_eoc
+
+
+def _build_cluster_chains_array(table):
+    eoc_magic = EOC_MAGIC
+    number_of_eoc = 0
+
+    cluster_head = {}
+    obj = {}
+    for i in range(2, len(table)):
+        c = table[i]
+        head = cluster_head.pop(i, i)
+
+        if c & eoc_magic == eoc_magic:
+            number_of_eoc += 1
+            if head not in obj:
+                obj[head] = [[head, head]]
+            continue
+
+        cluster_list = obj.get(head)
+        if cluster_list is None:
+            obj[head] = [[c, c]]
+        else:
+            last_segment = cluster_list[-1]
+            if last_segment[-1] == c - 1:
+                last_segment[-1] = c
+            else:
+                cluster_list.append([c, c])
+
+        cluster_head[c] = head
+
+    return defaultdict(list, obj), number_of_eoc
+
+
+def build_cluster_chains(table):
+    """
+    build run-length cluster chains from a decoded FAT, returns the same
+    `(dict, number_of_eoc)' pair as `FAT32.get_fat'
+
+    with numpy, only the entries which break a contiguous run are visited in
+    Python, contiguous runs and unreferenced free clusters are handled in bulk
+    """
+    with gc_paused():
+        if numpy is not None and isinstance(table, numpy.ndarray):
+            return _build_cluster_chains_numpy(table)
+
+        return _build_cluster_chains_array(table)
+
+
+def _to_uint32_array(values):
+    runs = array('I')
+    if runs.itemsize != 4:
+        runs = array('L')
+    if numpy is not None and isinstance(values, numpy.ndarray):
+        runs.frombytes(values.astype(runs.typecode).tobytes())
+    else:
+        runs.extend(values)
+    return runs
+
+
+class FileAllocationTable:
+
+    """
+    compact FAT model, the next-cluster table is kept as a decoded uint32
+    array and contiguous runs of allocated clusters are indexed by two flat
+    arrays holding the first and the last cluster of every run, so resolving a
+    chain costs one binary search per fragment instead of one dict of lists
+    per chain
+    """
+
+    __slots__ = ['table', 'run_starts', 'run_ends', 'number_of_eoc']
+
+    def __init__(self, table, index=None):
+        """
+        index: `(run_starts, run_ends, number_of_eoc)' built earlier for the
+        same table, e.g. loaded from a cache, the table is indexed if omitted
+        """
+        self.table = table
+
+        if index is not None:
+            run_starts, run_ends, self.number_of_eoc = index
+        elif numpy is not None and isinstance(table, numpy.ndarray):
+            run_starts, run_ends, self.number_of_eoc = self._index_numpy(table)
+        else:
+            run_starts, run_ends, self.number_of_eoc = self._index_array(table)
+
+        self.run_starts = _to_uint32_array(run_starts)
+        self.run_ends = _to_uint32_array(run_ends)
+
+    @staticmethod
+    def _index_numpy(table):
+        entries = table[2:]
+        allocated = entries != 0
+        sequential = entries == numpy.arange(3, len(table) + 1,
+                                             dtype=entries.dtype)
+        # a run only continues into an allocated cluster, and the last entry
+        # can not continue a run whatever it points to
+        sequential[:-1] &= allocated[1:]
+        sequential[-1:] = False
+
+        starts = allocated.copy()
+        starts[1:] &= ~sequential[:-1]
+        ends = allocated & ~sequential
+
+        number_of_eoc = int(numpy.count_nonzero(
+            (entries & EOC_MAGIC) == EOC_MAGIC))
+
+        return (numpy.flatnonzero(starts) + 2, numpy.flatnonzero(ends) + 2,
+                number_of_eoc)
+
+    @staticmethod
+    def _index_array(table):
+        run_starts, run_ends = [], []
+        number_of_eoc = 0
+        last = len(table) - 1
+        in_run = False
+        for i in range(2, len(table)):
+            c = table[i]
+            if not c:
+                continue
+            if not in_run:
+                run_starts.append(i)
+            if c == i + 1 and i != last and table[c]:
+                in_run = True
+            else:
+                in_run = False
+                run_ends.append(i)
+                if c & EOC_MAGIC == EOC_MAGIC:
+                    number_of_eoc += 1
+
+        return run_starts, run_ends, number_of_eoc
+
+    @staticmethod
+    def _runs_between(table, first, last):
+        """
+        clusters from `first' to `last' which start and which end a run, the
+        same as the index of the whole table would tell
+        """
+        n = len(table)
+        lo = max(first - 1, 2)
+        hi = min(last + 2, n)
+        # whether the entry after the window is allocated
+        next_allocated = hi < n and bool(table[hi])
+
+        if numpy is not None and isinstance(table, numpy.ndarray):
+            entries = table[lo:hi].astype(numpy.int64)
+            index = numpy.arange(lo, hi)
+            allocated = entries != 0
+            sequential = entries == index + 1
+            sequential[:-1] &= allocated[1:]
+            sequential[-1:] &= next_allocated
+
+            starts = allocated.copy()
+            starts[1:] &= ~sequential[:-1]
+            ends = allocated & ~sequential
+            # the flags of the entries around the window are only needed for
+            # those at its edges
+            inside = (index >= first) & (index <= last)
+            return (index[starts & inside].tolist(),
+                    index[ends & inside].tolist())
+
+        starts, ends = [], []
+        previous_sequential = False
+        for i in range(lo, hi):
+            c = table[i]
+            sequential = bool(c) and c == i + 1 and \
+                (table[c] != 0 if c < hi else next_allocated)
+            if first <= i <= last and c:
+                if not previous_sequential:
+                    starts.append(i)
+                if not sequential:
+                    ends.append(i)
+            previous_sequential = sequential
+
+        return starts, ends
+
+    def update(self, first, entries):
+        """
+        replace the entries of the table from cluster `first' on with
+        `entries', e.g. a block of the FAT which changed on disk, the runs
+        around them are indexed again and the rest of the index is kept
+        """
+        table = self.table
+        last = first + len(entries) - 1
+
+        counted = max(first, 2)
+        self.number_of_eoc += (count_eoc(entries[counted - first:]) -
+                               count_eoc(table[counted:last + 1]))
+
+        table[first:last + 1] = entries
+
+        # changed entries end the runs before them and start those after
+        # them anew
+        first = max(first - 1, 2)
+        last = min(last + 1, len(table) - 1)
+        starts, ends = self._runs_between(table, first, last)
+        for runs, values in ((self.run_starts, starts),
+                             (self.run_ends, ends)):
+            runs[bisect_left(runs, first):bisect_right(runs, last)] = \
+                _to_uint32_array(values)
+
+    def __len__(self):
+        return len(self.table)
+
+    @property
+    def nbytes(self):
+        """memory held by the table and the run index"""
+        return (len(self.table) * 4 +
+                (len(self.run_starts) + len(self.run_ends)) *
+                self.run_starts.itemsize)
+
+    def resolve_cluster_list(self, first_cluster):
+        """
+        follow the chain starting at `first_cluster', returns its extents as
+        `[[start, end], ...]', or an empty tuple if the cluster is not
+        allocated
+        """
+        table, run_starts, run_ends = self.table, self.run_starts, self.run_ends
+        n = len(table)
+
+        extents = []
+        c = first_cluster
+        # a corrupted FAT may link chains into a loop, no valid chain visits
+        # more runs than there are
+        for _ in range(len(run_starts)):
+            if not 2 <= c < n:
+                break
+            i = bisect_right(run_starts, c) - 1
+            if i < 0 or run_ends[i] < c:
+                # free cluster
+                break
+            end = run_ends[i]
+            extents.append([c, end])
+            c = int(table[end])
+
+        return extents or ()
+
+    def cluster_chains(self):
+        """the dict of lists representation returned by `build_cluster_chains'"""
+        return build_cluster_chains(self.table)
+
+
+class LazyFileAllocationTable:
+
+    """
+    FAT read and decoded block by block on demand, only the blocks a resolved
+    chain runs through are ever read, which keeps the cost of opening a volume
+    independent of its size
+    """
+
+    DEFAULT_BLOCK_SIZE = 1024 * 64
+
+    def __init__(self, stream, fat_abs_pos, bytes_per_fat,
+                 block_size=DEFAULT_BLOCK_SIZE):
+        self._stream = stream
+        self._fat_abs_pos = fat_abs_pos
+        self._bytes_per_fat = bytes_per_fat
+        self._block_size = block_size - block_size % 4
+        self._entries_per_block = self._block_size // 4
+
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+        self.number_of_entries = bytes_per_fat // 4
+
+    def __len__(self):
+        return self.number_of_entries
+
+    @property
+    def number_of_blocks_read(self):
+        return len(self._blocks)
+
+    def _block(self, cluster):
+        """decoded block holding `cluster' and the index of its first entry"""
+        i = cluster // self._entries_per_block
+        block = self._blocks.get(i)
+        if block is None:
+            with self._lock:
+                block = self._blocks.get(i)
+                if block is None:
+                    offset = i * self._block_size
+                    size = min(self._block_size, self._bytes_per_fat - offset)
+
+                    # read at the offset, so that the stream is left where
+                    # it is and other threads may read it meanwhile
+                    pos = self._fat_abs_pos + offset
+                    if self._stream.zero_copy:
+                        raw = self._stream.view(pos, size)
+                        if len(raw) < size:
+                            raise IOError('unexpected end of stream when '
+                                          'reading FAT at %d' % pos)
+                    else:
+                        raw = bytearray(size)
+                        _read_block(self._stream, pos, raw)
+                    block = decode_fat_table(raw)
+
+                    self._blocks[i] = block
+
+        return block, i * self._entries_per_block
+
+    def _entry(self, cluster):
+        block, base = self._block(cluster)
+        return int(block[cluster - base])
+
+    def _first_break(self, cluster):
+        """first cluster from `cluster' on which does not point to its
+        successor, or the last cluster of the FAT"""
+        c = cluster
+        while True:
+            block, base = self._block(c)
+            end = base + len(block)
+
+            if numpy is not None and isinstance(block, numpy.ndarray):
+                breaks = numpy.flatnonzero(
+                    block[c - base:] != numpy.arange(c + 1, end + 1,
+                                                     dtype=numpy.int64))
+                if len(breaks):
+                    return c + int(breaks[0])
+            else:
+                for i in range(c, end):
+                    if block[i - base] != i + 1:
+                        return i
+
+            if end >= self.number_of_entries:
+                return self.number_of_entries - 1
+            c = end
+
+    def resolve_cluster_list(self, first_cluster):
+        """same as `FileAllocationTable.resolve_cluster_list'"""
+        n = self.number_of_entries
+
+        extents = []
+        c = first_cluster
+        for _ in range(n):
+            if not 2 <= c < n or not self._entry(c):
+                break
+
+            end = self._first_break(c)
+            next_c = self._entry(end)
+            if not next_c:
+                # the run leads into a free cluster, which is not part of it
+                extents.append([c, end - 1])
+                break
+
+            extents.append([c, end])
+            c = next_c
+
+        return extents or ()
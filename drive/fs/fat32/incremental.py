@@ -0,0 +1,361 @@
+# encoding: utf-8
+"""
+incremental rescans of a FAT32 volume which changes between scans
+
+a scan leaves a `VolumeSnapshot' behind, holding a digest of every block of
+the FAT, the decoded directory tree and a digest of the clusters of every
+directory. the next scan reads the FAT and only indexes the blocks which hash
+differently from the snapshot, then walks the tree again, reading every
+directory but only decoding those whose clusters hash differently, entries of
+the others are taken from the snapshot
+"""
+from array import array
+from bisect import bisect_right
+from collections import deque
+import hashlib
+import os
+import pickle
+from drive.fs.fat32.fat import FAT_COMPARE_BLOCK_SIZE, read_fat_table, \
+    decode_fat_table, count_eoc, FileAllocationTable
+from stream.buffered_cluster_stream import BufferedClusterStream
+
+__all__ = ['ChangeSet', 'VolumeSnapshot', 'rescan']
+
+
+class ChangeSet:
+
+    """
+    files which changed between two scans, by path, moved files are
+    `(old_path, new_path)' pairs and are listed under `modified' by their new
+    path as well if their content changed
+    """
+
+    __slots__ = ['added', 'removed', 'modified', 'moved',
+                 'fat_blocks_changed', 'directories_decoded']
+
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.modified = []
+        self.moved = []
+        # what the scan had to decode again
+        self.fat_blocks_changed = 0
+        self.directories_decoded = 0
+
+    def __len__(self):
+        return (len(self.added) + len(self.removed) + len(self.modified) +
+                len(self.moved))
+
+    def __repr__(self):
+        return '<ChangeSet %d added, %d removed, %d modified, %d moved>' % (
+            len(self.added), len(self.removed), len(self.modified),
+            len(self.moved))
+
+
+class _Listing:
+
+    """what a directory held when it was last decoded"""
+
+    __slots__ = ['path', 'digest', 'cluster_list', 'files', 'subdirectories']
+
+    def __init__(self, path, digest, cluster_list, files, subdirectories):
+        self.path = path
+        self.digest = digest
+        self.cluster_list = cluster_list
+        # entries of the files right in the directory
+        self.files = files
+        # `(path, first_cluster)' of the directories right in it
+        self.subdirectories = subdirectories
+
+
+class VolumeSnapshot:
+
+    """state of a volume after a scan, see `rescan'"""
+
+    VERSION = 2
+
+    def __init__(self, partition, fat_blocks, fat, files, directories,
+                 listings):
+        # the geometry the snapshot is only valid for
+        self.geometry = self.geometry_of(partition)
+        # `(block_size, digests, eoc_counts)' of the blocks of the FAT, see
+        # `_fat_blocks'
+        self.fat_blocks = fat_blocks
+        self.run_index = (fat.run_starts, fat.run_ends, fat.number_of_eoc)
+        self.files = files
+        self.directories = directories
+        # `{first_cluster: _Listing}' of every directory
+        self.listings = listings
+
+    @staticmethod
+    def geometry_of(partition):
+        return (partition.preceding_bytes, partition.bytes_per_sector,
+                partition.bytes_per_cluster, partition.bytes_per_fat)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump((self.VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """the snapshot saved at `path', or None if it is of another version"""
+        with open(path, 'rb') as f:
+            version, snapshot = pickle.load(f)
+        if version != cls.VERSION:
+            return None
+        return snapshot
+
+
+_FAT_DIGEST_SIZE = 16
+
+
+def _block_digest(block):
+    return hashlib.blake2b(block, digest_size=_FAT_DIGEST_SIZE).digest()
+
+
+def _block_eoc(table, first, last):
+    # the first two entries are reserved and not counted
+    return count_eoc(table[max(first, 2):last + 1])
+
+
+def _fat_blocks(raw, table, block_size):
+    """
+    `(block_size, digests, eoc_counts)' of the FAT, the digests of its blocks
+    of `block_size' bytes concatenated and how many entries of each end a
+    chain
+    """
+    view = memoryview(raw)
+    digests = bytearray()
+    eoc_counts = array('Q')
+    for offset in range(0, len(raw), block_size):
+        digests += _block_digest(view[offset:offset + block_size])
+        first = offset // 4
+        eoc_counts.append(_block_eoc(table, first,
+                                     first + block_size // 4 - 1))
+    return block_size, bytes(digests), eoc_counts
+
+
+def _read_fat(partition, snapshot, block_size, changes):
+    """
+    the FAT of the volume, indexed from scratch without a snapshot, otherwise
+    only where its blocks hash differently from the snapshot, returns
+    `(fat_blocks, fat, changed)', `changed' are the sorted `(first, last)'
+    clusters of the blocks which differ
+    """
+    stream = partition.stream
+    bytes_per_fat = partition.bytes_per_fat
+    stream.seek(partition.fat_abs_pos, os.SEEK_SET)
+    # a copy, a view of a mapped image would change with the volume and
+    # cannot be updated
+    raw = bytearray(read_fat_table(stream, bytes_per_fat))
+    table = decode_fat_table(raw)
+
+    if snapshot is None or snapshot.fat_blocks[0] != block_size:
+        changes.fat_blocks_changed = -(-bytes_per_fat // block_size)
+        return (_fat_blocks(raw, table, block_size),
+                FileAllocationTable(table), None)
+
+    _, digests, eoc_counts = snapshot.fat_blocks
+    digests = bytearray(digests)
+    eoc_counts = array('Q', eoc_counts)
+    view = memoryview(raw)
+
+    changed = []
+    for i, offset in enumerate(range(0, bytes_per_fat, block_size)):
+        digest = _block_digest(view[offset:offset + block_size])
+        at = i * _FAT_DIGEST_SIZE
+        if digests[at:at + _FAT_DIGEST_SIZE] == digest:
+            continue
+
+        changes.fat_blocks_changed += 1
+        digests[at:at + _FAT_DIGEST_SIZE] = digest
+        first = offset // 4
+        last = min(first + block_size // 4, len(table)) - 1
+        changed.append((first, last))
+        eoc_counts[i] = _block_eoc(table, first, last)
+
+    # the table already holds the new entries, so `update' leaves the count
+    # of chain ends as it is and only indexes the runs of the changed blocks
+    # again
+    fat = FileAllocationTable(table, snapshot.run_index[:2] +
+                              (sum(eoc_counts),))
+    for first, last in changed:
+        fat.update(first, table[first:last + 1])
+
+    return (block_size, bytes(digests), eoc_counts), fat, changed
+
+
+def _touches(cluster_list, changed):
+    """whether the entries of any cluster of `cluster_list' changed"""
+    if changed is None:
+        return True
+    for start, end in cluster_list:
+        i = bisect_right(changed, (end, float('inf'))) - 1
+        if i >= 0 and changed[i][1] >= start:
+            return True
+    return False
+
+
+def _digest(partition, cluster_list):
+    digest = hashlib.blake2b(digest_size=16)
+    with BufferedClusterStream(partition.stream, cluster_list,
+                               partition.abs_c2b,
+                               partition.bytes_per_cluster) as stream:
+        while True:
+            chunk = stream.read(partition.bytes_per_cluster)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _moved(entry, path, cluster_list):
+    """`entry' of a directory listed before at another path or whose
+    cluster chain changed"""
+    return entry.from_record(path, entry.is_directory, entry.first_cluster,
+                             cluster_list, entry.file_length,
+                             entry.create_timestamp, entry.modify_timestamp,
+                             entry.access_timestamp)
+
+
+def _reuse(partition, listing, path, changed):
+    """the files and subdirectories of an unchanged `listing' now at `path'"""
+    files = []
+    for entry in listing.files:
+        full_path = path + entry.full_path[len(listing.path):]
+        cluster_list = entry.cluster_list
+        if _touches(cluster_list, changed):
+            cluster_list = partition.resolve_cluster_list(entry.first_cluster)
+        if full_path != entry.full_path or cluster_list != entry.cluster_list:
+            entry = _moved(entry, full_path, cluster_list)
+        files.append(entry)
+
+    subdirectories = [(path + subdirectory[len(listing.path):], first_cluster)
+                      for subdirectory, first_cluster
+                      in listing.subdirectories]
+    return files, subdirectories
+
+
+def _walk(partition, snapshot, changed, changes, root_dir_name='/'):
+    """
+    `(files, directories, listings)' of the tree, directories whose clusters
+    hash the same as in the snapshot are not decoded again
+    """
+    previous = snapshot.listings if snapshot is not None else {}
+
+    files = {}
+    directories = {}
+    listings = {}
+
+    # task := (directory_name, first_cluster)
+    tasks = deque([(root_dir_name, 2)])
+    while tasks:
+        dir_name, first_cluster = tasks.popleft()
+        cluster_list = partition.resolve_cluster_list(first_cluster)
+        directories[dir_name] = cluster_list
+
+        if dir_name.startswith(u'\u00e5'):
+            continue
+
+        digest = _digest(partition, cluster_list)
+        listing = previous.get(first_cluster)
+        if listing is not None and listing.digest == digest and \
+                listing.cluster_list == cluster_list:
+            found, subdirectories = _reuse(partition, listing, dir_name,
+                                           changed)
+        else:
+            changes.directories_decoded += 1
+            found, subdirectories = [], []
+            for entry in partition._iter_directory(dir_name, cluster_list):
+                if entry.is_directory:
+                    subdirectories.append((entry.full_path,
+                                           entry.first_cluster))
+                else:
+                    found.append(entry)
+
+        listings[first_cluster] = _Listing(dir_name, digest, cluster_list,
+                                           found, subdirectories)
+        files.update((entry.full_path, entry) for entry in found)
+        tasks.extend(subdirectories)
+
+    return files, directories, listings
+
+
+def _same_content(old, new):
+    # entries of unchanged directories are taken over as they are
+    if old is new:
+        return True
+    return (old.first_cluster == new.first_cluster and
+            old.file_length == new.file_length and
+            old.modify_timestamp == new.modify_timestamp and
+            list(old.cluster_list) == list(new.cluster_list))
+
+
+def _compare(old_files, new_files, changes):
+    removed = [path for path in old_files if path not in new_files]
+    added = [path for path in new_files if path not in old_files]
+    changes.modified = sorted(
+        path for path, entry in new_files.items()
+        if path in old_files and not _same_content(old_files[path], entry))
+
+    # a moved file keeps its clusters and creation time
+    sources = {}
+    for path in removed:
+        entry = old_files[path]
+        if entry.first_cluster >= 2:
+            sources.setdefault((entry.first_cluster, entry.create_timestamp),
+                               path)
+
+    moved_from = set()
+    for path in sorted(added):
+        entry = new_files[path]
+        source = sources.pop((entry.first_cluster, entry.create_timestamp),
+                             None)
+        if source is None:
+            changes.added.append(path)
+            continue
+        changes.moved.append((source, path))
+        moved_from.add(source)
+        if not _same_content(old_files[source], entry):
+            changes.modified.append(path)
+
+    changes.modified.sort()
+    changes.removed = sorted(path for path in removed
+                             if path not in moved_from)
+
+
+def rescan(partition, snapshot=None, block_size=FAT_COMPARE_BLOCK_SIZE):
+    """
+    scan `partition', a `FAT32', again after `snapshot' was taken, or from
+    scratch if there is none, returns `(changes, snapshot)', the `ChangeSet'
+    since the last scan and the snapshot of this one, whose `files' and
+    `directories' are the index as returned by `FAT32.get_fdt'
+
+    the FAT is compared with the snapshot in blocks of `block_size' bytes,
+    a snapshot of a volume of another geometry is ignored
+    """
+    block_size = max(block_size - block_size % 4, 4)
+    if snapshot is not None and \
+            snapshot.geometry != VolumeSnapshot.geometry_of(partition):
+        partition.logger.warning('snapshot is of another volume, scanning '
+                                 'from scratch')
+        snapshot = None
+
+    # the volume is read as it is now, not as a cache in front of it has it
+    partition.stream.invalidate()
+
+    changes = ChangeSet()
+    fat_blocks, fat, changed = _read_fat(partition, snapshot, block_size,
+                                         changes)
+    partition.logger.info('%d FAT blocks changed', changes.fat_blocks_changed)
+    partition.use_fat(fat)
+
+    files, directories, listings = _walk(partition, snapshot, changed,
+                                         changes)
+    partition.logger.info('decoded %d of %d directories',
+                          changes.directories_decoded, len(directories))
+
+    _compare(snapshot.files if snapshot is not None else {}, files, changes)
+
+    return changes, VolumeSnapshot(partition, fat_blocks, fat, files,
+                                   directories, listings)
@@ -0,0 +1,272 @@
+# encoding: utf-8
+"""
+recovery of deleted files
+
+deleted directory entries keep the first cluster and the length of a file,
+while the FAT entries of its chain are cleared, the chain is guessed to be the
+free clusters following the first one; files no directory entry remembers are
+carved from the free clusters by their signatures, in a single sequential pass
+over the data region
+"""
+from bisect import bisect_left
+from collections import namedtuple
+import os
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['Signature', 'SIGNATURES', 'CARVE_CHUNK_SIZE', 'is_free',
+           'guess_cluster_list', 'carve']
+
+# the upper bits of a FAT entry are reserved
+_ENTRY_MASK = 0x0fffffff
+
+# size of a single read of the carving pass
+CARVE_CHUNK_SIZE = 1024 * 1024 * 16
+
+Signature = namedtuple('Signature', ['extension', 'header', 'footer',
+                                     'footer_extra', 'max_size'])
+Signature.__doc__ = """
+file type recognized when carving, files start with `header' at the start of
+a cluster and end after `footer' and `footer_extra' more bytes, or where the
+free clusters run out, at `max_size' bytes at most
+"""
+
+SIGNATURES = (
+    Signature('jpg', b'\xff\xd8\xff', b'\xff\xd9', 0, 1024 * 1024 * 32),
+    Signature('png', b'\x89PNG\r\n\x1a\n', b'IEND\xaeB`\x82', 0,
+              1024 * 1024 * 32),
+    Signature('gif', b'GIF89a', b'\x00\x3b', 0, 1024 * 1024 * 16),
+    Signature('gif', b'GIF87a', b'\x00\x3b', 0, 1024 * 1024 * 16),
+    Signature('pdf', b'%PDF-', b'%%EOF', 0, 1024 * 1024 * 256),
+    # the end of central directory record is 22 bytes long without comment
+    Signature('zip', b'PK\x03\x04', b'PK\x05\x06', 18, 1024 * 1024 * 256),
+)
+
+
+def is_free(value):
+    return value & _ENTRY_MASK == 0
+
+
+def _free_mask(table, start, stop):
+    """which of the clusters in `[start, stop)' are free, as a sequence"""
+    if numpy is not None and isinstance(table, numpy.ndarray):
+        return (table[start:stop] & _ENTRY_MASK) == 0
+    return [v & _ENTRY_MASK == 0 for v in table[start:stop]]
+
+
+def _free_clusters(mask, offset):
+    """numbers of the free clusters in `mask' which starts at `offset'"""
+    if numpy is not None and isinstance(mask, numpy.ndarray):
+        return (numpy.flatnonzero(mask) + offset).tolist()
+    return [offset + i for i, free in enumerate(mask) if free]
+
+
+def guess_cluster_list(table, first_cluster, number_of_clusters,
+                       window=4096):
+    """
+    extents of the first `number_of_clusters' free clusters from
+    `first_cluster' on, the usual allocation of a file, or `()' if the first
+    cluster has been allocated again
+    """
+    if not number_of_clusters or not 2 <= first_cluster < len(table) or \
+            not is_free(table[first_cluster]):
+        return ()
+
+    clusters = []
+    pos = first_cluster
+    while len(clusters) < number_of_clusters and pos < len(table):
+        stop = min(pos + max(window, number_of_clusters - len(clusters)),
+                   len(table))
+        clusters.extend(_free_clusters(_free_mask(table, pos, stop), pos)
+                        [:number_of_clusters - len(clusters)])
+        pos = stop
+
+    cluster_list = []
+    for c in clusters:
+        if cluster_list and cluster_list[-1][1] == c - 1:
+            cluster_list[-1][1] = c
+        else:
+            cluster_list.append([c, c])
+    return cluster_list
+
+
+class _Candidate:
+
+    """a file being carved, it occupies contiguous clusters from `start'"""
+
+    __slots__ = ['start', 'signature', 'size', 'tail', 'last_cluster']
+
+    def __init__(self, start, signature, bytes_per_cluster):
+        self.start = start
+        self.signature = signature
+        # bytes searched for the footer so far
+        self.size = 0
+        # end of the last chunk searched, the footer may cross chunks
+        self.tail = b''
+        self.last_cluster = start - 1 + -(-signature.max_size //
+                                          bytes_per_cluster)
+
+    def found(self):
+        """the carved file if it ends here, without its footer"""
+        return (self.start, min(self.size, self.signature.max_size),
+                self.signature)
+
+
+def _find_headers(data, clusters, offset, bytes_per_cluster, signatures):
+    """`{cluster: signature}' of `clusters' which start with a header"""
+    found = {}
+    if not clusters:
+        return found
+
+    if numpy is not None:
+        length = max(len(s.header) for s in signatures)
+        rows = numpy.frombuffer(data, numpy.uint8,
+                                (clusters[-1] - offset + 1) *
+                                bytes_per_cluster).reshape(
+            -1, bytes_per_cluster)[numpy.array(clusters) - offset, :length]
+        for signature in reversed(signatures):
+            header = numpy.frombuffer(signature.header, numpy.uint8)
+            hits = (rows[:, :len(header)] == header).all(axis=1)
+            # earlier signatures take precedence
+            found.update((clusters[i], signature)
+                         for i in numpy.flatnonzero(hits).tolist())
+        return found
+
+    for c in clusters:
+        pos = (c - offset) * bytes_per_cluster
+        for signature in signatures:
+            if data[pos:pos + len(signature.header)] == signature.header:
+                found[c] = signature
+                break
+    return found
+
+
+def _merge_extents(extents):
+    merged = []
+    for start, end in sorted(extents):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def carve(stream, table, abs_c2b, bytes_per_cluster, signatures=SIGNATURES,
+          claimed=(), chunk_size=CARVE_CHUNK_SIZE):
+    """
+    yield `(first_cluster, size, signature)' of the files found in the free
+    clusters, each of them occupying contiguous clusters
+
+    table: the decoded FAT, free clusters are those with a zero entry
+    claimed: extents `[[start, end], ...]' of free clusters already known to
+    belong to a file, e.g. guessed for deleted entries, they are not carved
+    chunk_size: size of a single read, the data region is read front to back
+    once and only chunks with free clusters in them are read at all
+    """
+    clusters_per_chunk = max(chunk_size // bytes_per_cluster, 1)
+    buf = bytearray(clusters_per_chunk * bytes_per_cluster)
+
+    claimed = _merge_extents(claimed)
+    claimed_starts = [start for start, _ in claimed]
+
+    candidate = None
+    # first cluster which may start another file
+    resume = 2
+
+    for c0 in range(2, len(table), clusters_per_chunk):
+        c1 = min(c0 + clusters_per_chunk, len(table))
+
+        free = set(_free_clusters(_free_mask(table, c0, c1), c0))
+        for start, end in claimed[max(bisect_left(claimed_starts, c0) - 1, 0):
+                                  bisect_left(claimed_starts, c1)]:
+            free.difference_update(range(max(start, c0), min(end + 1, c1)))
+
+        if not free:
+            if candidate is not None:
+                yield candidate.found()
+                candidate = None
+            continue
+
+        stream.seek(abs_c2b(c0), os.SEEK_SET)
+        c1 = c0 + stream.readinto(
+            memoryview(buf)[:(c1 - c0) * bytes_per_cluster]) // \
+            bytes_per_cluster
+        free = sorted(c for c in free if c < c1)
+
+        headers = _find_headers(buf, [c for c in free if c >= resume], c0,
+                                bytes_per_cluster, signatures)
+        header_clusters = sorted(headers)
+
+        # next cluster to look at
+        pos = c0
+        while True:
+            if candidate is None:
+                i = bisect_left(header_clusters, max(pos, resume))
+                if i == len(header_clusters):
+                    break
+                pos = header_clusters[i]
+                candidate = _Candidate(pos, headers[pos], bytes_per_cluster)
+
+            # the candidate runs over free clusters up to the next allocated
+            # one, the next header, or its maximum size
+            limit = min(c1, candidate.last_cluster + 1)
+            i = bisect_left(header_clusters, max(pos, candidate.start + 1))
+            if i < len(header_clusters):
+                limit = min(limit, header_clusters[i])
+            run_end = pos
+            i = bisect_left(free, pos)
+            while run_end < limit and i < len(free) and free[i] == run_end:
+                run_end += 1
+                i += 1
+
+            a = (pos - c0) * bytes_per_cluster
+            b = (run_end - c0) * bytes_per_cluster
+            end = _find_footer(buf, a, b, candidate)
+            if end >= 0:
+                size = min(end, candidate.signature.max_size)
+                yield candidate.start, size, candidate.signature
+                resume = pos = candidate.start + -(-size // bytes_per_cluster)
+                candidate = None
+                continue
+
+            candidate.size += b - a
+            footer = candidate.signature.footer
+            if footer:
+                candidate.tail = bytes(buf[max(b - len(footer) + 1, a):b])
+
+            if run_end == c1:
+                # the candidate may go on in the next chunk
+                break
+
+            yield candidate.found()
+            resume = pos = run_end
+            candidate = None
+
+    if candidate is not None:
+        yield candidate.found()
+
+
+def _find_footer(buf, a, b, candidate):
+    """
+    size of the candidate if its footer is in `buf[a:b]', which follows the
+    bytes searched so far, or -1
+    """
+    footer = candidate.signature.footer
+    if not footer or b <= a:
+        return -1
+
+    # the footer may start in the previous chunk
+    joined = candidate.tail + bytes(buf[a:a + len(footer) - 1])
+    end = joined.find(footer)
+    if end >= 0:
+        end += candidate.size - len(candidate.tail)
+    else:
+        end = buf.find(footer, a, b)
+        if end < 0:
+            return -1
+        end += candidate.size - a
+
+    return end + len(footer) + candidate.signature.footer_extra
@@ -1,17 +1,32 @@
 # encoding: utf-8
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from functools import reduce
 import logging
 import os
+import struct
 from struct import unpack
 from construct import *
-from datetime import datetime, timezone
-from drive.fs import Partition
+from drive.fs import Partition, fold_path, split_path
+from drive.fs.fat32.fat import EOC_MAGIC, FAT_COMPARE_BLOCK_SIZE, \
+    read_fat_table, decode_fat_table, diff_fat_tables, chain_heads, \
+    FileAllocationTable, LazyFileAllocationTable
+from drive.fs.fat32.cluster_index import ClusterIndex
+from drive.fs.fat32.extraction import DEFAULT_MAX_IN_FLIGHT, \
+    select_entries, extract_entries
+from drive.fs.fat32.incremental import rescan
+from drive.fs.fat32.recovery import SIGNATURES, CARVE_CHUNK_SIZE, \
+    guess_cluster_list, carve
+from drive.fs.fat32.timestamps import fat_timestamp, utc_datetime
 from drive.keys import *
 from misc import STATE_LFN_ENTRY, STATE_DOS_ENTRY, MAGIC_END_SECTION, \
     clear_cur_obj, time_it, SimpleCounter, StateManager, STATE_START
 from stream.buffered_cluster_stream import BufferedClusterStream
 
+# upper bound of a single read when reading files out of the partition
+EXTRACT_READ_SIZE = 1024 * 1024 * 8
+
+
 FAT32BootSector = Struct(k_FAT32BootSector,
     Bytes       (k_jump_instruction, 3),
     String      (k_OEM_name, 8),
@@ -63,6 +78,13 @@ class FAT32DirectoryTableEntry:
     """
     This class is a bit ugly due to the __slots__ mechanism, which, however, can
     improve the performance somehow.
+
+    Timestamps are converted with `fat_timestamp', which caches every date,
+    and `create_time' and `modify_time' are built from them on access only.
+
+    Entries are decoded with the precompiled `_struct' into the same fields as
+    `__struct__', which is kept as the reference layout, because parsing with
+    construct costs far more than anything else done for an entry.
     """
 
     __struct__ = Struct(k_FAT32DirectoryTableEntry,
@@ -79,26 +101,30 @@ class FAT32DirectoryTableEntry:
                         ULInt16(k_modify_date),
                         ULInt16(k_lower_cluster),
                         ULInt32(k_file_length))
+    _struct = struct.Struct('<8s3sBxBHHHHHHHI')
+    _fields = (k_short_file_name, k_short_extension, k_attribute,
+               k_create_time_10ms, k_create_time, k_create_date,
+               k_access_date, k_higher_cluster, k_modify_time, k_modify_date,
+               k_lower_cluster, k_file_length)
+
     __slots__ = ['is_directory', 'cluster_list', 'full_path', 'first_cluster',
-                 'create_time', 'create_timestamp',
-                 'modify_time', 'modify_timestamp',
-                 'skip', 'is_deleted']
+                 'file_length', 'create_timestamp', 'modify_timestamp',
+                 'access_timestamp', 'skip', 'is_deleted']
 
     def __init__(self, raw, dir_name, state_mgr, current_obj, partition):
-        obj = self.__struct__.parse(raw)
+        obj = self._decode(raw)
 
         self.skip = False
-        self.is_deleted = b'\xe5' in obj[k_short_file_name]
+        self.is_deleted = obj[k_short_file_name].startswith(b'\xe5')
 
         self.is_directory = bool(obj[k_attribute] & 0x10)
 
         self.first_cluster = self._get_first_cluster(obj)
-        self.cluster_list = partition.resolve_cluster_list(self.first_cluster)\
-                            if not self.is_directory else ()
+        self.cluster_list = partition.resolve_cluster_list(self.first_cluster)
+        self.file_length = obj[k_file_length]
 
         try:
             name, ext = self._get_names(obj, state_mgr, current_obj)
-            print(dir_name, name, self.first_cluster)
             if name == '.' or name == '..':
                 self.skip = True
                 return
@@ -113,33 +139,57 @@ class FAT32DirectoryTableEntry:
 
         self.full_path = os.path.join(dir_name, name)
 
-        h, m, s = self._get_time(obj[k_create_time],
-                                 obj[k_create_time_10ms])
-        y, m_, d = self._get_date(obj[k_create_date])
-        try:
-            self.create_time = datetime(y, m_, d, h, m, int(s))
-            self.create_timestamp = (self.create_time.
-                                     replace(tzinfo=timezone.utc).
-                                     timestamp()
-                                     + s - int(s))
-        except ValueError:
-            partition.logger.warning('%s\\%s: invalid date %s, %s, %s',
-                                     dir_name, name, y, m_, d)
+        self.create_timestamp = fat_timestamp(obj[k_create_date],
+                                              obj[k_create_time],
+                                              obj[k_create_time_10ms])
+        self.modify_timestamp = fat_timestamp(obj[k_modify_date],
+                                              obj[k_modify_time])
+        # only the date of the last access is kept, it is often not recorded
+        self.access_timestamp = fat_timestamp(obj[k_access_date], 0)
+        if self.create_timestamp is None or self.modify_timestamp is None:
+            partition.logger.warning('%s\\%s: invalid date or time',
+                                     dir_name, name)
             self.skip = True
             return
 
-        h, m, s = self._get_time(obj[k_modify_time], 0)
-        y, m_, d = self._get_date(obj[k_modify_date])
-        try:
-            self.modify_time = datetime(y, m_, d, h, m, int(s))
-            self.modify_timestamp = (self.modify_time.
-                                     replace(tzinfo=timezone.utc).
-                                     timestamp())
-        except ValueError:
-            partition.logger.warning('%s\\%s: invalid date %s, %s, %s',
-                                     dir_name, name, y, m_, d)
-            self.skip = True
-            return
+    @property
+    def create_time(self):
+        if self.create_timestamp is not None:
+            return utc_datetime(self.create_timestamp)
+
+    @property
+    def modify_time(self):
+        if self.modify_timestamp is not None:
+            return utc_datetime(self.modify_timestamp)
+
+    @property
+    def access_time(self):
+        if self.access_timestamp is not None:
+            return utc_datetime(self.access_timestamp)
+
+    @classmethod
+    def _decode(cls, raw):
+        return dict(zip(cls._fields, cls._struct.unpack(raw)))
+
+    @classmethod
+    def from_record(cls, full_path, is_directory, first_cluster, cluster_list,
+                    file_length, create_timestamp, modify_timestamp,
+                    access_timestamp=None):
+        """rebuild an entry decoded earlier, e.g. from `FAT32IndexCache'"""
+        self = cls.__new__(cls)
+
+        self.skip = False
+        self.is_deleted = False
+        self.is_directory = is_directory
+        self.first_cluster = first_cluster
+        self.cluster_list = cluster_list
+        self.file_length = file_length
+        self.full_path = full_path
+        self.create_timestamp = create_timestamp
+        self.modify_timestamp = modify_timestamp
+        self.access_timestamp = access_timestamp
+
+        return self
 
     def _get_names(self, obj, state_mgr, current_obj):
         ext = ''
@@ -147,6 +197,8 @@ class FAT32DirectoryTableEntry:
             name = current_obj['name']
             if not self.is_directory:
                 ext = name.rsplit('.')[-1] if '.' in name else ''
+            if self.is_deleted:
+                name = '(deleted) ' + name
 
             state_mgr.transit_to(STATE_DOS_ENTRY)
             current_obj['name'] = ''
@@ -176,18 +228,6 @@ class FAT32DirectoryTableEntry:
                                  obj[k_short_extension])),
                       0)
 
-    @staticmethod
-    def _get_time(word, byte):
-        return ((word & 0xf800) >> 11,
-                (word & 0x07e0) >> 5,
-                (word & 0x001f) * 2 + byte * .01)
-
-    @staticmethod
-    def _get_date(word):
-        return (((word & 0xfe00) >> 9) + 1980,
-                (word & 0x01e0) >> 5,
-                word & 0x001f)
-
     @staticmethod
     def _get_first_cluster(obj):
         return obj[k_higher_cluster] << 16 | obj[k_lower_cluster]
@@ -205,11 +245,14 @@ class FAT32LongFilenameEntry:
                         String(k_name_2, 12),
                         ULInt16(None),
                         String(k_name_3, 4))
+    _struct = struct.Struct('<B10sxBB12s2x4s')
+    _fields = (k_sequence_number, k_name_1, k_type, k_checksum, k_name_2,
+               k_name_3)
 
     __slots__ = ['abort', 'is_deleted']
 
     def __init__(self, raw, state_mgr, current_obj, partition):
-        obj = self.__struct__.parse(raw)
+        obj = self._decode(raw)
 
         self.abort = False
         self.is_deleted = False
@@ -248,6 +291,10 @@ class FAT32LongFilenameEntry:
 
         current_obj['name'] = self._get_entry_name(obj) + current_obj['name']
 
+    @classmethod
+    def _decode(cls, raw):
+        return dict(zip(cls._fields, cls._struct.unpack(raw)))
+
     @staticmethod
     def _get_entry_name(obj):
         try:
@@ -268,13 +315,26 @@ class FAT32(Partition):
     _ul_int32 = ULInt32(None)
 
     def __init__(self, stream, preceding_bytes,
-                 read_fat2=False):
+                 read_fat2=False, cache=None, lazy=False):
+        """
+        cache: a `FAT32IndexCache', the decoded FAT and directory table are
+        loaded from it when the volume has not changed since it was stored
+        lazy: only parse the boot sector up front, the FAT is decoded when it
+        is first used, and until then cluster chains are resolved by reading
+        just the parts of the FAT they run through
+        read_fat2: decode FAT2 as well, to only verify it against FAT1 use
+        `check_fats', which is far cheaper
+        """
         super(FAT32, self).__init__(FAT32.type)
 
         self.logger = None
         self.setup_logger()
 
         self.stream = stream
+        self.preceding_bytes = preceding_bytes
+
+        self.cache = cache
+        self.cache_key = None
 
         self.logger.info('reading boot sector')
         self.boot_sector = FAT32BootSector.parse_stream(stream)
@@ -294,23 +354,127 @@ class FAT32(Partition):
 
         fat_abs_pos = self.s2b(self.boot_sector[k_number_of_reserved_sectors])
         fat_abs_pos += preceding_bytes
-        stream.seek(fat_abs_pos, os.SEEK_SET)
+        self.fat_abs_pos = fat_abs_pos
+        self.data_section_offset = fat_abs_pos + 2 * self.bytes_per_fat
+
+        self.read_fat2 = read_fat2
+        self._lazy_fat = None
+        self._fat1 = self._fat2 = None
+        self._number_of_eoc_1 = self._number_of_eoc_2 = None
+        if lazy:
+            self._lazy_fat = LazyFileAllocationTable(stream, fat_abs_pos,
+                                                     self.bytes_per_fat)
+            stream.seek(self.data_section_offset, os.SEEK_SET)
+        else:
+            self._read_fats()
+
+        self.fdt = {}
+        self.cluster_index = None
+
+    def _read_fats(self):
+        pos = self.stream.tell()
+
+        self.stream.seek(self.fat_abs_pos, os.SEEK_SET)
         self.logger.info('stream jumped to %d and ready to read FAT',
-                         fat_abs_pos)
+                         self.fat_abs_pos)
 
         self.logger.info('reading FAT')
-        res1 = self.fat1, self.number_of_eoc_1 = self.get_fat()
+        res1 = self._fat1, self._number_of_eoc_1 = self.get_fat()
         self.logger.info('read FAT, size of FAT is %d, number of EOCs is %d',
-                         self.bytes_per_fat, self.number_of_eoc_1)
-        if not read_fat2:
+                         self.bytes_per_fat, self._number_of_eoc_1)
+        if not self.read_fat2:
             self._jump(self.bytes_per_fat)
-            self.fat2, self.number_of_eoc_2 = res1
+            self._fat2, self._number_of_eoc_2 = res1
         else:
-            self.fat2, self.number_of_eoc_2 = self.get_fat()
+            self._fat2, self._number_of_eoc_2 = self.get_fat()
+
+        if self._lazy_fat is not None:
+            # lazily constructed, keep the stream where the caller left it
+            self.stream.seek(pos, os.SEEK_SET)
+            self._lazy_fat = None
+
+    def _ensure_fats(self):
+        if self._fat1 is None:
+            self._read_fats()
+
+    @property
+    def fat1(self):
+        self._ensure_fats()
+        return self._fat1
+
+    @property
+    def fat2(self):
+        self._ensure_fats()
+        return self._fat2
+
+    @property
+    def number_of_eoc_1(self):
+        self._ensure_fats()
+        return self._number_of_eoc_1
+
+    @property
+    def number_of_eoc_2(self):
+        self._ensure_fats()
+        return self._number_of_eoc_2
+
+    def use_fat(self, fat):
+        """use `fat', a `FileAllocationTable' read elsewhere, as both FATs"""
+        self._lazy_fat = None
+        self._fat1 = self._fat2 = fat
+        self._number_of_eoc_1 = self._number_of_eoc_2 = fat.number_of_eoc
+
+    def rescan(self, snapshot=None, block_size=FAT_COMPARE_BLOCK_SIZE):
+        """
+        read the FAT and the directory tree again, decoding only what changed
+        since `snapshot', a `VolumeSnapshot' of an earlier scan, returns
+        `(changes, snapshot)', see `incremental.rescan'
 
-        self.data_section_offset = fat_abs_pos + 2 * self.bytes_per_fat
+        `fdt' is set to the files and directories found
+        """
+        pos = self.stream.tell()
+        try:
+            changes, snapshot = rescan(self, snapshot, block_size)
+        finally:
+            self.stream.seek(pos, os.SEEK_SET)
 
-        self.fdt = {}
+        self.fdt = snapshot.files, snapshot.directories
+        self.cluster_index = ClusterIndex()
+        self._index(*self.fdt)
+        return changes, snapshot
+
+    def check_fats(self, block_size=FAT_COMPARE_BLOCK_SIZE):
+        """
+        compare FAT1 with FAT2 block by block on their raw bytes, which costs
+        little more than reading them, only blocks which differ are decoded
+
+        returns the cluster chains the copies disagree on as a list of
+        `(first_cluster, fat1_cluster_list, fat2_cluster_list)', empty if the
+        copies are identical, `first_cluster' is the head of the chain in FAT1
+        """
+        pos = self.stream.tell()
+        fat2_abs_pos = self.fat_abs_pos + self.bytes_per_fat
+        try:
+            differences = list(diff_fat_tables(self.stream, self.fat_abs_pos,
+                                               fat2_abs_pos,
+                                               self.bytes_per_fat,
+                                               block_size))
+            if not differences:
+                self.logger.info('FAT1 and FAT2 are identical')
+                return []
+
+            self.logger.warning('FAT1 and FAT2 differ in %d entries',
+                                len(differences))
+
+            # only the blocks of FAT2 the chains run through are decoded
+            fat2 = LazyFileAllocationTable(self.stream, fat2_abs_pos,
+                                           self.bytes_per_fat)
+            heads = chain_heads(self.fat1.table,
+                                [c for c, _, _ in differences])
+            return [(head, self.fat1.resolve_cluster_list(head),
+                     fat2.resolve_cluster_list(head))
+                    for head in sorted(set(heads.values()))]
+        finally:
+            self.stream.seek(pos, os.SEEK_SET)
 
     def setup_logger(self):
         self.logger = logging.getLogger('fat32')
@@ -322,9 +486,9 @@ class FAT32(Partition):
         ))
         self.logger.addHandler(handler)
 
-    def read_fdt(self):
+    def read_fdt(self, workers=1):
         self.logger.info('reading FDT')
-        self.fdt = self.get_fdt()
+        self.fdt = self.get_fdt(workers=workers)
 
     def _jump(self, size):
         self.stream.seek(size, os.SEEK_CUR)
@@ -340,16 +504,45 @@ class FAT32(Partition):
     def _next_ul_int32(self):
         return unpack('<I', self.stream.read(4))[0]
 
-    _eoc_magic = 0x0ffffff8
+    _eoc_magic = EOC_MAGIC
     def _is_eoc(self, n):
         return n & self._eoc_magic == self._eoc_magic
 
     @time_it
-    def get_fat(self):
+    def get_fat(self, bulk=True):
         """
         get file allocation table from current stream position,
-        returns the table represented in dict and number of EOCs
+        returns the table and number of EOCs
+
+        bulk: read the whole table at once and decode it as a typed array,
+        returned as a `FileAllocationTable', otherwise entries are read and
+        unpacked one by one into the legacy dict of cluster lists
         """
+        if not bulk:
+            return self._get_fat_by_entry()
+
+        raw = read_fat_table(self.stream, self.bytes_per_fat)
+        table = decode_fat_table(raw)
+        assert table[0] == self._eoc_magic
+        assert table[1] == 0xffffffff or table[1] == 0xfffffff
+
+        if self.cache is None or self.cache_key is not None:
+            fat = FileAllocationTable(table)
+            return fat, fat.number_of_eoc
+
+        # the first FAT read identifies the volume in the cache
+        self.cache_key = self.cache.key(self, raw)
+        index = self.cache.load_fat(self.cache_key)
+        if index is not None:
+            self.logger.info('loaded FAT index from cache')
+            fat = FileAllocationTable(table, index)
+        else:
+            fat = FileAllocationTable(table)
+            self.cache.store_fat(self.cache_key, self, fat)
+
+        return fat, fat.number_of_eoc
+
+    def _get_fat_by_entry(self):
         _0 = self._next_ul_int32()
         _1 = self._next_ul_int32()
         assert _0 == self._eoc_magic
@@ -380,6 +573,7 @@ class FAT32(Partition):
             head = cluster_head.pop(i, i)
 
             if self._is_eoc(c):
+                number_of_eoc.inc()
                 if not obj[head]:
                     obj[head].append([head, head])
 
@@ -399,33 +593,320 @@ class FAT32(Partition):
 
         [_operate(i) for i in range(2, number_of_fat_items)]
 
-        return obj, number_of_eoc
+        return obj, int(number_of_eoc)
 
-    def get_fdt(self, root_dir_name='/'):
-        # task := (directory_name, fdt_abs_start_byte_pos)
-        __tasks__ = [(root_dir_name,
-                      self.resolve_cluster_list(2))]
+    def get_fdt(self, root_dir_name='/', workers=1):
+        """
+        walk the directory tree, returns files and directories keyed by path
+
+        workers: number of directories read at the same time, the workers
+        share the stream, which they only read with `readinto_at'
+        """
+        use_cache = self.cache is not None and root_dir_name == '/'
+        if use_cache:
+            # the FAT identifies the volume in the cache
+            self._ensure_fats()
+            cached = self.cache.load_fdt(self.cache_key,
+                                         FAT32DirectoryTableEntry, self)
+            if cached is not None:
+                self.logger.info('loaded FDT from cache')
+                self.cluster_index = ClusterIndex()
+                self._index(*cached)
+                return cached
+
+        # task := (directory_name, cluster_list)
+        __tasks__ = deque([(root_dir_name,
+                            self.resolve_cluster_list(2))])
 
         files = {}
         directories = {}
 
-        while __tasks__:
-            dir_name, cluster_list = __tasks__.pop(0)
+        # filled as the tree is walked, queries see what is found so far
+        self.cluster_index = ClusterIndex()
 
-            directories[dir_name] = cluster_list
+        if workers > 1:
+            self._walk_parallel(__tasks__, files, directories, workers)
+        else:
+            while __tasks__:
+                dir_name, cluster_list = __tasks__.popleft()
 
-            if dir_name.startswith(u'\u00e5'):
-                continue
+                directories[dir_name] = cluster_list
+                self.cluster_index.add(dir_name, cluster_list)
 
-            files.update(self._discover(__tasks__, dir_name, cluster_list))
+                if dir_name.startswith(u'\u00e5'):
+                    continue
+
+                found = self._discover(__tasks__, dir_name, cluster_list)
+                files.update(found)
+                self._index(found)
 
         self.logger.info('found %s files and dirs in total', len(files) +
                                                              len(directories))
 
+        if use_cache:
+            self.cache.store_fdt(self.cache_key, self, files, directories)
+
         return files, directories
 
+    def _index(self, files, directories=None):
+        for path, entry in files.items():
+            self.cluster_index.add(path, entry.cluster_list)
+        for path, cluster_list in (directories or {}).items():
+            self.cluster_index.add(path, cluster_list)
+
+    def owner_of_cluster(self, cluster):
+        """
+        path of the file or directory whose cluster chain holds `cluster', or
+        None if the cluster is free or not reachable from the root
+
+        answered from `cluster_index', which is filled by `get_fdt' as it
+        walks the tree, the tree is read first if it has not been
+        """
+        if self.cluster_index is None:
+            self.read_fdt()
+        return self.cluster_index.owner_of_cluster(cluster)
+
+    def owner_of_offset(self, offset):
+        """
+        path of the file or directory holding the byte at absolute `offset'
+        of the stream, or None, see `owner_of_cluster'
+        """
+        if offset < self.data_section_offset:
+            return None
+        return self.owner_of_cluster(
+            (offset - self.data_section_offset) // self.bytes_per_cluster + 2)
+
+    def iter_entries(self, path_prefix='/'):
+        """
+        walk the directory tree lazily, yields `FAT32DirectoryTableEntry' of
+        files and directories as soon as they are decoded
+
+        path_prefix: only entries at or below this path are yielded, and only
+        directories leading to it are read, case is ignored
+        stop iterating, e.g. with `itertools.islice', to end the walk early
+        """
+        prefix = split_path(path_prefix)
+
+        # task := (directory_name, cluster_list)
+        __tasks__ = deque([('/', self.resolve_cluster_list(2))])
+
+        while __tasks__:
+            dir_name, cluster_list = __tasks__.popleft()
+
+            if dir_name.startswith(u'\u00e5'):
+                continue
+
+            for entry in self._iter_directory(dir_name, cluster_list):
+                parts = split_path(entry.full_path)
+                depth = min(len(parts), len(prefix))
+                if parts[:depth] != prefix[:depth]:
+                    # neither leading to nor below the prefix
+                    continue
+
+                if entry.is_directory:
+                    __tasks__.append((entry.full_path, entry.cluster_list))
+
+                if len(parts) >= len(prefix):
+                    yield entry
+
+    def iter_deleted_entries(self):
+        """
+        walk the directory tree, deleted directories included, and yield the
+        deleted entries of files and directories
+
+        the FAT no longer holds their chains, their cluster lists are guessed
+        as the free clusters following the first one, enough to hold the file,
+        and a single cluster for a directory, which is only walked if it still
+        starts with its `.' entry
+        """
+        table = self.fat1.table
+
+        # task := (directory_name, cluster_list, is_deleted)
+        __tasks__ = deque([('/', self.resolve_cluster_list(2), False)])
+
+        while __tasks__:
+            dir_name, cluster_list, dir_deleted = __tasks__.popleft()
+
+            for entry in self._iter_directory(dir_name, cluster_list,
+                                              include_deleted=True):
+                # entries of a deleted directory are gone with it
+                if entry.is_deleted or dir_deleted:
+                    entry.is_deleted = True
+                    entry.cluster_list = guess_cluster_list(
+                        table, entry.first_cluster,
+                        1 if entry.is_directory else
+                        -(-entry.file_length // self.bytes_per_cluster))
+
+                    if entry.is_directory and entry.cluster_list and \
+                            self._is_directory_cluster(
+                                entry.cluster_list[0][0]):
+                        __tasks__.append((entry.full_path,
+                                          entry.cluster_list, True))
+                    yield entry
+
+                elif entry.is_directory:
+                    __tasks__.append((entry.full_path, entry.cluster_list,
+                                      False))
+
+    def _is_directory_cluster(self, cluster):
+        self.stream.seek(self.abs_c2b(cluster), os.SEEK_SET)
+        return self.stream.read(11) == b'.          '
+
+    def recover(self, carve_free=True, signatures=SIGNATURES,
+                chunk_size=CARVE_CHUNK_SIZE):
+        """
+        deleted files, as `FAT32DirectoryTableEntry' keyed by path like the
+        files returned by `get_fdt', ready for `open_file' and `extract'
+
+        files come from the deleted directory entries, see
+        `iter_deleted_entries', and with `carve_free' also from the free
+        clusters no deleted entry claims, found by their `signatures' in a
+        single pass over the data region reading `chunk_size' at a time, they
+        are named `/(carved)/<first cluster>.<extension>'
+        """
+        files = {}
+        claimed = []
+
+        for entry in self.iter_deleted_entries():
+            claimed.extend(entry.cluster_list)
+            if entry.is_directory:
+                continue
+            if entry.full_path in files:
+                entry.full_path = '%s (%d)' % (entry.full_path,
+                                               entry.first_cluster)
+            files[entry.full_path] = entry
+
+        self.logger.info('found %d deleted files', len(files))
+
+        if carve_free:
+            for first_cluster, size, signature in carve(
+                    self.stream, self.fat1.table, self.abs_c2b,
+                    self.bytes_per_cluster, signatures, claimed, chunk_size):
+                path = '/(carved)/%d.%s' % (first_cluster, signature.extension)
+                last_cluster = first_cluster - 1 + \
+                    -(-size // self.bytes_per_cluster)
+                entry = FAT32DirectoryTableEntry.from_record(
+                    path, False, first_cluster,
+                    [[first_cluster, last_cluster]], size, None, None)
+                entry.is_deleted = True
+                files[path] = entry
+
+            self.logger.info('found %d files in total after carving',
+                             len(files))
+
+        return files
+
+    def _walk_parallel(self, tasks, files, directories, workers):
+        def _walk(dir_name, cluster_list):
+            sub_tasks = []
+            return sub_tasks, self._discover(sub_tasks, dir_name,
+                                             cluster_list)
+
+        pending = set()
+        with ThreadPoolExecutor(workers) as pool:
+            while tasks or pending:
+                # keep every worker busy and a few directories queued
+                while tasks and len(pending) < 2 * workers:
+                    dir_name, cluster_list = tasks.popleft()
+
+                    directories[dir_name] = cluster_list
+                    self.cluster_index.add(dir_name, cluster_list)
+
+                    if dir_name.startswith(u'\u00e5'):
+                        continue
+
+                    pending.add(pool.submit(_walk, dir_name, cluster_list))
+
+                if not pending:
+                    continue
+
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    sub_tasks, found = future.result()
+                    tasks.extend(sub_tasks)
+                    files.update(found)
+                    self._index(found)
+
+    def find_entry(self, path):
+        """
+        `FAT32DirectoryTableEntry' of the file or directory at `path', case
+        is ignored, raises FileNotFoundError if there is none
+        """
+        # the tree may have been read by `read_fdt'
+        entry = self._find_in_fdt(path)
+        if entry is not None:
+            return entry
+
+        full_path = fold_path(path)
+        for entry in self.iter_entries(full_path):
+            if fold_path(entry.full_path) == full_path:
+                return entry
+
+        raise FileNotFoundError(path)
+
+    def open_file(self, path, max_read_size=EXTRACT_READ_SIZE):
+        """
+        open the file at `path', or given as its `FAT32DirectoryTableEntry',
+        for reading, returns a `BufferedClusterStream' over its cluster chain
+        trimmed to its length
+
+        max_read_size: upper bound of a single read of a contiguous extent
+        """
+        entry = path
+        if not isinstance(entry, FAT32DirectoryTableEntry):
+            entry = self.find_entry(path)
+        if entry.is_directory:
+            raise IsADirectoryError(entry.full_path)
+
+        stream = BufferedClusterStream(self.stream, entry.cluster_list,
+                                       self.abs_c2b, self.bytes_per_cluster,
+                                       max_read_size, entry.file_length)
+        if stream.size < entry.file_length:
+            self.logger.warning('%s: cluster chain holds %d of %d bytes',
+                                entry.full_path, stream.size,
+                                entry.file_length)
+        return stream
+
+    def extract(self, path, dest, max_read_size=EXTRACT_READ_SIZE):
+        """
+        copy the content of the file at `path', or given as its
+        `FAT32DirectoryTableEntry', to `dest', a path or a writable binary
+        file, returns the number of bytes copied
+        """
+        with self.open_file(path, max_read_size) as stream:
+            if not isinstance(dest, (str, bytes, os.PathLike)):
+                return stream.copy_to(dest)
+
+            with open(dest, 'wb') as out:
+                return stream.copy_to(out)
+
+    def extract_many(self, patterns, dest_dir, workers=4,
+                     max_in_flight=DEFAULT_MAX_IN_FLIGHT, progress=None):
+        """
+        extract the files matching `patterns', paths or glob patterns, into
+        `dest_dir' keeping their paths, returns a dict of the output path of
+        every file keyed by its path
+
+        the extents of all files are read in the order of their physical
+        offsets in a single pass, see `extract_entries' for the arguments
+        """
+        files, _ = self.fdt or self.get_fdt()
+        entries = select_entries(files, patterns)
+        self.logger.info('extracting %d files', len(entries))
+
+        return extract_entries(self.stream, entries, dest_dir, self.abs_c2b,
+                               self.bytes_per_cluster, EXTRACT_READ_SIZE,
+                               workers, max_in_flight, progress)
+
     def resolve_cluster_list(self, first_cluster, fat=None):
-        fat = fat or self.fat1
+        if fat is None:
+            fat = self._lazy_fat if self._lazy_fat is not None else self.fat1
+
+        if isinstance(fat, LazyFileAllocationTable):
+            return fat.resolve_cluster_list(first_cluster)
+
+        if isinstance(fat, FileAllocationTable):
+            return fat.resolve_cluster_list(first_cluster)
 
         if first_cluster in fat:
             # a bit ugly, may be refactored later
@@ -439,31 +920,59 @@ class FAT32(Partition):
     def abs_c2b(self, cluster):
         return self.c2b(cluster - 2) + self.data_section_offset
 
+    @property
+    def number_of_clusters(self):
+        """entries of the FAT, including the two reserved ones"""
+        return self.bytes_per_fat // 4
+
     def _discover(self, tasks, dir_name, cluster_list):
+        files = {}
+
+        for entry in self._iter_directory(dir_name, cluster_list):
+            if entry.is_directory:
+                # append new directory task to tasks
+                tasks.append((entry.full_path, entry.cluster_list))
+            else:
+                # regular 8.3 entry
+                files[entry.full_path] = entry
+
+        return files
+
+    def _iter_raw_entries(self, stream, dir_name):
+        """yield 32-byte records of a directory, reading a cluster at a time"""
+        while True:
+            chunk = stream.read(self.bytes_per_cluster)
+
+            for offset in range(0, len(chunk) - 31, 32):
+                yield chunk[offset:offset + 32]
+
+            if len(chunk) < self.bytes_per_cluster:
+                if stream.tell() >= stream.size:
+                    self.logger.warning('cluster list exhausted at %s',
+                                        dir_name)
+                return
+
+    def _iter_directory(self, dir_name, cluster_list, include_deleted=False):
+        """
+        yield entries of files and subdirectories of a single directory
+
+        include_deleted: yield deleted entries too, their cluster lists are
+        whatever the FAT says about their first cluster now
+        """
         if 'System Volume Information' in dir_name:
-            return {}
+            return
 
         __blank__ = b'\x00'
 
         __state__ = StateManager(STATE_START)
         __cur_obj__ = {'name': '', 'checksum': 0}
 
-        files = {}
-
         with BufferedClusterStream(self.stream,
                                    cluster_list,
-                                   self.abs_c2b) as stream:
-            while True:
-                try:
-                    raw = stream.read(32)
-                except StopIteration:
-                    self.logger.warning('cluster list exhausted at %s',
-                                        dir_name)
-                    break
-
-                if len(raw) < 32:
-                    break
-                elif raw.startswith(__blank__):
+                                   self.abs_c2b,
+                                   self.bytes_per_cluster) as stream:
+            for raw in self._iter_raw_entries(stream, dir_name):
+                if raw.startswith(__blank__):
                     break
 
                 attribute = raw[0xb]
@@ -482,15 +991,8 @@ class FAT32(Partition):
                     if attribute == 0xb:
                         print('label: %s' % entry.full_path[1:])
 
-                    if entry.skip or entry.is_deleted:
+                    if entry.skip or \
+                            entry.is_deleted and not include_deleted:
                         continue
 
-                    if entry.is_directory:
-                        # append new directory task to tasks
-                        tasks.append((entry.full_path,
-                                      self.fat1[entry.first_cluster]))
-                    else:
-                        # regular 8.3 entry
-                        files[entry.full_path] = entry
-
-        return files
+                    yield entry
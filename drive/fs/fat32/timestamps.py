@@ -0,0 +1,62 @@
+# encoding: utf-8
+"""
+conversion of FAT date and time words into POSIX timestamps
+
+a FAT date or time is a 16-bit word, so there are at most 65536 of each and
+the handful of distinct values found on a volume are converted only once
+"""
+from datetime import date, datetime, timezone
+
+__all__ = ['fat_date_to_seconds', 'fat_timestamp', 'utc_datetime']
+
+_EPOCH = date(1970, 1, 1).toordinal()
+
+# seconds since the epoch at midnight of every date word seen so far, None if
+# the word is not a valid date
+_date_seconds = {}
+
+# seconds since midnight of the hours and minutes of a time word, indexed by
+# `word >> 5', None if they are out of range
+_time_seconds = [h * 3600 + m * 60 if h < 24 and m < 60 else None
+                 for h in range(32) for m in range(64)]
+
+
+def fat_date_to_seconds(word):
+    """seconds since the epoch at midnight UTC of the date, or None"""
+    try:
+        return _date_seconds[word]
+    except KeyError:
+        pass
+
+    try:
+        seconds = (date(((word & 0xfe00) >> 9) + 1980,
+                        (word & 0x01e0) >> 5,
+                        word & 0x001f).toordinal() - _EPOCH) * 86400
+    except ValueError:
+        seconds = None
+    _date_seconds[word] = seconds
+    return seconds
+
+
+def fat_timestamp(date_word, time_word, time_10ms=0):
+    """
+    POSIX timestamp of a FAT date and time taken as UTC, or None if either of
+    them is invalid
+    time_10ms: the 10 ms units of the creation time, 0 for other times
+    """
+    day = fat_date_to_seconds(date_word)
+    seconds = _time_seconds[time_word >> 5]
+    if day is None or seconds is None:
+        return None
+
+    s = (time_word & 0x001f) * 2 + time_10ms * .01
+    whole = int(s)
+    if whole > 59:
+        return None
+    return float(day + seconds + whole) + s - whole
+
+
+def utc_datetime(timestamp):
+    """naive datetime in UTC of a timestamp, without the fraction of second"""
+    return datetime.fromtimestamp(int(timestamp), timezone.utc).\
+        replace(tzinfo=None)
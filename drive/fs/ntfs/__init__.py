@@ -0,0 +1,20 @@
+# encoding: utf-8
+from drive.fs.ntfs.structs import NTFS, NTFSEntry
+from drive.keys import *
+import os
+
+__all__ = ['get_ntfs_obj', 'get_ntfs_partition', 'NTFS', 'NTFSEntry']
+
+
+def get_ntfs_obj(entry, stream, **_):
+    """options of the FAT32 class, e.g. `cache', are ignored"""
+    first_byte_addr = entry[k_first_byte_address]
+
+    stream.seek(first_byte_addr, os.SEEK_SET)
+
+    return NTFS(stream, preceding_bytes=first_byte_addr)
+
+
+def get_ntfs_partition(stream):
+    """use this function if you have partition image"""
+    return NTFS(stream, preceding_bytes=0)
@@ -0,0 +1,668 @@
+# encoding: utf-8
+from collections import namedtuple
+import io
+import logging
+import os
+import struct
+from construct import *
+from drive.fs import Partition
+from drive.fs.fat32.timestamps import utc_datetime
+from drive.keys import *
+from stream.buffered_cluster_stream import BufferedClusterStream
+
+# upper bound of a single read of the $MFT
+MFT_READ_CHUNK_SIZE = 1024 * 1024 * 16
+
+# upper bound of a single read when reading files out of the partition
+EXTRACT_READ_SIZE = 1024 * 1024 * 8
+
+# the update sequence array protects the last two bytes of every 512 bytes
+UPDATE_SEQUENCE_STRIDE = 512
+
+# 100 ns intervals between 1601-01-01 and 1970-01-01
+_FILETIME_EPOCH = 116444736000000000
+
+ROOT_RECORD_NUMBER = 5
+
+AT_STANDARD_INFORMATION = 0x10
+AT_ATTRIBUTE_LIST = 0x20
+AT_FILE_NAME = 0x30
+AT_DATA = 0x80
+AT_INDEX_ALLOCATION = 0xa0
+AT_END = 0xffffffff
+
+# name of the index allocation of the file names of a directory, $Secure and
+# others have index allocations by other names
+I30 = '$I30'
+
+FILE_RECORD_IN_USE = 0x1
+FILE_RECORD_IS_DIRECTORY = 0x2
+
+# $FILE_NAME namespaces, DOS names are only used if there is no other
+NAMESPACE_DOS = 2
+
+
+NTFSBootSector = Struct(k_NTFSBootSector,
+    Bytes       (k_jump_instruction, 3),
+    String      (k_OEM_name, 8),
+    ULInt16     (k_bytes_per_sector),
+    ULInt8      (k_sectors_per_cluster),
+    ULInt16     (k_number_of_reserved_sectors),
+    Padding(5),
+    ULInt8      (k_media_descriptor),
+    Padding(2),
+    ULInt16     (k_sectors_per_track),
+    ULInt16     (k_number_of_heads),
+    ULInt32     (k_number_of_hidden_sectors),
+    Padding(8),
+    ULInt64     (k_number_of_sectors),
+    ULInt64     (k_MFT_cluster),
+    ULInt64     (k_MFT_mirror_cluster),
+    SLInt8      (k_clusters_per_file_record),
+    Padding(3),
+    SLInt8      (k_clusters_per_index_buffer),
+    Padding(3),
+    ULInt64     (k_volume_serial_number),
+    allow_overwrite=True
+)
+
+# magic, update sequence offset and count, $LogFile sequence number, sequence
+# number, hard link count, offset of the first attribute, flags, bytes in
+# use, bytes allocated, base record reference
+_record_header = struct.Struct('<4sHHQHHHHIIQ')
+# type, length, non-resident flag, name length, name offset, flags, id
+_attribute_header = struct.Struct('<IIBBHHH')
+# value length, value offset
+_resident_header = struct.Struct('<IH')
+# first VCN, last VCN, data runs offset, allocated, real and initialized size
+_non_resident_header = struct.Struct('<QQH6xQQQ')
+# creation, modification, MFT modification and access time
+_standard_information = struct.Struct('<QQQQ')
+# parent reference, 4 times, allocated and real size, flags, reparse value,
+# name length in characters, namespace
+_file_name = struct.Struct('<QQQQQQQIIBB')
+
+FileRecord = namedtuple('FileRecord', [
+    'in_use', 'is_directory', 'base_record', 'names', 'times', 'data',
+    'index_allocation'])
+FileRecord.__doc__ = """
+attributes of a FILE record needed for the directory tree
+base_record: number of the base record of an extension record, or None
+names: `(parent_record, namespace, name)' of every $FILE_NAME
+times: creation, modification and access FILETIME of $STANDARD_INFORMATION
+or None
+data: the unnamed $DATA as `(first_vcn, extents, size)', where extents is
+None if it is resident and may hold sparse runs, see `decode_runlist',
+`size' is only valid in the part starting at VCN 0
+index_allocation: extents of the $I30 index allocation, or None
+"""
+
+
+def decode_runlist(buf, pos, end):
+    """
+    extents `[[start, end], ...]' of the data runs at `buf[pos:end]' in VCN
+    order, a sparse run has no clusters and is given as `[None, length]', it
+    reads as zeros, see `BufferedClusterStream'
+    """
+    extents = []
+    lcn = 0
+    while pos < end:
+        header = buf[pos]
+        if not header:
+            break
+        length_size, offset_size = header & 0xf, header >> 4
+        pos += 1
+        length = int.from_bytes(buf[pos:pos + length_size], 'little')
+        pos += length_size
+        if not offset_size:
+            # sparse run, no clusters are allocated
+            if extents and extents[-1][0] is None:
+                extents[-1][1] += length
+            else:
+                extents.append([None, length])
+            continue
+        lcn += int.from_bytes(buf[pos:pos + offset_size], 'little',
+                              signed=True)
+        pos += offset_size
+
+        if extents and extents[-1][0] is not None and \
+                extents[-1][1] + 1 == lcn:
+            extents[-1][1] = lcn + length - 1
+        else:
+            extents.append([lcn, lcn + length - 1])
+
+    return extents
+
+
+def allocated_extents(extents):
+    """`extents' without the sparse runs, merged where they are adjacent"""
+    cluster_list = []
+    for start, end in extents:
+        if start is None:
+            continue
+        if cluster_list and cluster_list[-1][1] + 1 == start:
+            cluster_list[-1][1] = end
+        else:
+            cluster_list.append([start, end])
+    return cluster_list
+
+
+def apply_fixups(buf, offset, record_size):
+    """
+    restore the sector ends of the record at `buf[offset:]' in place from its
+    update sequence array, returns False if the record is torn
+    """
+    usa_offset, usa_count = struct.unpack_from('<HH', buf, offset + 4)
+    usa = offset + usa_offset
+    if usa_count < 1 or \
+            (usa_count - 1) * UPDATE_SEQUENCE_STRIDE > record_size or \
+            usa_offset + 2 * usa_count > record_size:
+        return False
+
+    usn = buf[usa:usa + 2]
+    for i in range(1, usa_count):
+        end = offset + i * UPDATE_SEQUENCE_STRIDE - 2
+        if buf[end:end + 2] != usn:
+            return False
+        buf[end:end + 2] = buf[usa + 2 * i:usa + 2 * i + 2]
+
+    return True
+
+
+def decode_record(buf, offset, record_size, fixed_up=False):
+    """
+    decode the FILE record at `buf[offset:]', its fixups are applied to `buf'
+    in place unless `fixed_up', returns a `FileRecord' or None if there is no
+    valid record
+    """
+    if not fixed_up and (buf[offset:offset + 4] != b'FILE' or
+                         not apply_fixups(buf, offset, record_size)):
+        return None
+
+    (_, _, _, _, _, _, attribute_offset, flags, bytes_in_use, _,
+     base_reference) = _record_header.unpack_from(buf, offset)
+
+    names = []
+    times = None
+    data = None
+    index_allocation = None
+
+    pos = offset + attribute_offset
+    end = offset + min(bytes_in_use, record_size)
+    while pos + 16 <= end:
+        (type_, length, non_resident, name_length, name_offset, _,
+         _) = _attribute_header.unpack_from(buf, pos)
+        if type_ == AT_END or length < 16 or pos + length > end:
+            break
+
+        if not non_resident:
+            value_length, value_offset = _resident_header.unpack_from(
+                buf, pos + 16)
+            value = pos + value_offset
+
+            if type_ == AT_STANDARD_INFORMATION:
+                created, modified, _, accessed = \
+                    _standard_information.unpack_from(buf, value)
+                times = created, modified, accessed
+            elif type_ == AT_FILE_NAME:
+                (parent, _, _, _, _, _, _, _, _, length_, namespace) = \
+                    _file_name.unpack_from(buf, value)
+                name = bytes(buf[value + 66:value + 66 + 2 * length_])
+                names.append((parent & 0xffffffffffff, namespace,
+                              name.decode('utf-16-le', 'replace')))
+            elif type_ == AT_DATA and not name_length:
+                data = 0, None, value_length
+
+        elif type_ == AT_DATA and not name_length or \
+                type_ == AT_INDEX_ALLOCATION and _attribute_name(
+                    buf, pos + name_offset, name_length) == I30:
+            (first_vcn, _, runs_offset, _, size,
+             _) = _non_resident_header.unpack_from(buf, pos + 16)
+            extents = decode_runlist(buf, pos + runs_offset, pos + length)
+            if type_ == AT_DATA:
+                data = first_vcn, extents, size
+            else:
+                index_allocation = allocated_extents(extents)
+
+        pos += length
+
+    # the reference of a base record is 0, that of an extension record
+    # carries a sequence number even if it refers to record 0
+    base_record = base_reference & 0xffffffffffff if base_reference else None
+    return FileRecord(bool(flags & FILE_RECORD_IN_USE),
+                      bool(flags & FILE_RECORD_IS_DIRECTORY), base_record,
+                      names, times, data, index_allocation)
+
+
+def _attribute_name(buf, pos, name_length):
+    return bytes(buf[pos:pos + 2 * name_length]).decode('utf-16-le',
+                                                          'replace')
+
+
+def _copy(stream, out):
+    if isinstance(stream, BufferedClusterStream):
+        return stream.copy_to(out)
+    return out.write(stream.read())
+
+
+def _filetime_to_timestamp(filetime):
+    if not filetime:
+        return None
+    return (filetime - _FILETIME_EPOCH) / 1e7
+
+
+class NTFSEntry:
+
+    """
+    a file or directory of the $MFT, with the same attributes as
+    `FAT32DirectoryTableEntry', so the tools built around `get_fdt' work on
+    NTFS too, cluster numbers are logical cluster numbers of the volume
+    """
+
+    __slots__ = ['is_directory', 'cluster_list', 'full_path', 'first_cluster',
+                 'file_length', 'create_timestamp', 'modify_timestamp',
+                 'access_timestamp', 'is_deleted', 'is_resident', 'record_number',
+                 'parent_record', 'name', 'data_runs', 'extents']
+
+    def __init__(self, record_number, record, name, parent_record):
+        self.record_number = record_number
+        self.is_directory = record.is_directory
+        self.is_deleted = False
+        self.name = name
+        self.parent_record = parent_record
+        self.full_path = None
+
+        created, modified, accessed = record.times or (0, 0, 0)
+        self.create_timestamp = _filetime_to_timestamp(created)
+        self.modify_timestamp = _filetime_to_timestamp(modified)
+        self.access_timestamp = _filetime_to_timestamp(accessed)
+
+        self.is_resident = False
+        self.file_length = 0
+        # `(first_vcn, extents)' of every part of the $DATA attribute, which
+        # may be spread over extension records
+        self.data_runs = []
+        # extents of $DATA in VCN order, sparse runs included, which are left
+        # out of `cluster_list'
+        self.extents = ()
+        self.cluster_list = ()
+        self.first_cluster = 0
+        if record.is_directory:
+            self.cluster_list = record.index_allocation or ()
+        else:
+            self.add_data(record.data)
+
+    def add_data(self, data):
+        if data is None:
+            return
+        first_vcn, extents, size = data
+        if extents is None:
+            self.is_resident = True
+            self.file_length = size
+            return
+        if first_vcn == 0:
+            self.file_length = size
+        self.data_runs.append((first_vcn, extents))
+
+    def resolve_cluster_list(self):
+        """merge the parts of $DATA into `extents' and `cluster_list' in VCN
+        order"""
+        if self.is_directory or not self.data_runs:
+            return
+
+        self.extents = [list(extent) for _, extents in
+                        sorted(self.data_runs, key=lambda part: part[0])
+                        for extent in extents]
+        cluster_list = allocated_extents(self.extents)
+        self.cluster_list = cluster_list
+        self.first_cluster = cluster_list[0][0] if cluster_list else 0
+        self.data_runs = None
+
+    @property
+    def create_time(self):
+        if self.create_timestamp is not None:
+            return utc_datetime(self.create_timestamp)
+
+    @property
+    def modify_time(self):
+        if self.modify_timestamp is not None:
+            return utc_datetime(self.modify_timestamp)
+
+    @property
+    def access_time(self):
+        if self.access_timestamp is not None:
+            return utc_datetime(self.access_timestamp)
+
+
+class NTFS(Partition):
+
+    type = 'NTFS'
+
+    def __init__(self, stream, preceding_bytes,
+                 mft_chunk_size=MFT_READ_CHUNK_SIZE):
+        """
+        mft_chunk_size: upper bound of a single read of the $MFT, which is
+        read in one sequential pass
+        """
+        super(NTFS, self).__init__(NTFS.type)
+
+        self.logger = None
+        self.setup_logger()
+
+        self.stream = stream
+        self.preceding_bytes = preceding_bytes
+        self.mft_chunk_size = mft_chunk_size
+
+        self.logger.info('reading boot sector')
+        self.boot_sector = NTFSBootSector.parse_stream(stream)
+        if self.boot_sector[k_OEM_name] != b'NTFS    ':
+            raise ValueError('not an NTFS boot sector: OEM name is %r' %
+                             self.boot_sector[k_OEM_name])
+
+        self.bytes_per_sector = self.boot_sector[k_bytes_per_sector]
+        self.bytes_per_cluster = self.bytes_per_sector *\
+                                 self.boot_sector[k_sectors_per_cluster]
+
+        clusters_per_record = self.boot_sector[k_clusters_per_file_record]
+        if clusters_per_record > 0:
+            self.bytes_per_record = self.c2b(clusters_per_record)
+        else:
+            self.bytes_per_record = 1 << -clusters_per_record
+
+        self.mft_abs_pos = self.abs_c2b(self.boot_sector[k_MFT_cluster])
+        self.logger.info('read boot sector, bytes per sector is %d, '
+                         'bytes per cluster is %d, bytes per record is %d',
+                         self.bytes_per_sector, self.bytes_per_cluster,
+                         self.bytes_per_record)
+
+        # `(first_vcn, start, end)' of the extents of the $MFT, known once it
+        # has been read
+        self.mft_extents = None
+        self.mft_size = 0
+
+        self.fdt = {}
+
+    def setup_logger(self):
+        self.logger = logging.getLogger('ntfs')
+        self.logger.setLevel(logging.DEBUG)
+        if not self.logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setLevel(logging.DEBUG)
+            handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(name)s - %(levelname)s: %(message)s'
+            ))
+            self.logger.addHandler(handler)
+
+    def s2b(self, n):
+        """sector to byte"""
+        return self.bytes_per_sector * n
+
+    def c2b(self, n):
+        """cluster to byte"""
+        return self.bytes_per_cluster * n
+
+    def abs_c2b(self, cluster):
+        return self.c2b(cluster) + self.preceding_bytes
+
+    @property
+    def number_of_clusters(self):
+        return self.boot_sector[k_number_of_sectors] // \
+               self.boot_sector[k_sectors_per_cluster]
+
+    def read_fdt(self):
+        self.logger.info('reading FDT')
+        self.fdt = self.get_fdt()
+
+    def _record_address(self, record_number):
+        """absolute address of a record, or None if it is beyond the $MFT"""
+        pos = record_number * self.bytes_per_record
+        if self.mft_extents is None:
+            # only the start of the $MFT is known, which holds record 0
+            return self.mft_abs_pos + pos
+
+        vcn, offset = divmod(pos, self.bytes_per_cluster)
+        for first_vcn, start, end in self.mft_extents:
+            if first_vcn <= vcn <= first_vcn + end - start:
+                return self.abs_c2b(start + vcn - first_vcn) + offset
+        return None
+
+    def _read_raw_record(self, record_number):
+        """bytes of a record with its fixups applied, or None"""
+        address = self._record_address(record_number)
+        if address is None:
+            return None
+
+        buf = bytearray(self.bytes_per_record)
+        self.stream.seek(address, os.SEEK_SET)
+        if self.stream.readinto(buf) < len(buf) or \
+                buf[:4] != b'FILE' or \
+                not apply_fixups(buf, 0, self.bytes_per_record):
+            return None
+        return buf
+
+    def _read_record(self, record_number):
+        buf = self._read_raw_record(record_number)
+        if buf is None:
+            return None
+        return decode_record(buf, 0, self.bytes_per_record, fixed_up=True)
+
+    def _load_mft_extents(self):
+        mft = self._read_record(0)
+        if mft is None or mft.data is None or not mft.data[1]:
+            raise IOError('$MFT record is corrupted')
+        self.mft_size = mft.data[2]
+        self.mft_extents = []
+        self._add_mft_part(mft.data)
+
+    def _add_mft_part(self, data):
+        """add the extents of a part of the $MFT as `(first_vcn, start, end)'"""
+        vcn, extents, _ = data
+        for start, end in extents:
+            if start is None:
+                vcn += end
+                continue
+            self.mft_extents.append((vcn, start, end))
+            vcn += end - start + 1
+
+    def iter_records(self):
+        """
+        yield `(record_number, FileRecord)' of every valid record of the
+        $MFT, which is read extent by extent in chunks of `mft_chunk_size'
+        """
+        self._load_mft_extents()
+
+        record_size = self.bytes_per_record
+        records_per_chunk = max(self.mft_chunk_size // record_size, 1)
+        buf = bytearray(records_per_chunk * record_size)
+        view = memoryview(buf)
+
+        number_of_records = self.mft_size // record_size
+        # parts of the $MFT in extension records of record 0 are found on the
+        # way and appended, their records are numbered by their VCN
+        i = 0
+        while i < len(self.mft_extents):
+            first_vcn, start, end = self.mft_extents[i]
+            i += 1
+
+            record_number = self.c2b(first_vcn) // record_size
+            pos = self.abs_c2b(start)
+            left = min(self.c2b(end - start + 1),
+                       (number_of_records - record_number) * record_size)
+            while left > 0:
+                self.stream.seek(pos, os.SEEK_SET)
+                size = self.stream.readinto(view[:min(left, len(buf))])
+                size -= size % record_size
+                if not size:
+                    self.logger.warning('$MFT is cut short at record %d',
+                                        record_number)
+                    break
+
+                for offset in range(0, size, record_size):
+                    record = decode_record(buf, offset, record_size)
+                    if record is not None:
+                        if record.base_record == 0 and record.data and \
+                                record.data[0] and record.data[1]:
+                            self._add_mft_part(record.data)
+                        yield record_number, record
+                    record_number += 1
+
+                pos += size
+                left -= size
+
+    def get_fdt(self):
+        """
+        walk the $MFT in a single pass, returns files and directories keyed
+        by path like `FAT32.get_fdt', files as `NTFSEntry' and directories as
+        the cluster lists of their index allocation, names keep their case
+        """
+        entries = {}
+        # `{base_record: [FileRecord, ...]}' of extension records
+        extensions = {}
+
+        for record_number, record in self.iter_records():
+            if not record.in_use:
+                continue
+            if record.base_record is not None:
+                extensions.setdefault(record.base_record, []).append(record)
+                continue
+
+            name, parent = self._pick_name(record.names)
+            entries[record_number] = NTFSEntry(record_number, record, name,
+                                               parent)
+
+        for base_record, records in extensions.items():
+            entry = entries.get(base_record)
+            if entry is None:
+                continue
+            for record in records:
+                if entry.is_directory:
+                    entry.cluster_list = list(entry.cluster_list) + \
+                                         (record.index_allocation or [])
+                else:
+                    entry.add_data(record.data)
+                if entry.name is None:
+                    entry.name, entry.parent_record = \
+                        self._pick_name(record.names)
+
+        files = {}
+        directories = {}
+        paths = {ROOT_RECORD_NUMBER: '/'}
+        for record_number, entry in entries.items():
+            entry.resolve_cluster_list()
+            if record_number == ROOT_RECORD_NUMBER:
+                directories['/'] = entry.cluster_list
+                continue
+            if entry.name is None:
+                continue
+
+            path = self._path_of(entry, entries, paths)
+            target = directories if entry.is_directory else files
+            if path in target:
+                path = '%s (%d)' % (path, record_number)
+            entry.full_path = path
+            if entry.is_directory:
+                directories[path] = entry.cluster_list
+            else:
+                files[path] = entry
+
+        self.logger.info('found %s files and dirs in total', len(files) +
+                                                             len(directories))
+        return files, directories
+
+    @staticmethod
+    def _pick_name(names):
+        """`(name, parent_record)' of the $FILE_NAME to show"""
+        best = None
+        for parent, namespace, name in names:
+            if best is None or best[1] == NAMESPACE_DOS != namespace:
+                best = parent, namespace, name
+        if best is None:
+            return None, None
+        return best[2], best[0]
+
+    def _path_of(self, entry, entries, paths):
+        """full path of `entry', parents are resolved once and memoized"""
+        chain = []
+        record_number = entry.parent_record
+        while record_number not in paths:
+            parent = entries.get(record_number)
+            if parent is None or parent.name is None or \
+                    not parent.is_directory or record_number in chain:
+                # the parent is gone, or the references run in a loop
+                paths[record_number] = '/(orphan %d)' % record_number
+                break
+            chain.append(record_number)
+            record_number = parent.parent_record
+
+        for record_number in reversed(chain):
+            parent = entries[record_number]
+            paths[record_number] = os.path.join(
+                paths[parent.parent_record], parent.name)
+
+        return os.path.join(paths[entry.parent_record], entry.name)
+
+    def find_entry(self, path):
+        """
+        `NTFSEntry' of the file at `path', case is ignored, raises
+        FileNotFoundError if there is none, the tree is read first if it has
+        not been
+        """
+        if not self.fdt:
+            self.read_fdt()
+        entry = self._find_in_fdt(path)
+        if entry is None:
+            raise FileNotFoundError(path)
+        return entry
+
+    def open_file(self, path, max_read_size=EXTRACT_READ_SIZE):
+        """
+        open the file at `path', or given as its `NTFSEntry', for reading,
+        see `FAT32.open_file', the content of resident files is read from
+        their record
+        """
+        entry = path
+        if not isinstance(entry, NTFSEntry):
+            entry = self.find_entry(path)
+        if entry.is_directory:
+            raise IsADirectoryError(entry.full_path)
+
+        if entry.is_resident:
+            return io.BytesIO(self._resident_data(entry.record_number))
+
+        # sparse runs read as zeros
+        return BufferedClusterStream(self.stream, entry.extents,
+                                     self.abs_c2b, self.bytes_per_cluster,
+                                     max_read_size, entry.file_length)
+
+    def extract(self, path, dest, max_read_size=EXTRACT_READ_SIZE):
+        """
+        copy the content of the file at `path', or given as its `NTFSEntry',
+        to `dest', a path or a writable binary file, returns the number of
+        bytes copied
+        """
+        with self.open_file(path, max_read_size) as stream:
+            if not isinstance(dest, (str, bytes, os.PathLike)):
+                return _copy(stream, dest)
+
+            with open(dest, 'wb') as out:
+                return _copy(stream, out)
+
+    def _resident_data(self, record_number):
+        buf = self._read_raw_record(record_number)
+        if buf is None:
+            raise IOError('record %d is corrupted' % record_number)
+
+        pos = struct.unpack_from('<H', buf, 20)[0]
+        while pos + 16 <= len(buf):
+            (type_, length, non_resident, name_length, _, _,
+             _) = _attribute_header.unpack_from(buf, pos)
+            if type_ == AT_END or length < 16:
+                break
+            if type_ == AT_DATA and not name_length and not non_resident:
+                value_length, value_offset = _resident_header.unpack_from(
+                    buf, pos + 16)
+                return bytes(buf[pos + value_offset:
+                                 pos + value_offset + value_length])
+            pos += length
+
+        raise IOError('record %d has no resident data' % record_number)
@@ -0,0 +1,158 @@
+# encoding: utf-8
+"""
+GUID partition tables
+
+a disk with a GPT has a protective MBR with a single partition of type 0xee,
+the GPT header follows in the next sector and a backup of it is kept in the
+last sector of the disk. the partition entry array is read in a single read
+and both it and the header are checked against their CRC32, the backup is
+used if the primary copy is damaged
+"""
+import logging
+import os
+import struct
+import uuid
+import zlib
+from construct import *
+from drive.keys import *
+
+__all__ = ['GPTHeader', 'PARTITION_TYPES', 'read_gpt_entries']
+
+logger = logging.getLogger('disk')
+
+# sector sizes the GPT header is looked for with
+SECTOR_SIZES = (512, 4096)
+
+# bounds of the partition entry array, entries are 128 bytes times a power
+# of 2, larger arrays than these only come from damaged headers
+MAX_PARTITION_ENTRIES = 4096
+MAX_PARTITION_ENTRY_SIZE = 1024
+
+GPTHeader = Struct(k_GPTHeader,
+    Magic(b'EFI PART'),
+    ULInt32(k_revision),
+    ULInt32(k_header_size),
+    ULInt32(k_header_crc32),
+    Padding(4),
+    ULInt64(k_current_lba),
+    ULInt64(k_backup_lba),
+    ULInt64(k_first_usable_lba),
+    ULInt64(k_last_usable_lba),
+    Bytes(k_disk_guid, 16),
+    ULInt64(k_partition_entries_lba),
+    ULInt32(k_number_of_partition_entries),
+    ULInt32(k_size_of_partition_entry),
+    ULInt32(k_partition_entries_crc32),
+)
+
+# type GUID, unique GUID, first LBA, last LBA, attributes, name
+_partition_entry = struct.Struct('<16s16sQQQ72s')
+
+# FAT32 and NTFS volumes both use the basic data type, they are told apart by
+# their boot sectors
+PARTITION_TYPES = {
+    uuid.UUID('ebd0a0a2-b9e5-4433-87c0-68b6b72699c7'): k_BasicDataPartition,
+    # the EFI system partition is FAT formatted
+    uuid.UUID('c12a7328-f81f-11d2-ba4b-00a0c93ec93b'): k_BasicDataPartition,
+}
+
+
+def _header_crc(raw, header_size):
+    header = bytearray(raw[:header_size])
+    header[16:20] = bytes(4)
+    return zlib.crc32(header) & 0xffffffff
+
+
+def _read_header(stream, lba, sector_size):
+    """the GPT header at `lba' if its CRC matches, or None"""
+    stream.seek(lba * sector_size, os.SEEK_SET)
+    raw = stream.read(sector_size)
+    try:
+        header = GPTHeader.parse(raw)
+    except ConstructError:
+        return None
+
+    if not 92 <= header[k_header_size] <= len(raw) or \
+            _header_crc(raw, header[k_header_size]) != header[k_header_crc32]:
+        logger.warning('GPT header at LBA %d fails its CRC check', lba)
+        return None
+    return header
+
+
+def _read_entries(stream, header, sector_size):
+    """partition entries of `header' if the CRC of their array matches"""
+    size = header[k_size_of_partition_entry]
+    count = header[k_number_of_partition_entries]
+    if not _partition_entry.size <= size <= MAX_PARTITION_ENTRY_SIZE or \
+            size & (size - 1) or count > MAX_PARTITION_ENTRIES:
+        logger.warning('GPT header at LBA %d gives %d partition entries of '
+                       '%d bytes', header[k_current_lba], count, size)
+        return None
+
+    stream.seek(header[k_partition_entries_lba] * sector_size, os.SEEK_SET)
+    raw = stream.read(size * count)
+    if len(raw) < size * count or \
+            zlib.crc32(raw) & 0xffffffff != header[k_partition_entries_crc32]:
+        logger.warning('GPT partition entries at LBA %d fail their CRC check',
+                       header[k_partition_entries_lba])
+        return None
+
+    entries = []
+    empty = bytes(16)
+    for offset in range(0, size * count, size):
+        if raw[offset:offset + 16] == empty:
+            continue
+
+        type_guid, unique_guid, first_lba, last_lba, attributes, name = \
+            _partition_entry.unpack_from(raw, offset)
+        type_guid = uuid.UUID(bytes_le=bytes(type_guid))
+        entries.append(Container(**{
+            k_partition_type: PARTITION_TYPES.get(type_guid, k_ignored),
+            k_partition_type_guid: type_guid,
+            k_unique_partition_guid: uuid.UUID(bytes_le=bytes(unique_guid)),
+            k_first_sector_address: first_lba,
+            k_first_byte_address: first_lba * sector_size,
+            k_number_of_sectors: last_lba - first_lba + 1,
+            k_partition_attributes: attributes,
+            k_partition_name: bytes(name).decode('utf-16-le').
+                rstrip('\x00'),
+        }))
+
+    return entries
+
+
+def _last_lba(stream, sector_size):
+    try:
+        stream.seek(0, os.SEEK_END)
+        return stream.tell() // sector_size - 1
+    except (NotImplementedError, OSError, ValueError):
+        # e.g. drives, whose size is not known
+        return None
+
+
+def read_gpt_entries(stream):
+    """
+    entries of the used partitions of the GPT of the disk in `stream', with
+    the keys of the MBR partition entries and their GUIDs, raises ValueError
+    if neither the primary nor the backup GPT is intact
+    """
+    for sector_size in SECTOR_SIZES:
+        header = _read_header(stream, 1, sector_size)
+        if header is not None:
+            entries = _read_entries(stream, header, sector_size)
+            if entries is not None:
+                return entries
+            backup_lba = header[k_backup_lba]
+        else:
+            backup_lba = _last_lba(stream, sector_size)
+
+        if backup_lba is None:
+            continue
+        backup = _read_header(stream, backup_lba, sector_size)
+        if backup is not None:
+            entries = _read_entries(stream, backup, sector_size)
+            if entries is not None:
+                logger.warning('using the backup GPT at LBA %d', backup_lba)
+                return entries
+
+    raise ValueError('no intact GPT found')
@@ -2,6 +2,7 @@
 
 k_bootstrap_code = 'bootstrap_code'
 k_MBR = 'MBR'
+k_EBR = 'EBR'
 k_Partition = 'Partition'
 k_PartitionEntry = 'PartitionEntry'
 k_PartitionEntries = 'PartitionEntries'
@@ -80,3 +81,31 @@ k_full_path = 'full_path'
 k_path = 'path'
 k_extension = 'k_extension'
 k_cluster_list = 'cluster_list'
+
+k_NTFSBootSector = 'NTFSBootSector'
+k_MFT_cluster = 'MFT_cluster'
+k_MFT_mirror_cluster = 'MFT_mirror_cluster'
+k_clusters_per_file_record = 'clusters_per_file_record'
+k_clusters_per_index_buffer = 'clusters_per_index_buffer'
+k_volume_serial_number = 'volume_serial_number'
+
+k_GPTProtective = 'GPTProtective'
+k_GPTHeader = 'GPTHeader'
+k_signature = 'signature'
+k_revision = 'revision'
+k_header_size = 'header_size'
+k_header_crc32 = 'header_crc32'
+k_current_lba = 'current_lba'
+k_backup_lba = 'backup_lba'
+k_first_usable_lba = 'first_usable_lba'
+k_last_usable_lba = 'last_usable_lba'
+k_disk_guid = 'disk_guid'
+k_partition_entries_lba = 'partition_entries_lba'
+k_number_of_partition_entries = 'number_of_partition_entries'
+k_size_of_partition_entry = 'size_of_partition_entry'
+k_partition_entries_crc32 = 'partition_entries_crc32'
+k_partition_type_guid = 'partition_type_guid'
+k_unique_partition_guid = 'unique_partition_guid'
+k_partition_attributes = 'partition_attributes'
+k_partition_name = 'partition_name'
+k_BasicDataPartition = 'BasicDataPartition'
@@ -27,13 +27,17 @@ PartitionEntry = Struct(k_PartitionEntry,
           calc_chs_address(k_starting_chs_address)),
 
     Byte(k_partition_type),
+    # types no partition class handles are ignored
     Value(k_partition_type, lambda c: {
-        0x0: k_ignored,
+        0x5: k_ExtendedPartition,
         0xf: k_ExtendedPartition,
+        0x85: k_ExtendedPartition,
         0xb: k_FAT32,
         0xc: k_FAT32,
         0x7: k_NTFS,
-    }[c[k_partition_type]]),
+        # the disk has a GPT, see `drive.gpt'
+        0xee: k_GPTProtective,
+    }.get(c[k_partition_type], k_ignored)),
 
     Array(3, ULInt8(k_ending_chs_address)),
     Value(k_ending_chs_address,
@@ -56,3 +60,13 @@ ClassicalMBR = Struct(k_MBR,
 
     Magic(b'\x55\xaa')
 )
+
+# an EBR has the layout of an MBR, but only its first entry, the logical
+# partition, and its second one, the next EBR, are used
+ExtendedBootRecord = Struct(k_EBR,
+    Bytes(k_bootstrap_code, 0x1be),
+
+    Rename(k_PartitionEntries, Array(4, PartitionEntry)),
+
+    Magic(b'\x55\xaa')
+)
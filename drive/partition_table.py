@@ -0,0 +1,177 @@
+# encoding: utf-8
+"""
+partition tables of disks
+
+logical partitions are described by a chain of EBRs, one sector each and
+spread over the extended partition, they are read lazily as the partitions
+are iterated. tables are cached, so that the same image opened again does not
+have its EBR chain read and parsed again
+"""
+from collections import OrderedDict
+import logging
+import os
+import threading
+from construct import ConstructError
+from drive.gpt import read_gpt_entries
+from drive.keys import *
+from drive.mbr import ClassicalMBR, ExtendedBootRecord
+
+__all__ = ['SECTOR_SIZE', 'MAX_CACHED_TABLES', 'PartitionTable',
+           'read_partition_table', 'clear_partition_table_cache']
+
+SECTOR_SIZE = 512
+
+# number of partition tables kept by `read_partition_table'
+MAX_CACHED_TABLES = 32
+
+logger = logging.getLogger('disk')
+
+
+def _relocate(entry, sector):
+    """copy of `entry' whose addresses are relative to `sector'"""
+    entry = entry.copy()
+    entry[k_first_sector_address] += sector
+    entry[k_first_byte_address] = entry[k_first_sector_address] * SECTOR_SIZE
+    return entry
+
+
+class _EBRChain:
+
+    """
+    the logical partitions of an extended partition, the chain is followed
+    one EBR at a time, by whichever stream iterates it next
+    """
+
+    def __init__(self, extended_entry):
+        self.start = extended_entry[k_first_sector_address]
+        self.end = self.start + extended_entry[k_number_of_sectors]
+        self.entries = []
+        self.next_sector = self.start
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.next_sector is None
+
+    def advance(self, stream):
+        """read the next EBR of the chain"""
+        sector, self.next_sector = self.next_sector, None
+        if sector in self.seen:
+            logger.warning('EBR chain loops back to sector %d', sector)
+            return
+        if not self.start <= sector < self.end:
+            logger.warning('EBR at sector %d is outside of the extended '
+                           'partition', sector)
+            return
+        self.seen.add(sector)
+
+        stream.seek(sector * SECTOR_SIZE, os.SEEK_SET)
+        try:
+            ebr = ExtendedBootRecord.parse(stream.read(SECTOR_SIZE))
+        except ConstructError:
+            logger.warning('no valid EBR at sector %d', sector)
+            return
+
+        logical, next_ebr = ebr[k_PartitionEntries][:2]
+        if logical[k_number_of_sectors]:
+            # the logical partition starts relative to its EBR
+            self.entries.append(_relocate(logical, sector))
+        if next_ebr[k_partition_type] == k_ExtendedPartition:
+            # and the next EBR relative to the extended partition
+            self.next_sector = self.start + next_ebr[k_first_sector_address]
+
+    def iter_entries(self, stream):
+        i = 0
+        while True:
+            with self.lock:
+                if i == len(self.entries):
+                    if self.done:
+                        return
+                    self.advance(stream)
+                    continue
+                entry = self.entries[i]
+            yield entry
+            i += 1
+
+
+class PartitionTable:
+
+    """
+    the MBR of a disk and the EBR chains of its extended partitions, or the
+    GPT if the MBR is a protective one
+    """
+
+    def __init__(self, raw_mbr):
+        self.raw_mbr = raw_mbr
+        self.mbr = ClassicalMBR.parse(raw_mbr)
+        # `{first_sector: _EBRChain}' of the extended partitions
+        self._chains = {}
+        self._gpt_entries = None
+        self._lock = threading.Lock()
+
+    @property
+    def primary_entries(self):
+        return self.mbr[k_PartitionEntries]
+
+    @property
+    def is_gpt(self):
+        return any(entry[k_partition_type] == k_GPTProtective
+                   for entry in self.primary_entries)
+
+    def gpt_entries(self, stream):
+        """entries of the partitions in the GPT, read once"""
+        with self._lock:
+            if self._gpt_entries is None:
+                self._gpt_entries = read_gpt_entries(stream)
+            return self._gpt_entries
+
+    def logical_entries(self, stream, extended_entry):
+        """yield the entries of the logical partitions in `extended_entry'"""
+        key = extended_entry[k_first_sector_address]
+        with self._lock:
+            if key not in self._chains:
+                self._chains[key] = _EBRChain(extended_entry)
+            chain = self._chains[key]
+        return chain.iter_entries(stream)
+
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def _identity(stream):
+    """what tells images apart besides their MBR"""
+    try:
+        st = os.fstat(stream.fileno())
+    except (NotImplementedError, AttributeError, OSError):
+        return id(stream)
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def read_partition_table(stream):
+    """
+    `PartitionTable' of the disk in `stream', the MBR is read every time and
+    the table is taken from the cache if the same image has been read before
+    """
+    stream.seek(0, os.SEEK_SET)
+    raw_mbr = stream.read(SECTOR_SIZE)
+    key = _identity(stream), raw_mbr
+
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None:
+            _tables.move_to_end(key)
+            return table
+
+    table = PartitionTable(raw_mbr)
+    with _tables_lock:
+        table = _tables.setdefault(key, table)
+        while len(_tables) > MAX_CACHED_TABLES:
+            _tables.popitem(last=False)
+    return table
+
+
+def clear_partition_table_cache():
+    with _tables_lock:
+        _tables.clear()
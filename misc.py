@@ -1,4 +1,6 @@
 # encoding: utf-8
+from contextlib import contextmanager
+import gc
 import os
 from construct import Construct
 import time
@@ -28,6 +30,21 @@ def time_it(f):
     return wrapper
 
 
+@contextmanager
+def gc_paused():
+    """
+    pause the cyclic garbage collector while building millions of small
+    containers, which would otherwise trigger a full collection again and again
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
 class SimpleCounter:
 
     __slots__ = ['counter']
@@ -1,9 +1,14 @@
 # encoding: utf-8
 
+from stream.cached_stream import BlockCache, CachedStream
 from stream.img_stream import ImageStream
+from stream.mapped_img_stream import MappedImageStream
 from stream.windows_drive import WindowsPhysicalDriveStream
 
 
 
 __all__ = ['WindowsPhysicalDriveStream',
-           'ImageStream']
\ No newline at end of file
+           'ImageStream',
+           'MappedImageStream',
+           'BlockCache',
+           'CachedStream']
\ No newline at end of file
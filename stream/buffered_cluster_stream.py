@@ -1,52 +1,258 @@
 # encoding: utf-8
-from io import BytesIO
-from itertools import chain
+from bisect import bisect_right
+import errno
 import os
 from stream.read_only_stream import ReadOnlyStream
 
 
-class MethodNotSupportedError(BaseException):
-    pass
+def _copy_file_range(src, dst, src_pos, count):
+    return os.copy_file_range(src, dst, count, src_pos)
+
+
+def _sendfile(src, dst, src_pos, count):
+    return os.sendfile(dst, src, src_pos, count)
+
+
+# ways to copy between file descriptors inside the kernel, best first, both
+# write at the position of `dst' and advance it, if it has one
+_KERNEL_COPIES = [copy for name, copy in (('copy_file_range', _copy_file_range),
+                                          ('sendfile', _sendfile))
+                  if hasattr(os, name)]
+
+# errors meaning that a kernel copy does not support the given files
+_UNSUPPORTED_COPY_ERRORS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS,
+                            errno.EOPNOTSUPP, errno.EBADF}
 
 
 class BufferedClusterStream(ReadOnlyStream):
-    def __init__(self, origin_stream, cluster_list, abs_c2b):
+
+    """
+    reads a cluster chain as one continuous stream, every contiguous extent of
+    the chain is read with as few large reads as possible
+
+    the origin stream is only read with `readinto_at', so any number of
+    cluster streams can read the same origin from different threads
+    """
+
+    # upper bound of a single read issued to the origin stream
+    DEFAULT_MAX_READ_SIZE = 1024 * 1024
+
+    def __init__(self, origin_stream, cluster_list, abs_c2b, bytes_per_cluster,
+                 max_read_size=DEFAULT_MAX_READ_SIZE, size=None):
         """
+        cluster_list: extents of the chain as `[[start, end], ...]', an
+        extent `[None, count]' is a hole of `count' clusters which reads as
+        zeros, like a sparse run of NTFS
         abs_c2b: a function which calculates the absolute byte address of the
         cluster, usually given `self.abs_c2b' in FAT32
+        bytes_per_cluster: cluster size of the partition
+        max_read_size: upper bound of a single read, rounded down to whole
+        clusters
+        size: length of the stream if shorter than the chain, e.g. the length
+        of a file, so that the slack of its last cluster is not read
         """
         super(BufferedClusterStream, self).__init__()
 
         self._stream = origin_stream
-        self.clusters = chain.from_iterable(map(lambda args: range(args[0],
-                                                                   args[1] + 1),
-                                                 cluster_list))
-        self._abs_c2b = abs_c2b
+        self._max_read_size = max(max_read_size // bytes_per_cluster, 1) *\
+                              bytes_per_cluster
 
-        self._buffer = BytesIO()
+        # absolute byte address and chain offset of every extent
+        self._extents = []
+        self._offsets = []
+        chain_size = 0
+        for start, end in cluster_list:
+            if start is None:
+                self._extents.append(None)
+                count = end
+            else:
+                self._extents.append(abs_c2b(start))
+                count = end - start + 1
+            self._offsets.append(chain_size)
+            chain_size += count * bytes_per_cluster
+        self.chain_size = chain_size
+        self.size = chain_size if size is None else min(size, chain_size)
 
-    def _load_next_cluster(self):
-        self._stream.seek(self._abs_c2b(next(self.clusters)), os.SEEK_SET)
-        self._buffer = BytesIO(self._stream.read())
+        self._pos = 0
+
+        # chain offset of the buffer and its content
+        self._buffer_pos = 0
+        self._buffer = memoryview(b'')
+
+    def _locate(self, pos):
+        """absolute byte address of chain offset `pos', None in a hole, and
+        bytes left in its extent"""
+        i = bisect_right(self._offsets, pos) - 1
+        extent_end = self.size
+        if i + 1 < len(self._offsets):
+            extent_end = min(self._offsets[i + 1], extent_end)
+        address = self._extents[i]
+        if address is not None:
+            address += pos - self._offsets[i]
+        return address, extent_end - pos
+
+    def _fill_buffer(self):
+        address, remaining = self._locate(self._pos)
+        size = min(remaining, self._max_read_size)
+
+        if address is None:
+            self._buffer = memoryview(bytes(size))
+        elif self._stream.zero_copy:
+            self._buffer = self._stream.view(address, size)
+        else:
+            self._buffer = memoryview(self._stream.read_at(address, size))
+        self._buffer_pos = self._pos
+
+        return len(self._buffer)
+
+    def _buffered(self):
+        """buffered bytes from current position on"""
+        offset = self._pos - self._buffer_pos
+        if 0 <= offset < len(self._buffer):
+            return self._buffer[offset:]
+        return None
 
     def read(self, size=ReadOnlyStream.DEFAULT_READ_BUFFER_SIZE):
-        buf = self._buffer.read(size)
-        buf_len = len(buf)
+        left = max(self.size - self._pos, 0)
+        size = left if size < 0 else min(size, left)
+
+        chunk = self._buffered()
+        if chunk is not None and len(chunk) >= size:
+            # fast path, small reads from the current buffer
+            self._pos += size
+            return bytes(chunk[:size])
+
+        buf = bytearray(size)
+        return bytes(buf[:self.readinto(buf)])
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        size = min(len(view), max(self.size - self._pos, 0))
 
-        if buf_len < size:
-            # current cluster finished, jump to next cluster
-            self._load_next_cluster()
-            buf += self._buffer.read(size - buf_len)
+        done = 0
+        while done < size:
+            chunk = self._buffered()
+            if chunk is None:
+                address, remaining = self._locate(self._pos)
+                if size - done >= self._max_read_size and \
+                        address is not None and not self._stream.zero_copy:
+                    # large reads go straight into the caller's buffer
+                    n = min(size - done, remaining)
+                    n = self._stream.readinto_at(address,
+                                                 view[done:done + n])
+                    if not n:
+                        break
+                    self._pos += n
+                    done += n
+                    continue
 
-        return buf
+                if not self._fill_buffer():
+                    break
+                chunk = self._buffered()
+
+            n = min(len(chunk), size - done)
+            view[done:done + n] = chunk[:n]
+            self._pos += n
+            done += n
+
+        return done
+
+    def copy_to(self, out):
+        """
+        copy the rest of the stream to the writable binary file `out', returns
+        the number of bytes copied
+
+        if both the origin stream and `out' have a file descriptor, whole
+        extents are copied by the kernel with `os.copy_file_range' or
+        `os.sendfile', otherwise in reads of `max_read_size'. `out' may be a
+        pipe or a socket
+        """
+        copied = 0
+        try:
+            src, dst = self._stream.fileno(), out.fileno()
+        except (AttributeError, NotImplementedError, OSError):
+            # io.UnsupportedOperation is an OSError
+            src = dst = None
+
+        if src is not None:
+            out.flush()
+            try:
+                copied = self._copy_in_kernel(src, dst)
+            finally:
+                self._sync_position(out)
+
+        return copied + self._copy_buffered(out)
+
+    @staticmethod
+    def _sync_position(out):
+        """catch `out' up with the position the kernel moved its descriptor
+        to"""
+        try:
+            out.seek(0, os.SEEK_CUR)
+        except OSError:
+            # io.UnsupportedOperation, pipes and sockets have no position
+            pass
+
+    def _copy_in_kernel(self, src, dst):
+        copied = 0
+        copies = list(_KERNEL_COPIES)
+        while copies and self._pos < self.size:
+            address, remaining = self._locate(self._pos)
+            if address is None:
+                # holes are written by `_copy_buffered'
+                break
+            try:
+                n = copies[0](src, dst, address, remaining)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_COPY_ERRORS:
+                    raise
+                copies.pop(0)
+                continue
+
+            if not n:
+                break
+            self._pos += n
+            copied += n
+
+        return copied
+
+    def _copy_buffered(self, out):
+        copied = 0
+        buf = None
+        while self._pos < self.size:
+            address, remaining = self._locate(self._pos)
+            size = min(remaining, self._max_read_size)
+
+            if address is None:
+                chunk = memoryview(bytes(size))
+            elif self._stream.zero_copy:
+                chunk = self._stream.view(address, size)
+            else:
+                if buf is None:
+                    buf = memoryview(bytearray(self._max_read_size))
+                chunk = buf[:self._stream.readinto_at(address, buf[:size])]
+
+            if not chunk:
+                break
+            out.write(chunk)
+            self._pos += len(chunk)
+            copied += len(chunk)
+
+        return copied
 
     def close(self):
-        self._buffer.close()
+        self._buffer.release()
 
     def seek(self, pos, whence=os.SEEK_SET):
-        raise MethodNotSupportedError('BufferedClusterStream does '
-                                      'not support seek')
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+
+        self._pos = pos
 
     def tell(self):
-        raise MethodNotSupportedError('BufferedClusterStream does '
-                                      'not support tell')
+        return self._pos
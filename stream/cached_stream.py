@@ -0,0 +1,274 @@
+# encoding: utf-8
+from collections import OrderedDict
+import os
+import threading
+
+from stream.read_only_stream import ReadOnlyStream
+
+__all__ = ['BlockCache', 'CachedStream']
+
+
+class BlockCache:
+
+    """
+    aligned blocks of a stream kept in memory up to a budget of bytes, the
+    least recently used blocks are evicted first. it is shared by a
+    `CachedStream' and the handles reopened from it, and counts how often a
+    block was found
+    """
+
+    DEFAULT_BUDGET = 1024 * 1024 * 64
+    DEFAULT_BLOCK_SIZE = 1024 * 64
+
+    def __init__(self, budget=DEFAULT_BUDGET, block_size=DEFAULT_BLOCK_SIZE):
+        self.budget = budget
+        self.block_size = block_size
+        # bytes held by the blocks
+        self.nbytes = 0
+
+        # blocks found, blocks read for a request, blocks read ahead of one
+        # and blocks dropped for the budget
+        self.hits = 0
+        self.misses = 0
+        self.read_ahead = 0
+        self.evictions = 0
+
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, index):
+        """the block `index' or None, counted as a hit or a miss"""
+        with self._lock:
+            block = self._blocks.get(index)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._blocks.move_to_end(index)
+            return block
+
+    def __contains__(self, index):
+        return index in self._blocks
+
+    def put(self, index, block, read_ahead=False):
+        with self._lock:
+            old = self._blocks.pop(index, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._blocks[index] = block
+            self.nbytes += len(block)
+            if read_ahead:
+                self.read_ahead += 1
+
+            while self.nbytes > self.budget and len(self._blocks) > 1:
+                _, old = self._blocks.popitem(last=False)
+                self.nbytes -= len(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self.nbytes = 0
+
+    @property
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+    def __repr__(self):
+        return ('<BlockCache %d blocks, %d of %d bytes, %d hits, %d misses, '
+                '%d read ahead, %d evictions>' % (
+                    len(self._blocks), self.nbytes, self.budget, self.hits,
+                    self.misses, self.read_ahead, self.evictions))
+
+
+class CachedStream(ReadOnlyStream):
+
+    """
+    stream served from a `BlockCache' in front of any other stream, so that
+    the FAT, directory clusters and other metadata read over and over again
+    only hit the device once
+
+    reads are rounded out to whole blocks, and the missing blocks of a read
+    are fetched from the origin stream with one read per contiguous run.
+    once reads follow each other, the blocks after them are read ahead in the
+    same request, twice as many every time a sequential read reaches the
+    origin stream, up to `max_read_ahead' bytes. reads of at least a quarter
+    of the budget bypass the cache, so that copying large files out does not
+    flush it
+
+    blocks are kept until `invalidate' is called, which `FAT32.rescan' does
+    """
+
+    DEFAULT_MAX_READ_AHEAD = 1024 * 1024
+
+    def __init__(self, origin_stream, budget=BlockCache.DEFAULT_BUDGET,
+                 block_size=BlockCache.DEFAULT_BLOCK_SIZE,
+                 max_read_ahead=DEFAULT_MAX_READ_AHEAD, cache=None):
+        """
+        cache: a `BlockCache' to share with other handles on the same storage,
+        `budget' and `block_size' are those of a new one otherwise
+        """
+        super(CachedStream, self).__init__()
+
+        self._stream = origin_stream
+        self.cache = cache or BlockCache(budget, block_size)
+        self.block_size = self.cache.block_size
+        self.max_read_ahead = max_read_ahead
+        # identifies the image, e.g. in `FAT32IndexCache'
+        self.img_path = getattr(origin_stream, 'img_path', None)
+
+        self._pos = 0
+        # where a read continuing the last one starts, and the number of
+        # blocks read ahead of it
+        self._next_pos = None
+        self._window = 0
+
+    def _fetch(self, first, count, read_ahead):
+        """
+        read the blocks from `first' on from the origin stream into the cache,
+        returns `{index: block}' of the blocks read
+        """
+        size = self.block_size
+        view = memoryview(bytearray(count * size))
+        done = self._stream.readinto_at(first * size, view)
+
+        blocks = {}
+        for i in range(-(-done // size)):
+            block = bytes(view[i * size:min((i + 1) * size, done)])
+            blocks[first + i] = block
+            self.cache.put(first + i, block, first + i >= read_ahead)
+        return blocks
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        # only reads continuing the last one are read ahead of
+        window = self._window if self._pos == self._next_pos else None
+
+        n, window = self._read_blocks(self._pos, view, window)
+        self._window = window or 0
+        self._pos += n
+        self._next_pos = self._pos
+        return n
+
+    def _readinto_at(self, offset, view):
+        # positioned reads are not read ahead of, they can come from any
+        # number of threads
+        return self._read_blocks(offset, view, None)[0]
+
+    def _read_blocks(self, offset, view, window):
+        """
+        read into `view' from `offset' through the cache, the blocks after it
+        are read ahead unless `window' is None, returns the number of bytes
+        read and the next window
+        """
+        size = len(view)
+        if not size:
+            return 0, window
+
+        if size >= self.cache.budget // 4:
+            return self._stream.readinto_at(offset, view), None
+
+        block_size = self.block_size
+        first = offset // block_size
+        last = (offset + size - 1) // block_size
+
+        blocks = {}
+        missing = []
+        for i in range(first, last + 1):
+            block = self.cache.get(i)
+            if block is None:
+                missing.append(i)
+            else:
+                blocks[i] = block
+
+        # one read per run of missing blocks, the last run is extended by the
+        # blocks read ahead, up to the first one which is cached
+        runs = []
+        for i in missing:
+            if runs and runs[-1][1] == i:
+                runs[-1][1] += 1
+            else:
+                runs.append([i, i + 1])
+        if runs and runs[-1][1] == last + 1 and window is not None:
+            # the window grows with every read of a sequential run which
+            # reaches the device
+            window = min(max(2 * window, last - first + 1),
+                         self.max_read_ahead // block_size)
+            end = last + 1
+            while end <= last + window and end not in self.cache:
+                end += 1
+            runs[-1][1] = end
+
+        for start, end in runs:
+            blocks.update(self._fetch(start, end - start, last + 1))
+
+        done = 0
+        offset -= first * block_size
+        for i in range(first, last + 1):
+            block = blocks.get(i, b'')
+            n = min(len(block) - offset, size - done)
+            if n <= 0:
+                break
+            view[done:done + n] = block[offset:offset + n]
+            done += n
+            offset = 0
+            if len(block) < block_size:
+                # end of the stream
+                break
+
+        return done, window
+
+    def read(self, size=ReadOnlyStream.DEFAULT_READ_BUFFER_SIZE):
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = self.read(self.max_read_ahead)
+                if not chunk:
+                    return b''.join(chunks)
+                chunks.append(chunk)
+
+        buf = bytearray(size)
+        n = self.readinto(buf)
+        del buf[n:]
+        return bytes(buf)
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            self._stream.seek(0, os.SEEK_END)
+            pos += self._stream.tell()
+
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+
+        self._pos = pos
+
+    def tell(self):
+        return self._pos
+
+    def invalidate(self):
+        """
+        drop the blocks of the cache, which is shared with the reopened
+        handles, so that changes of the storage are read
+        """
+        self.cache.clear()
+        self._next_pos = None
+        self._window = 0
+        self._stream.invalidate()
+
+    def reopen(self):
+        """another handle on the origin storage sharing the same cache"""
+        return CachedStream(self._stream.reopen(),
+                            max_read_ahead=self.max_read_ahead,
+                            cache=self.cache)
+
+    def fileno(self):
+        return self._stream.fileno()
+
+    def close(self):
+        self._stream.close()
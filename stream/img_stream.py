@@ -15,9 +15,27 @@ class ImageStream(ReadOnlyStream):
     def read(self, size=ReadOnlyStream.DEFAULT_READ_BUFFER_SIZE):
         return self.img.read(size)
 
+    def readinto(self, buf):
+        return self.img.readinto(buf)
+
+    if hasattr(os, 'preadv'):
+        def _readinto_at(self, offset, view):
+            return os.preadv(self.img.fileno(), [view], offset)
+    elif hasattr(os, 'pread'):
+        def _readinto_at(self, offset, view):
+            data = os.pread(self.img.fileno(), len(view), offset)
+            view[:len(data)] = data
+            return len(data)
+
     def seek(self, pos, whence=os.SEEK_SET):
         self.img.seek(pos, whence)
 
+    def reopen(self):
+        return ImageStream(self.img_path)
+
+    def fileno(self):
+        return self.img.fileno()
+
     def close(self):
         self.img.close()
 
@@ -0,0 +1,82 @@
+# encoding: utf-8
+import mmap
+import os
+
+from stream.read_only_stream import ReadOnlyStream
+
+
+class MappedImageStream(ReadOnlyStream):
+
+    """
+    image stream backed by a read-only memory mapping, reads are served from
+    the page cache and `view' hands out memoryview slices of the image without
+    copying
+    """
+
+    zero_copy = True
+
+    def __init__(self, img_path):
+        super(MappedImageStream, self).__init__()
+
+        self.img_path = img_path
+        self.img = open(img_path, 'rb')
+        self._map = mmap.mmap(self.img.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        self._pos = 0
+
+        self.size = len(self._map)
+
+    def read(self, size=ReadOnlyStream.DEFAULT_READ_BUFFER_SIZE):
+        start = min(self._pos, self.size)
+        end = self.size if size < 0 else min(start + size, self.size)
+        self._pos = max(self._pos, end)
+
+        return self._map[start:end]
+
+    def readinto(self, buf):
+        view = memoryview(buf).cast('B')
+        data = self.view(min(self._pos, self.size), len(view))
+        view[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def _readinto_at(self, offset, view):
+        data = self.view(offset, len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def view(self, offset, size):
+        """memoryview of `size' bytes at absolute `offset', clipped to the image"""
+        if offset < 0:
+            raise ValueError('negative offset %d' % offset)
+
+        return self._view[offset:offset + size]
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self.size
+
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+
+        self._pos = pos
+
+    def tell(self):
+        return self._pos
+
+    def reopen(self):
+        return MappedImageStream(self.img_path)
+
+    def fileno(self):
+        return self.img.fileno()
+
+    def close(self):
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # views handed out are still alive, the mapping goes away with them
+            pass
+        self.img.close()
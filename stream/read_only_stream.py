@@ -1,23 +1,123 @@
 # encoding: utf-8
 import os
+import threading
 
 
 class ReadOnlyStream:
 
     DEFAULT_READ_BUFFER_SIZE = 1024 * 4
 
+    # whether `view' can hand out memoryview slices of the underlying storage
+    zero_copy = False
+
+    # reads of the underlying storage have to start and end on multiples of
+    # this, e.g. the sectors of a raw disk, see `readinto_at'
+    sector_size = 1
+
     def __init__(self):
-        pass
+        # serializes `_readinto_at' of streams which have to seek for it
+        self._position_lock = threading.Lock()
 
     def read(self, size=DEFAULT_READ_BUFFER_SIZE):
         raise NotImplementedError
 
+    def readinto(self, buf):
+        """
+        read into the writable buffer `buf', returns the number of bytes read,
+        subclasses which can avoid the intermediate copy should override this
+        """
+        view = memoryview(buf).cast('B')
+        data = self.read(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def read_at(self, offset, size):
+        """`size' bytes at absolute `offset', without moving the stream"""
+        buf = bytearray(size)
+        del buf[self.readinto_at(offset, buf):]
+        return bytes(buf)
+
+    def readinto_at(self, offset, buf):
+        """
+        read into the writable buffer `buf' from absolute `offset' without
+        moving the stream, returns the number of bytes read, which is short
+        only at the end of the storage. it can be called from many threads on
+        the same stream at once
+
+        reads which do not start and end on sector boundaries are read whole
+        sectors at a time and copied out
+        """
+        view = memoryview(buf).cast('B')
+        if offset < 0:
+            raise ValueError('negative offset %d' % offset)
+
+        sector = self.sector_size
+        start = offset - offset % sector
+        end = -(-(offset + len(view)) // sector) * sector
+        if start == offset and end == offset + len(view):
+            return self._readinto_fully(offset, view)
+
+        aligned = memoryview(bytearray(end - start))
+        n = self._readinto_fully(start, aligned) - (offset - start)
+        n = max(min(n, len(view)), 0)
+        view[:n] = aligned[offset - start:offset - start + n]
+        return n
+
+    def _readinto_fully(self, offset, view):
+        done = 0
+        while done < len(view):
+            n = self._readinto_at(offset + done, view[done:])
+            if not n:
+                break
+            done += n
+        return done
+
+    def _readinto_at(self, offset, view):
+        """
+        read into `view' from `offset', both aligned to `sector_size', the
+        stream position is left alone. this seeks and restores the position
+        under a lock, streams which can read at an offset directly should
+        override it
+        """
+        with self._position_lock:
+            pos = self.tell()
+            try:
+                self.seek(offset, os.SEEK_SET)
+                return self.readinto(view)
+            finally:
+                self.seek(pos, os.SEEK_SET)
+
     def seek(self, pos, whence=os.SEEK_SET):
         raise NotImplementedError
 
     def tell(self):
         raise NotImplementedError
 
+    def view(self, offset, size):
+        """memoryview of `size' bytes at absolute `offset', see `zero_copy'"""
+        raise NotImplementedError
+
+    def reopen(self):
+        """
+        open another handle on the same storage, with its own position, so that
+        it can be read from another thread
+        """
+        raise NotImplementedError
+
+    def invalidate(self):
+        """
+        forget whatever was kept of the storage, e.g. before reading a volume
+        which changed since, see `CachedStream'
+        """
+        pass
+
+    def fileno(self):
+        """
+        file descriptor of the underlying storage, so that data can be copied
+        by the kernel without passing through Python
+        """
+        raise NotImplementedError
+
     def close(self):
         raise NotImplementedError
 
@@ -0,0 +1,206 @@
+# encoding: utf-8
+import os
+import struct
+import tempfile
+import uuid
+import zlib
+from attest import Tests
+from bench.synthetic import SyntheticDisk, SyntheticFAT32, SyntheticNTFS
+from drive.disk import get_drive_obj
+from drive.fs.fat32 import FAT32
+from drive.fs.ntfs import NTFS
+from drive.gpt import read_gpt_entries
+from drive.keys import *
+from drive.partition_table import clear_partition_table_cache, \
+    read_partition_table
+from stream import ImageStream
+
+disk = Tests()
+
+
+def _fat32(name):
+    image = SyntheticFAT32(256)
+    image.add_file('/%s.TXT' % name, name.encode('ascii'))
+    return image
+
+
+def _ntfs(name):
+    image = SyntheticNTFS(256)
+    image.add_file('/%s.txt' % name, name.encode('ascii'))
+    return image
+
+
+@disk.context
+def build_disk():
+    image = SyntheticDisk()
+    image.add_partition(_fat32('P0'), 0x0c)
+    image.add_logical_partition(_fat32('L0'), 0x0b)
+    image.add_logical_partition(_ntfs('l1'), 0x07)
+    image.add_logical_partition(_fat32('L2'), 0x0c)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+
+    clear_partition_table_cache()
+    yield path, image
+
+    clear_partition_table_cache()
+    os.remove(path)
+
+
+def _names(partitions):
+    names = []
+    for partition in partitions:
+        files, _ = partition.get_fdt()
+        names.extend(sorted(path for path in files if '$' not in path))
+    return names
+
+
+@disk.test
+def test_logical_partitions(path, image):
+    with ImageStream(path) as stream:
+        partitions = [p for p in get_drive_obj(stream) if p]
+        assert [type(p) for p in partitions] == [FAT32, FAT32, NTFS, FAT32]
+        assert _names(partitions) == ['/p0.txt', '/l0.txt', '/l1.txt',
+                                      '/l2.txt']
+
+
+@disk.test
+def test_lazy(path, image):
+    with ImageStream(path) as stream:
+        partitions = get_drive_obj(stream)
+        assert next(partitions).type == FAT32.type
+        assert next(partitions).type == FAT32.type
+
+        table = read_partition_table(stream)
+        chain, = table._chains.values()
+        # only the first EBR has been read
+        assert chain.seen == {image.ebr_sectors[0]}
+
+
+@disk.test
+def test_cache(path, image):
+    with ImageStream(path) as stream:
+        list(get_drive_obj(stream))
+        table = read_partition_table(stream)
+
+    with ImageStream(path) as stream:
+        # the EBRs are not read again
+        assert read_partition_table(stream) is table
+        entries = list(table.logical_entries(stream,
+                                             table.primary_entries[1]))
+        assert [e[k_partition_type] for e in entries] ==\
+            [k_FAT32, k_NTFS, k_FAT32]
+        assert entries[0][k_first_byte_address] ==\
+            (image.ebr_sectors[0] + image.ALIGNMENT) * 512
+
+
+@disk.test
+def test_loop(path, image):
+    # the last EBR links back to the second one
+    extended_start = image.ebr_sectors[0]
+    with open(path, 'r+b') as f:
+        f.seek(image.ebr_sectors[2] * 512 + 0x1be + 16)
+        f.write(struct.pack('<B3sB3sII', 0, b'\0\0\0', 0x05, b'\0\0\0',
+                            image.ebr_sectors[1] - extended_start, 1))
+
+    with ImageStream(path) as stream:
+        partitions = [p for p in get_drive_obj(stream) if p]
+        assert len(partitions) == 4
+
+
+BASIC_DATA = uuid.UUID('ebd0a0a2-b9e5-4433-87c0-68b6b72699c7')
+LINUX = uuid.UUID('0fc63daf-8483-4772-8e79-3d69d8477de4')
+
+
+def _gpt_disk():
+    image = SyntheticDisk(gpt=True)
+    for i in range(5):
+        if i == 3:
+            image.add_partition(_fat32('LINUX'), LINUX, 'linux')
+        elif i % 2:
+            image.add_partition(_ntfs('n%d' % i), BASIC_DATA, 'data %d' % i)
+        else:
+            image.add_partition(_fat32('F%d' % i), BASIC_DATA, 'data %d' % i)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    return image.write(path)
+
+
+@disk.test
+def test_gpt(*_):
+    path = _gpt_disk()
+    try:
+        with ImageStream(path) as stream:
+            partitions = list(get_drive_obj(stream))
+            assert [type(p) for p in partitions] == [FAT32, NTFS, FAT32,
+                                                     type(None), FAT32]
+            assert _names(p for p in partitions if p) ==\
+                ['/f0.txt', '/n1.txt', '/f2.txt', '/f4.txt']
+
+            entries = read_gpt_entries(stream)
+            assert [e[k_partition_name] for e in entries] ==\
+                ['data 0', 'data 1', 'data 2', 'linux', 'data 4']
+            assert entries[3][k_partition_type_guid] == LINUX
+            assert entries[3][k_partition_type] == k_ignored
+    finally:
+        clear_partition_table_cache()
+        os.remove(path)
+
+
+@disk.test
+def test_gpt_backup(*_):
+    path = _gpt_disk()
+    try:
+        with ImageStream(path) as stream:
+            intact = read_gpt_entries(stream)
+
+        # a damaged entry array fails its CRC, the backup is used
+        with open(path, 'r+b') as f:
+            f.seek(2 * 512 + 40)
+            f.write(b'\xff')
+        with ImageStream(path) as stream:
+            assert read_gpt_entries(stream) == intact
+
+        # as it is if the primary header is damaged
+        with open(path, 'r+b') as f:
+            f.seek(512 + 40)
+            f.write(b'\xff')
+        with ImageStream(path) as stream:
+            assert read_gpt_entries(stream) == intact
+
+        # or if it claims an entry array too large to be read
+        with open(path, 'r+b') as f:
+            f.seek(512)
+            header = bytearray(f.read(92))
+            header[80:84] = struct.pack('<I', 1 << 24)
+            header[16:20] = bytes(4)
+            header[16:20] = struct.pack('<I', zlib.crc32(header))
+            f.seek(512)
+            f.write(header)
+        with ImageStream(path) as stream:
+            assert read_gpt_entries(stream) == intact
+
+        with open(path, 'r+b') as f:
+            f.seek(-512 + 40, os.SEEK_END)
+            f.write(b'\xff')
+        with ImageStream(path) as stream:
+            try:
+                read_gpt_entries(stream)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError('damaged GPT was read')
+
+            # the disk is still listed, from its protective MBR
+            clear_partition_table_cache()
+            assert list(get_drive_obj(stream)) == [None] * 4
+    finally:
+        clear_partition_table_cache()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    disk.run()
@@ -0,0 +1,105 @@
+# encoding: utf-8
+import random
+from attest import Tests
+from analysis import events as events_module
+from analysis.events import EventStore
+
+events = Tests()
+
+
+@events.context
+def random_events():
+    rng = random.Random(3)
+    paths, create_times, modify_times, access_times = [], [], [], []
+    t = 1e9
+    for i in range(3000):
+        # quiet stretches with bursts of files created at once
+        t += rng.expovariate(1 / 600.) if rng.random() < .9 else 0.5
+        paths.append('/d%d/s%d/f%d' % (i % 3, i % 7, i))
+        create_times.append(t)
+        modify_times.append(t + rng.uniform(0, 1e5))
+        access_times.append(float('nan') if i % 5 else t + 1e6)
+    columns = [paths, create_times, modify_times, access_times,
+               [i * 10 for i in range(3000)], list(range(3000))]
+
+    stores = []
+    numpy = events_module.numpy
+    try:
+        for module in (numpy, None):
+            events_module.numpy = module
+            if module is not None:
+                stores.append(EventStore(paths, *(module.array(c)
+                                                  for c in columns[1:])))
+            else:
+                stores.append(EventStore(paths, *columns[1:]))
+    finally:
+        events_module.numpy = numpy
+
+    yield [columns, stores]
+
+
+@events.test
+def test_range(data):
+    (paths, create_times, modify_times, access_times, sizes, _), stores = \
+        data
+    since, until = sorted(modify_times)[100], sorted(modify_times)[900]
+    expected = sorted((t, i) for i, t in enumerate(modify_times)
+                      if since <= t <= until)
+    for store in stores:
+        assert list(store.range('modify', since, until)) ==\
+            [i for _, i in expected]
+        assert store.count('modify', since, until) == 801
+        assert store.count('access') == 600
+        assert len(store) == 3000 + 3000 + 600
+
+
+def _brute_force_bursts(times, window, threshold):
+    times = sorted(times)
+    dense = [(i, sum(1 for u in times[i:] if u <= t + window))
+             for i, t in enumerate(times)]
+    runs = []
+    for i, n in dense:
+        if n < threshold:
+            continue
+        if runs and i < runs[-1][1]:
+            runs[-1][1] = max(runs[-1][1], i + n)
+        else:
+            runs.append([i, i + n])
+    return [(times[a], times[b - 1], b - a) for a, b in runs]
+
+
+@events.test
+def test_bursts(data):
+    (_, create_times, _, _, _, _), stores = data
+    expected = _brute_force_bursts(create_times, 10, 4)
+    assert expected
+    for store in stores:
+        bursts = store.bursts('create', 10, 4)
+        assert [(b.first_time, b.last_time, b.count) for b in bursts] ==\
+            expected
+        assert all(len(b.path_ids) == b.count for b in bursts)
+
+
+@events.test
+def test_rollup(data):
+    (paths, create_times, _, _, sizes, _), stores = data
+    since, until = 1e9, sorted(create_times)[1499]
+    expected = {}
+    for path, t, size in zip(paths, create_times, sizes):
+        if since <= t <= until:
+            directory = path.rpartition('/')[0]
+            count, total = expected.get(directory, (0, 0))
+            expected[directory] = count + 1, total + size
+
+    for store in stores:
+        rollup = store.rollup('create', since, until)
+        assert rollup == expected
+
+        recursive = store.rollup('create', since, until, recursive=True)
+        assert recursive['/'] == (1500, sum(s for _, s in expected.values()))
+        assert recursive['/d0'][0] == sum(
+            n for d, (n, _) in expected.items() if d.startswith('/d0/'))
+
+
+if __name__ == '__main__':
+    events.run()
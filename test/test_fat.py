@@ -0,0 +1,626 @@
+# encoding: utf-8
+from datetime import datetime, timezone
+import io
+from itertools import islice
+import os
+import random
+import shutil
+import struct
+import tempfile
+import threading
+from attest import Tests
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition, FAT32IndexCache, \
+    VolumeSnapshot
+from drive.fs.fat32 import fat as fat_module
+from drive.fs.fat32.fat import FileAllocationTable, decode_fat_table
+from drive.fs.fat32.structs import FAT32DirectoryTableEntry
+from drive.fs.fat32.timestamps import fat_timestamp
+from stream import ImageStream
+
+fat = Tests()
+
+
+@fat.context
+def build_partition():
+    image = SyntheticFAT32(4096)
+    image.add_directory('/DOCS')
+    image.add_file('/README.TXT', b'readme' * 100,
+                   time=datetime(2017, 5, 6, 7, 8, 10))
+    image.add_file('/DOCS/fragmented file.txt', b'x' * 40000, fragments=3)
+    image.add_directory('/MANY')
+    for i in range(200):
+        image.add_file('/MANY/F%d.TXT' % i, b'%d' % i)
+    image.add_chain(1)
+    image.add_chain(30, fragments=4)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+
+    with ImageStream(path) as stream:
+        yield get_fat32_partition(stream)
+
+    os.remove(path)
+
+
+@fat.test
+def test_bulk_decoding(partition):
+    partition.stream.seek(partition.fat_abs_pos, os.SEEK_SET)
+    by_entry = partition.get_fat(bulk=False)
+
+    assert by_entry == (partition.fat1.cluster_chains()[0],
+                        partition.number_of_eoc_1)
+    assert partition.number_of_eoc_1 == 207
+
+
+@fat.test
+def test_cluster_chains(partition):
+    assert partition.resolve_cluster_list(2) == [[2, 2]]
+    assert partition.resolve_cluster_list(4) == [[4, 7], [9, 12], [14, 15]]
+    assert partition.resolve_cluster_list(6) == [[6, 7], [9, 12], [14, 15]]
+    # free clusters and clusters out of range
+    assert partition.resolve_cluster_list(8) == ()
+    assert partition.resolve_cluster_list(0) == ()
+    assert partition.resolve_cluster_list(len(partition.fat1)) == ()
+
+
+@fat.test
+def test_fdt(partition):
+    files, directories = partition.get_fdt()
+
+    assert set(directories) == {'/', '/docs', '/many'}
+    # 200 entries do not fit in one 4 KiB cluster
+    assert len(directories['/many'][0]) == 2
+    assert len(files) == 202
+    assert files['/many/f199.txt'].cluster_list == [[218, 218]]
+    assert files['/docs/fragmented file.txt'].cluster_list ==\
+        partition.resolve_cluster_list(4)
+
+
+@fat.test
+def test_parallel_fdt(partition):
+    files, directories = partition.get_fdt()
+    parallel_files, parallel_directories = partition.get_fdt(workers=4)
+
+    assert parallel_directories == directories
+    assert {path: entry.cluster_list for path, entry in files.items()} ==\
+        {path: entry.cluster_list for path, entry in parallel_files.items()}
+
+
+@fat.test
+def test_iter_entries(partition):
+    files, directories = partition.get_fdt()
+
+    entries = list(partition.iter_entries())
+    assert {e.full_path for e in entries} == \
+        set(files) | set(directories) - {'/'}
+
+    docs = [e.full_path for e in partition.iter_entries('/DOCS')]
+    assert docs == ['/docs', '/docs/fragmented file.txt']
+
+    first = [e.full_path for e in islice(partition.iter_entries('/many/'), 3)]
+    assert first == ['/many', '/many/f0.txt', '/many/f1.txt']
+
+
+@fat.test
+def test_index_cache(partition):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+
+    def _open(cache):
+        partition.stream.seek(0, os.SEEK_SET)
+        return get_fat32_partition(partition.stream, cache=cache)
+
+    def _fdt(p):
+        files, directories = p.get_fdt()
+        return ({path: (e.cluster_list, e.create_timestamp, e.modify_time,
+                        e.access_timestamp)
+                 for path, e in files.items()}, directories)
+
+    try:
+        with FAT32IndexCache(path) as cache:
+            scanned = _open(cache)
+            # an image file is identified by its modification time
+            assert not cache._verifies(scanned)
+            assert cache.load_fdt(scanned.cache_key,
+                                  FAT32DirectoryTableEntry, scanned) is None
+            expected = _fdt(scanned)
+
+            loaded = _open(cache)
+            assert loaded.cache_key == scanned.cache_key
+            assert cache.load_fdt(loaded.cache_key,
+                                  FAT32DirectoryTableEntry,
+                                  loaded) is not None
+            assert loaded.fat1.run_starts == scanned.fat1.run_starts
+            assert _fdt(loaded) == expected
+    finally:
+        os.remove(path)
+
+
+@fat.test
+def test_index_cache_rename(partition):
+    fd, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(fd)
+    fd, img_path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    shutil.copyfile(partition.stream.img_path, img_path)
+
+    try:
+        # the image stands in for a drive
+        with FAT32IndexCache(path, verify=True) as cache:
+            with ImageStream(img_path) as stream:
+                assert '/many/f1.txt' in \
+                    get_fat32_partition(stream, cache=cache).get_fdt()[0]
+
+            # a rename on a drive: same FAT, same modification time
+            stat = os.stat(img_path)
+            with open(img_path, 'r+b') as f:
+                raw = f.read()
+                f.seek(raw.index(b'F1      TXT'))
+                f.write(b'G1      TXT')
+            os.utime(img_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+            with ImageStream(img_path) as stream:
+                files, _ = get_fat32_partition(stream, cache=cache).get_fdt()
+            assert '/many/g1.txt' in files
+            assert '/many/f1.txt' not in files
+    finally:
+        os.remove(path)
+        os.remove(img_path)
+
+
+@fat.test
+def test_lazy(partition):
+    partition.stream.seek(0, os.SEEK_SET)
+    lazy = get_fat32_partition(partition.stream, lazy=True)
+
+    assert lazy.boot_sector == partition.boot_sector
+    assert lazy.resolve_cluster_list(4) == [[4, 7], [9, 12], [14, 15]]
+    assert lazy._lazy_fat.number_of_blocks_read == 1
+
+    files, directories = lazy.get_fdt()
+    assert set(files) == set(partition.get_fdt()[0])
+    assert lazy._fat1 is None
+
+    assert lazy.number_of_eoc_1 == partition.number_of_eoc_1
+    assert lazy.resolve_cluster_list(4) == [[4, 7], [9, 12], [14, 15]]
+
+
+@fat.test
+def test_timestamps(partition):
+    def reference(date_word, time_word, time_10ms):
+        s = (time_word & 0x1f) * 2 + time_10ms * .01
+        try:
+            t = datetime(((date_word & 0xfe00) >> 9) + 1980,
+                         (date_word & 0x01e0) >> 5, date_word & 0x1f,
+                         time_word >> 11, (time_word & 0x07e0) >> 5, int(s))
+        except ValueError:
+            return None
+        return t.replace(tzinfo=timezone.utc).timestamp() + s - int(s)
+
+    rnd = random.Random(0)
+    for _ in range(20000):
+        words = (rnd.getrandbits(16), rnd.getrandbits(16), rnd.randrange(200))
+        assert fat_timestamp(*words) == reference(*words)
+
+    readme = partition.get_fdt()[0]['/readme.txt']
+    assert readme.modify_time == datetime(2017, 5, 6, 7, 8, 10)
+    assert readme.create_timestamp == datetime(
+        2017, 5, 6, 7, 8, 10, tzinfo=timezone.utc).timestamp()
+    # only the date of the last access is recorded
+    assert readme.access_time == datetime(2017, 5, 6)
+
+
+@fat.test
+def test_extract(partition):
+    content = b'x' * 40000
+    with partition.open_file('/DOCS/Fragmented File.txt') as f:
+        assert f.size == 40000 < f.chain_size
+        assert f.read(10) == content[:10]
+        buf = bytearray(50000)
+        assert f.readinto(buf) == 39990
+        assert f.read() == b''
+
+    entry = partition.find_entry('/readme.txt')
+    with partition.open_file(entry, max_read_size=1) as f:
+        assert f.read() == b'readme' * 100
+
+    fd, path = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        assert partition.extract('/docs/fragmented file.txt', path) == 40000
+        with open(path, 'rb') as f:
+            assert f.read() == content
+
+        # copied by the kernel after what was written to `out' before
+        with open(path, 'wb') as out:
+            out.write(b'header')
+            assert partition.extract('/docs/fragmented file.txt', out) ==\
+                40000
+            out.write(b'trailer')
+        with open(path, 'rb') as f:
+            assert f.read() == b'header' + content + b'trailer'
+    finally:
+        os.remove(path)
+
+    # and into a pipe, which has no position
+    r, w = os.pipe()
+    with open(r, 'rb') as pipe_in, open(w, 'wb') as pipe_out:
+        received = []
+        reader = threading.Thread(target=lambda: received.append(
+            pipe_in.read(40000)))
+        reader.start()
+        assert partition.extract('/docs/fragmented file.txt', pipe_out) ==\
+            40000
+        reader.join()
+        assert received == [content]
+
+    # no file descriptor, copied through a buffer
+    out = io.BytesIO(b'header')
+    out.seek(0, os.SEEK_END)
+    assert partition.extract('/docs/fragmented file.txt', out) == 40000
+    assert out.getvalue() == b'header' + content
+
+    for path, error in (('/docs', IsADirectoryError),
+                        ('/docs/missing.txt', FileNotFoundError)):
+        try:
+            partition.open_file(path)
+        except error:
+            pass
+        else:
+            assert False, path
+
+
+@fat.test
+def test_mixed_case(*_):
+    image = SyntheticFAT32(4096)
+    image.add_directory('/Docs')
+    image.add_file('/Docs/Report Final.TXT', b'report')
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    try:
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            # long names keep their case, lookups ignore it
+            for read in (False, True):
+                if read:
+                    partition.read_fdt()
+                    assert '/Docs/Report Final.TXT' in partition.fdt[0]
+                for spelling in ('/Docs/Report Final.TXT',
+                                 '/docs/report final.txt',
+                                 '\\DOCS\\REPORT FINAL.txt'):
+                    entry = partition.find_entry(spelling)
+                    assert entry.full_path == '/Docs/Report Final.TXT'
+                    with partition.open_file(spelling) as f:
+                        assert f.read() == b'report'
+
+        dest_dir = tempfile.mkdtemp()
+        try:
+            with ImageStream(path) as stream:
+                partition = get_fat32_partition(stream)
+                for patterns in ('/Docs/Report Final.TXT',
+                                 '/docs/REPORT final.txt', '/Docs/*',
+                                 '/docs/r*.txt'):
+                    outputs = partition.extract_many(patterns, dest_dir)
+                    # written under the names as they are on the volume
+                    assert outputs == {'/Docs/Report Final.TXT': os.path.join(
+                        dest_dir, 'Docs', 'Report Final.TXT')}
+                    with open(outputs['/Docs/Report Final.TXT'], 'rb') as f:
+                        assert f.read() == b'report'
+        finally:
+            shutil.rmtree(dest_dir)
+    finally:
+        os.remove(path)
+
+
+@fat.test
+def test_hostile_names(*_):
+    image = SyntheticFAT32(4096)
+    image.add_directory('/DOCS')
+    image.add_file('/DOCS/..\\..\\..\\evil.txt', b'evil')
+    image.add_file('/DOCS/C:drive.txt', b'drive')
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    parent = tempfile.mkdtemp()
+    dest_dir = os.path.join(parent, 'out')
+    try:
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            outputs = partition.extract_many('/docs/*', dest_dir)
+
+        # kept within `dest_dir'
+        assert sorted(outputs.values()) == [
+            os.path.join(dest_dir, 'docs', 'drive.txt'),
+            os.path.join(dest_dir, 'docs', 'evil.txt')]
+        assert os.listdir(parent) == ['out']
+
+        # nor does a link in it lead out of it
+        shutil.rmtree(dest_dir)
+        os.makedirs(dest_dir)
+        os.symlink(parent, os.path.join(dest_dir, 'docs'))
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            try:
+                partition.extract_many('/docs/*', dest_dir)
+            except ValueError:
+                pass
+            else:
+                assert False, 'extracted through a link'
+        assert sorted(os.listdir(parent)) == ['out']
+    finally:
+        shutil.rmtree(parent)
+        os.remove(path)
+
+
+@fat.test
+def test_extract_truncated(*_):
+    image = SyntheticFAT32(4096)
+    image.add_file('/BIG.BIN', b'b' * 20000)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    dest_dir = tempfile.mkdtemp()
+    try:
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            entry = partition.find_entry('/big.bin')
+            cut = partition.abs_c2b(entry.cluster_list[0][0]) + 10000
+        os.truncate(path, cut)
+
+        with ImageStream(path) as stream:
+            partition = get_fat32_partition(stream)
+            try:
+                partition.extract_many('/big.bin', dest_dir)
+            except IOError as e:
+                assert str(cut) in str(e)
+            else:
+                assert False, 'extracted from a truncated image'
+    finally:
+        shutil.rmtree(dest_dir)
+        os.remove(path)
+
+
+@fat.test
+def test_extract_many(partition):
+    dest_dir = tempfile.mkdtemp()
+    progress = []
+    try:
+        outputs = partition.extract_many(
+            ['/MANY/F1?.TXT', '/docs/fragmented file.txt', '/readme.txt'],
+            dest_dir, max_in_flight=1,
+            progress=lambda done, total: progress.append((done, total)))
+
+        assert len(outputs) == 12
+        for i in range(10, 20):
+            with open(outputs['/many/f%d.txt' % i], 'rb') as f:
+                assert f.read() == b'%d' % i
+        with open(os.path.join(dest_dir, 'docs', 'fragmented file.txt'),
+                  'rb') as f:
+            assert f.read() == b'x' * 40000
+
+        total = 10 * 2 + 40000 + 600
+        assert progress[-1] == (total, total)
+        assert [done for done, _ in progress] == sorted(
+            done for done, _ in progress)
+    finally:
+        shutil.rmtree(dest_dir)
+
+
+@fat.test
+def test_owner_of_cluster(partition):
+    fragmented = '/docs/fragmented file.txt'
+    assert partition.owner_of_cluster(2) == '/'
+    assert partition.owner_of_cluster(3) == '/docs'
+    assert partition.owner_of_cluster(9) == fragmented
+    assert partition.owner_of_cluster(8) is None
+    assert partition.owner_of_cluster(218) == '/many/f199.txt'
+
+    assert partition.owner_of_offset(0) is None
+    assert partition.owner_of_offset(partition.abs_c2b(15) + 4095) == \
+        fragmented
+    assert partition.owner_of_offset(partition.abs_c2b(16)) != fragmented
+
+    files, directories = partition.get_fdt(workers=4)
+    owners = dict((c, path) for path, entry in files.items()
+                  for start, end in entry.cluster_list
+                  for c in range(start, end + 1))
+    owners.update((c, path) for path, cluster_list in directories.items()
+                  for start, end in cluster_list
+                  for c in range(start, end + 1))
+    for c in range(4096):
+        assert partition.owner_of_cluster(c) == owners.get(c), c
+
+
+@fat.test
+def test_recover(partition):
+    photo = b'\xff\xd8\xff\xe0' + os.urandom(9000) + b'\xff\xd9'
+    carved = b'\x89PNG\r\n\x1a\n' + b'\x00' * 10000 + b'IEND\xaeB`\x82'
+
+    image = SyntheticFAT32(256)
+    image.add_file('/KEEP.TXT', b'keep')
+    image.add_file('/GONE.TXT', b'g' * 5000, deleted=True)
+    image.add_file('/old photo.jpg', photo, deleted=True)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    # a file no directory entry remembers, crossing chunks when carving
+    with open(path, 'r+b') as f:
+        f.seek(image.abs_c2b(100) + 3000)
+        f.write(b'\xff\xd8\xff' + b'\x00' * 1000)
+        f.seek(image.abs_c2b(101))
+        f.write(carved)
+
+    try:
+        with ImageStream(path) as stream:
+            recovering = get_fat32_partition(stream)
+            assert set(recovering.get_fdt()[0]) == {'/keep.txt'}
+
+            files = recovering.recover(carve_free=False)
+            assert set(files) == {'/(deleted) one.txt',
+                                  '/(deleted) old photo.jpg'}
+            for path_, content in (('/(deleted) one.txt', b'g' * 5000),
+                                   ('/(deleted) old photo.jpg', photo)):
+                assert files[path_].is_deleted
+                with recovering.open_file(files[path_]) as f:
+                    assert f.read(-1) == content
+
+            for chunk_size in (4096 * 2, 4096 * 64):
+                files = recovering.recover(chunk_size=chunk_size)
+                assert set(files) == {'/(deleted) one.txt',
+                                      '/(deleted) old photo.jpg',
+                                      '/(carved)/101.png'}
+                with recovering.open_file(files['/(carved)/101.png']) as f:
+                    assert f.read(-1) == carved
+    finally:
+        os.remove(path)
+
+
+@fat.test
+def test_check_fats(partition):
+    assert partition.check_fats() == []
+
+    image = SyntheticFAT32(4096)
+    image.add_file('/A.TXT', b'a' * 40000, fragments=3)
+    image.add_file('/B.TXT', b'b' * 5000)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    fat2_abs_pos = image.RESERVED_SECTORS * image.BYTES_PER_SECTOR + \
+        image.bytes_per_fat
+    with open(path, 'r+b') as f:
+        # FAT2 links the middle of /a.txt to a free cluster
+        f.seek(fat2_abs_pos + 9 * 4)
+        f.write(struct.pack('<I', 100))
+        f.seek(fat2_abs_pos + 100 * 4)
+        f.write(struct.pack('<I', 0x0fffffff))
+
+    try:
+        with ImageStream(path) as stream:
+            checked = get_fat32_partition(stream)
+            for block_size in (16, 4096, 1024 * 1024):
+                assert checked.check_fats(block_size) == [
+                    (3, [[3, 6], [8, 11], [13, 14]], [[3, 6], [8, 9],
+                                                      [100, 100]]),
+                    (100, (), [[100, 100]])]
+    finally:
+        os.remove(path)
+
+
+@fat.test
+def test_update_fat(*_):
+    rnd = random.Random(5)
+    numpy = fat_module.numpy
+    try:
+        for module in (numpy, None):
+            fat_module.numpy = module
+            image = SyntheticFAT32(2000)
+            for _ in range(150):
+                image.add_chain(rnd.randint(1, 20), rnd.randint(1, 3))
+            raw = bytearray(image.build())
+            table = FileAllocationTable(decode_fat_table(raw))
+            n = len(table)
+
+            for _ in range(30):
+                first = rnd.randrange(0, n)
+                last = min(first + rnd.randrange(0, 40), n - 1)
+                # runs are cut, linked and freed
+                entries = [rnd.choice((0, 0x0fffffff, c + 1, c + 1,
+                                       rnd.randrange(2, n)))
+                           for c in range(first, last + 1)]
+                block = struct.pack('<%dI' % len(entries), *entries)
+                table.update(first, decode_fat_table(block))
+                raw[first * 4:last * 4 + 4] = block
+
+                expected = FileAllocationTable(decode_fat_table(raw))
+                assert table.run_starts == expected.run_starts
+                assert table.run_ends == expected.run_ends
+                assert table.number_of_eoc == expected.number_of_eoc
+    finally:
+        fat_module.numpy = numpy
+
+
+@fat.test
+def test_rescan(*_):
+    image = SyntheticFAT32(4096)
+    image.add_file('/README.TXT', b'readme')
+    image.add_directory('/DOCS')
+    image.add_file('/DOCS/A.TXT', b'a' * 5000, fragments=2)
+    image.add_directory('/DOCS/SUB')
+    image.add_file('/DOCS/SUB/B.TXT', b'b' * 100)
+    image.add_directory('/KEEP')
+    image.add_directory('/MANY')
+    for i in range(50):
+        image.add_file('/MANY/F%d.TXT' % i, b'%d' % i)
+    image.add_directory('/OTHER')
+    image.add_file('/OTHER/C.TXT', b'c' * 9000)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    snapshot_path = path + '.snapshot'
+
+    def _scan(snapshot=None):
+        with ImageStream(path) as stream:
+            p = get_fat32_partition(stream, lazy=True)
+            changes, snapshot = p.rescan(snapshot, block_size=512)
+            assert p.fdt == (snapshot.files, snapshot.directories)
+
+            stream.seek(0, os.SEEK_SET)
+            scanned = get_fat32_partition(stream)
+            files, directories = scanned.get_fdt()
+            assert snapshot.directories == directories
+            assert {k: (e.cluster_list, e.file_length, e.modify_timestamp)
+                    for k, e in snapshot.files.items()} == \
+                {k: (e.cluster_list, e.file_length, e.modify_timestamp)
+                 for k, e in files.items()}
+            assert p.fat1.run_starts == scanned.fat1.run_starts
+            assert p.number_of_eoc_1 == scanned.number_of_eoc_1
+            assert p.owner_of_cluster(files['/other/c.txt'].first_cluster) ==\
+                '/other/c.txt'
+        return changes, snapshot
+
+    try:
+        image.write(path)
+        changes, snapshot = _scan()
+        assert len(changes.added) == 54 and len(changes) == 54
+        # a digest of every block rather than the FAT itself
+        assert len(snapshot.fat_blocks[1]) == \
+            16 * (image.bytes_per_fat // 512)
+        snapshot.save(snapshot_path)
+
+        image.remove('/DOCS/A.TXT')
+        image.add_file('/DOCS/NEW.TXT', b'new' * 2000)
+        image._nodes['/README.TXT'].time = datetime(2018, 1, 1)
+        image.move('/DOCS/SUB', '/KEEP/SUB')
+        image.move('/MANY/F1.TXT', '/F1.TXT')
+        image.write(path)
+
+        changes, snapshot = _scan(VolumeSnapshot.load(snapshot_path))
+        assert changes.added == ['/docs/new.txt']
+        assert changes.removed == ['/docs/a.txt']
+        assert changes.modified == ['/readme.txt']
+        assert changes.moved == [('/many/f1.txt', '/f1.txt'),
+                                 ('/docs/sub/b.txt', '/keep/sub/b.txt')]
+        # /other is left alone
+        assert changes.directories_decoded == 5
+        assert 0 < changes.fat_blocks_changed < image.bytes_per_fat // 512
+
+        changes, _ = _scan(snapshot)
+        assert len(changes) == 0
+        assert changes.directories_decoded == 0
+        assert changes.fat_blocks_changed == 0
+    finally:
+        os.remove(path)
+        if os.path.exists(snapshot_path):
+            os.remove(snapshot_path)
+
+
+if __name__ == '__main__':
+    fat.run()
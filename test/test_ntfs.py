@@ -0,0 +1,152 @@
+# encoding: utf-8
+from datetime import datetime
+import io
+import os
+import tempfile
+from attest import Tests
+from bench.synthetic import SyntheticNTFS
+from drive.fs.ntfs import get_ntfs_partition
+from drive.fs.ntfs.structs import decode_runlist, allocated_extents, \
+    decode_record
+from stream import ImageStream
+
+ntfs = Tests()
+
+LARGE = bytes(range(256)) * 100
+SPARSE = bytes(8192) + LARGE[:5000] + bytes(12288) + b'end'
+
+
+@ntfs.context
+def build_partition():
+    image = SyntheticNTFS(256, number_of_records=32, mft_fragments=2,
+                          mft_extension=True)
+    image.add_directory('/Docs')
+    image.add_file('/readme.txt', b'readme' * 10,
+                   time=datetime(2017, 5, 6, 7, 8, 10))
+    image.add_file('/Docs/Large File.bin', LARGE, fragments=3)
+    image.add_file('/Docs/split.bin', LARGE[::-1], fragments=3, split=True)
+    image.add_file('/gone.txt', b'deleted', deleted=True)
+    image.add_directory('/Docs/Sub')
+    image.add_file('/Docs/Sub/a.txt', b'a' * 5000)
+    image.add_file('/Docs/sparse.bin', SPARSE, sparse=True)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+
+    with ImageStream(path) as stream:
+        # a small chunk size makes the $MFT take several reads
+        partition = get_ntfs_partition(stream)
+        partition.mft_chunk_size = 4096
+        yield partition, image
+
+    os.remove(path)
+
+
+@ntfs.test
+def test_boot_sector(partition, image):
+    assert partition.bytes_per_cluster == 4096
+    assert partition.bytes_per_record == 1024
+    assert partition.mft_abs_pos == image.abs_c2b(image.MFT_CLUSTER)
+
+
+@ntfs.test
+def test_runlist(*_):
+    # a run going backwards, a sparse run which takes up VCNs but no
+    # clusters, and a run which continues the one before the sparse run
+    runs = bytes([0x21, 0x04, 0x00, 0x01,
+                  0x21, 0x02, 0x00, 0xff,
+                  0x01, 0x05,
+                  0x11, 0x03, 0x02,
+                  0x00])
+    extents = decode_runlist(runs, 0, len(runs))
+    assert extents == [[256, 259], [0, 1], [None, 5], [2, 4]]
+    assert allocated_extents(extents) == [[256, 259], [0, 4]]
+
+
+@ntfs.test
+def test_index_allocation(partition, image):
+    # the $I30 index allocation, whichever order the others come in
+    for names in (('$SDH', '$I30', '$SII'), ('$I30', '$O'), ('$R', '$I30')):
+        attributes = [image._non_resident(
+            0xa0, [(100 + i, 100 + i)] if name != '$I30' else [(5, 6)], 0,
+            image.bytes_per_cluster, name) for i, name in enumerate(names)]
+        record = bytearray(image._record(40, attributes, 0x3))
+        decoded = decode_record(record, 0, partition.bytes_per_record)
+        assert decoded.index_allocation == [[5, 6]]
+
+    record = bytearray(image._record(40, [image._non_resident(
+        0xa0, [(7, 8)], 0, image.bytes_per_cluster, '$SDH')], 0x1))
+    assert decode_record(record, 0,
+                         partition.bytes_per_record).index_allocation is None
+
+
+@ntfs.test
+def test_fdt(partition, image):
+    files, directories = partition.get_fdt()
+
+    # names keep their case
+    assert set(directories) == {'/', '/Docs', '/Docs/Sub'}
+    assert set(files) == {'/$MFT', '/readme.txt', '/Docs/Large File.bin',
+                          '/Docs/split.bin', '/Docs/Sub/a.txt',
+                          '/Docs/sparse.bin'}
+    assert directories['/Docs'] == [list(e) for e in
+                                    image._nodes['/Docs'].clusters]
+
+    large = files['/Docs/Large File.bin']
+    assert large.cluster_list == [list(e) for e in
+                                  image._nodes['/Docs/Large File.bin'].
+                                  clusters]
+    assert large.file_length == len(LARGE)
+    assert large.first_cluster == large.cluster_list[0][0]
+
+    # the extents in the extension record are merged
+    split = files['/Docs/split.bin']
+    assert len(split.cluster_list) == 3
+    assert split.file_length == len(LARGE)
+
+    readme = files['/readme.txt']
+    assert readme.is_resident
+    assert readme.file_length == 60
+    assert readme.modify_time == datetime(2017, 5, 6, 7, 8, 10)
+    assert readme.create_time == datetime(2017, 5, 6, 7, 8, 10)
+
+
+@ntfs.test
+def test_mft_extension(partition, image):
+    # records from 16 on are in the second extent of the $MFT, which is only
+    # found through the extension record of record 0
+    numbers = [n for n, _ in partition.iter_records()]
+    assert numbers == [0, 1, 5] + list(range(16, 25))
+    assert partition.mft_extents == [(0, 4, 7), (4, 9, 12)]
+
+
+@ntfs.test
+def test_open_file(partition, image):
+    assert partition.open_file('/README.TXT').read(-1) == b'readme' * 10
+    assert partition.open_file('/docs/large file.bin').read(-1) == LARGE
+    assert partition.open_file('/docs/split.bin').read(-1) == LARGE[::-1]
+
+    # sparse runs read as zeros and keep the extents after them in place
+    sparse = partition.find_entry('/Docs/Sparse.BIN')
+    assert sum(end - start + 1 for start, end in sparse.cluster_list) == 3
+    with partition.open_file(sparse, max_read_size=4096) as f:
+        assert f.read(-1) == SPARSE
+    out = io.BytesIO()
+    assert partition.extract(sparse, out) == len(SPARSE)
+    assert out.getvalue() == SPARSE
+
+    out = io.BytesIO()
+    assert partition.extract('/docs/sub/a.txt', out) == 5000
+    assert out.getvalue() == b'a' * 5000
+
+    try:
+        partition.open_file('/gone.txt')
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError('deleted record was found')
+
+
+if __name__ == '__main__':
+    ntfs.run()
@@ -0,0 +1,244 @@
+# encoding: utf-8
+from concurrent.futures import ThreadPoolExecutor
+import os
+import random
+import tempfile
+from attest import Tests
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition
+from stream import CachedStream, ImageStream, MappedImageStream
+from stream.read_only_stream import ReadOnlyStream
+
+streams = Tests()
+
+_data = bytes(range(256)) * 64
+
+
+@streams.context
+def open_streams():
+    fd, path = tempfile.mkstemp(suffix='.img')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(_data)
+
+    with ImageStream(path) as image, MappedImageStream(path) as mapped:
+        yield image, mapped
+
+    os.remove(path)
+
+
+@streams.test
+def test_read_and_seek(image, mapped):
+    for pos, whence, size in ((0, os.SEEK_SET, 512),
+                              (100, os.SEEK_CUR, 4096),
+                              (-10, os.SEEK_END, 100),
+                              (100, os.SEEK_END, 10),
+                              (1000, os.SEEK_SET, -1)):
+        image.seek(pos, whence)
+        mapped.seek(pos, whence)
+        assert mapped.read(size) == image.read(size)
+        assert mapped.tell() == image.tell()
+
+
+@streams.test
+def test_view(image, mapped):
+    assert mapped.zero_copy and not image.zero_copy
+
+    view = mapped.view(1000, 64)
+    assert isinstance(view, memoryview)
+    assert view == _data[1000:1064]
+    assert mapped.view(len(_data) - 10, 64) == _data[-10:]
+    # views do not move the stream position
+    assert mapped.tell() == 0
+
+
+class _SectorStream(ImageStream):
+
+    """an image which can only be read in whole sectors, like a drive"""
+
+    sector_size = 512
+
+    def _readinto_at(self, offset, view):
+        assert offset % 512 == 0 and len(view) % 512 == 0
+        return super(_SectorStream, self)._readinto_at(offset, view)
+
+
+class _SeekingStream(ImageStream):
+
+    """an image read at an offset by seeking, as streams do by default"""
+
+    _readinto_at = ReadOnlyStream._readinto_at
+
+
+@streams.test
+def test_read_at(image, mapped):
+    rnd = random.Random(4)
+    with _SectorStream(image.img_path) as sectors, \
+            _SeekingStream(image.img_path) as seeking:
+        streams_ = (image, mapped, sectors, seeking)
+        for stream in streams_:
+            stream.seek(123)
+        for _ in range(200):
+            offset = rnd.randrange(len(_data) + 100)
+            size = rnd.choice((0, 1, 31, 512, 1000, 5000))
+            expected = _data[offset:offset + size]
+            for stream in streams_:
+                assert stream.read_at(offset, size) == expected
+                buf = bytearray(size)
+                assert stream.readinto_at(offset, buf) == len(expected)
+                assert buf[:len(expected)] == expected
+        # the position is left alone
+        assert all(stream.tell() == 123 for stream in streams_)
+
+        # many threads read the same handle at once
+        offsets = [rnd.randrange(len(_data)) for _ in range(2000)]
+        for stream in streams_:
+            def _read(offset):
+                return stream.read_at(offset, 700) == \
+                    _data[offset:offset + 700]
+
+            with ThreadPoolExecutor(8) as pool:
+                assert all(pool.map(_read, offsets))
+
+
+class _CountingStream(ImageStream):
+
+    def __init__(self, img_path):
+        super(_CountingStream, self).__init__(img_path)
+        self.reads = []
+
+    def _readinto_at(self, offset, view):
+        n = super(_CountingStream, self)._readinto_at(offset, view)
+        self.reads.append((offset, n))
+        return n
+
+    def reopen(self):
+        return _CountingStream(self.img_path)
+
+
+@streams.test
+def test_cached_reads(image, mapped):
+    rnd = random.Random(2)
+    with _CountingStream(image.img_path) as origin:
+        cached = CachedStream(origin, budget=4096, block_size=256,
+                              max_read_ahead=1024)
+        for _ in range(300):
+            pos = rnd.randrange(len(_data) + 100)
+            size = rnd.choice((1, 10, 256, 300, 900))
+            cached.seek(pos)
+            mapped.seek(pos)
+            assert cached.read(size) == mapped.read(size)
+            assert cached.tell() == mapped.tell()
+        assert cached.cache.nbytes <= 4096 and cached.cache.evictions
+
+        cached.seek(-10, os.SEEK_END)
+        assert cached.read(-1) == _data[-10:]
+        cached.seek(100)
+        assert cached.read(-1) == _data[100:]
+
+        # the same blocks again only hit the cache
+        cached.seek(3000)
+        cached.read(200)
+        reads, hits = len(origin.reads), cached.cache.hits
+        for _ in range(3):
+            cached.seek(3000)
+            assert cached.read(200) == _data[3000:3200]
+        assert len(origin.reads) == reads
+        assert cached.cache.hits == hits + 6
+
+        # so does another handle
+        with cached.reopen() as other:
+            other.seek(3000)
+            assert other.read(10) == _data[3000:3010]
+        assert cached.cache.hits == hits + 7
+
+        # reads of a quarter of the budget or more bypass the cache
+        cached.seek(0)
+        assert cached.read(1024) == _data[:1024]
+        assert origin.reads[-1] == (0, 1024)
+
+
+@streams.test
+def test_read_ahead(image, mapped):
+    with _CountingStream(image.img_path) as origin:
+        cached = CachedStream(origin, budget=len(_data), block_size=256,
+                              max_read_ahead=2048)
+        data = b''
+        while True:
+            chunk = cached.read(64)
+            if not chunk:
+                break
+            data += chunk
+        assert data == _data
+
+        # a block of read ahead, then two, four and eight at a time
+        assert [n for _, n in origin.reads[:5]] == [256, 512, 768, 1280, 2304]
+        assert len(origin.reads) < len(_data) // 2048 + 5
+        assert cached.cache.read_ahead > 50
+        assert cached.cache.hit_ratio > .9
+
+        # random reads are not read ahead of
+        origin.reads.clear()
+        cached.cache.clear()
+        for pos in (5000, 1100, 9000):
+            cached.seek(pos)
+            cached.read(64)
+        assert [n for _, n in origin.reads] == [256] * 3
+
+
+@streams.test
+def test_cached_partition(*_):
+    image = SyntheticFAT32(4096)
+    image.add_directory('/DOCS')
+    for i in range(100):
+        image.add_file('/DOCS/F%d.TXT' % i, b'%d' % i)
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    try:
+        with ImageStream(path) as stream:
+            expected = get_fat32_partition(stream).get_fdt()
+
+        with CachedStream(_CountingStream(path)) as stream:
+            partition = get_fat32_partition(stream)
+            files, directories = partition.get_fdt()
+            assert set(files) == set(expected[0])
+            assert directories == expected[1]
+
+            reads = len(stream._stream.reads)
+            partition.get_fdt()
+            assert len(stream._stream.reads) == reads
+    finally:
+        os.remove(path)
+
+
+
+@streams.test
+def test_cached_rescan(*_):
+    image = SyntheticFAT32(4096)
+    image.add_directory('/DOCS')
+    image.add_file('/DOCS/A.TXT', b'a')
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+    try:
+        with CachedStream(ImageStream(path)) as stream:
+            partition = get_fat32_partition(stream, lazy=True)
+            _, snapshot = partition.rescan()
+            assert len(stream.cache)
+
+            # the image changes under the cache, which a rescan drops
+            image.add_file('/DOCS/B.TXT', b'b')
+            image.write(path)
+            changes, _ = partition.rescan(snapshot)
+            assert changes.added == ['/docs/b.txt']
+
+            stream.invalidate()
+            assert not len(stream.cache)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    streams.run()
@@ -0,0 +1,119 @@
+# encoding: utf-8
+import random
+from attest import Tests
+from analysis import tiles as tiles_module
+from analysis.tiles import TimeClusterTiles
+
+tiles = Tests()
+
+
+@tiles.context
+def random_extents():
+    rng = random.Random(7)
+    starts, ends, create_times, modify_times = [], [], [], []
+    for _ in range(2000):
+        start = rng.randrange(5000)
+        starts.append(start)
+        ends.append(start + int(rng.expovariate(1 / 40.)))
+        create_times.append(rng.uniform(1e9, 1.1e9))
+        modify_times.append(rng.uniform(1e9, 1.1e9)
+                            if rng.random() < .9 else float('nan'))
+    yield [starts, ends, create_times, modify_times]
+
+
+def _brute_force(t, starts, ends, times):
+    """finest level histogram, cluster by cluster"""
+    counts = [[0] * t.size for _ in range(t.size)]
+    first, last = t.time_range
+    for start, end, time in zip(starts, ends, times):
+        if time != time or not first <= time <= last:
+            continue
+        row = min(int((time - first) * t.size / (last - first)), t.size - 1)
+        for c in range(start, min(end, t.size * t.cluster_bin - 1) + 1):
+            counts[row][c // t.cluster_bin] += 1
+    return counts
+
+
+def _tiles(extents, **kwargs):
+    numpy = tiles_module.numpy
+    built = []
+    try:
+        for module in (numpy, None):
+            tiles_module.numpy = module
+            if module is not None:
+                arrays = [module.array(a) for a in extents]
+            else:
+                arrays = extents
+            built.append(TimeClusterTiles(*arrays, tile_size=8, levels=3,
+                                          **kwargs))
+    finally:
+        tiles_module.numpy = numpy
+    return built
+
+
+def _as_lists(tile):
+    return [[int(c) for c in row] for row in tile]
+
+
+@tiles.test
+def test_finest_level(extents):
+    starts, ends, create_times, modify_times = extents
+    for t in _tiles(extents, number_of_clusters=4000):
+        assert t.size == 32 and t.cluster_bin == 125
+
+        finest = [[] for _ in range(t.size)]
+        for cluster_tile in range(4):
+            for time_tile in range(4):
+                tile = _as_lists(t.tile(2, time_tile, cluster_tile,
+                                        'modify'))
+                for i, row in enumerate(tile):
+                    finest[time_tile * 8 + i][cluster_tile * 8:
+                                              cluster_tile * 8 + 8] = row
+        assert finest == _brute_force(t, starts, ends, modify_times)
+
+
+@tiles.test
+def test_pyramid(extents):
+    numpy_tiles, loop_tiles = _tiles(extents)
+    for level in range(3):
+        n = 1 << level
+        for time_tile in range(n):
+            for cluster_tile in range(n):
+                a = _as_lists(numpy_tiles.tile(level, time_tile,
+                                               cluster_tile))
+                b = _as_lists(loop_tiles.tile(level, time_tile,
+                                              cluster_tile))
+                assert a == b
+
+    # every cluster of every extent is counted once per time
+    starts, ends, create_times, modify_times = extents
+    total = sum(e - s + 1 for s, e in zip(starts, ends))
+    total_modify = sum(e - s + 1 for s, e, t in
+                       zip(starts, ends, modify_times) if t == t)
+    top = _as_lists(numpy_tiles.tile(0, 0, 0))
+    assert sum(map(sum, top)) == total + total_modify
+
+    (first, last), (c0, c1) = numpy_tiles.bounds(1, 1, 0)
+    assert first == sum(numpy_tiles.time_range) / 2
+    assert c0 == 0 and c1 == numpy_tiles.cluster_bin * 16 - 1
+
+    try:
+        numpy_tiles.tile(1, 2, 0)
+    except IndexError:
+        pass
+    else:
+        raise AssertionError('tile out of range')
+
+
+@tiles.test
+def test_wide_extents(*_):
+    # no extent lies within a single bin
+    extents = [[0, 10, 40], [5, 30, 63], [1e9, 1e9, 1e9], [1e9, 1e9, 1e9]]
+    numpy_tiles, loop_tiles = _tiles(extents, number_of_clusters=64)
+    assert numpy_tiles.cluster_bin == 2
+    assert _as_lists(numpy_tiles.tile(0, 0, 0)) == \
+        _as_lists(loop_tiles.tile(0, 0, 0))
+
+
+if __name__ == '__main__':
+    tiles.run()
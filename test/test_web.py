@@ -0,0 +1,237 @@
+# encoding: utf-8
+from datetime import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import zlib
+from urllib.error import HTTPError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+from attest import Tests
+from bench.synthetic import SyntheticFAT32
+from drive.fs.fat32 import get_fat32_partition
+from stream import ImageStream
+from web import make_server
+
+api = Tests()
+
+
+class _HeldPartition:
+
+    """a partition whose scan waits until it is released"""
+
+    type = 'FAT32'
+    preceding_bytes = 0
+    number_of_clusters = None
+
+    def __init__(self, partition):
+        self.partition = partition
+        self.release = threading.Event()
+
+    def get_fdt(self):
+        self.release.wait()
+        return self.partition.get_fdt()
+
+
+@api.context
+def serve():
+    image = SyntheticFAT32(1024)
+    image.add_directory('/DOCS')
+    image.add_file('/README.TXT', b'readme', time=datetime(2017, 5, 6))
+    image.add_file('/DOCS/A.TXT', b'a' * 10000,
+                   time=datetime(2018, 1, 1))
+    image.add_file('/DOCS/B.TXT', b'b', time=datetime(2019, 1, 1))
+    image.add_directory('/DOCS2')
+    image.add_file('/DOCS2/Report Final.TXT', b'report',
+                   time=datetime(2016, 1, 1))
+    image.add_directory('/MANY')
+    for i in range(50):
+        image.add_file('/MANY/F%02d.TXT' % i, b'%d' % i,
+                       time=datetime(2020, 1, 1, 0, i))
+
+    fd, path = tempfile.mkstemp(suffix='.img')
+    os.close(fd)
+    image.write(path)
+
+    with ImageStream(path) as stream, ImageStream(path) as held_stream:
+        held = _HeldPartition(get_fat32_partition(held_stream))
+        httpd = make_server([get_fat32_partition(stream), None, held],
+                            '127.0.0.1', 0)
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+
+        def get(url, raw=False, headers=None):
+            url = 'http://127.0.0.1:%d%s' % (httpd.server_address[1], url)
+            try:
+                with urlopen(Request(url, headers=headers or {}),
+                             timeout=10) as response:
+                    if raw:
+                        return response.headers, response.read()
+                    return response.status, json.loads(response.read())
+            except HTTPError as e:
+                return e.code, json.loads(e.read())
+
+        yield get, held
+
+        held.release.set()
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+
+    os.remove(path)
+
+
+@api.test
+def test_partitions(get, held):
+    status, volumes = get('/api/partitions/0/dir?wait=10')
+    assert status == 200
+
+    status, volumes = get('/api/partitions')
+    assert status == 200
+    assert [(v['number'], v['status']) for v in volumes] ==\
+        [(0, 'ready'), (2, 'scanning')]
+    assert volumes[0]['files'] == 54
+
+    # the held partition does not stall the others
+    assert get('/api/partitions/2/dir')[0] == 503
+    assert get('/api/partitions/1/dir')[0] == 404
+    held.release.set()
+    assert get('/api/partitions/2/dir?wait=10')[0] == 200
+
+
+@api.test
+def test_dir_and_file(get, held):
+    status, listing = get('/api/partitions/0/dir?path=/&wait=10')
+    assert status == 200
+    assert [(e['path'], e['is_directory']) for e in listing['entries']] ==\
+        [('/docs', True), ('/docs2', True), ('/many', True),
+         ('/readme.txt', False)]
+
+    status, listing = get('/api/partitions/0/dir?path=/Docs')
+    assert [e['path'] for e in listing['entries']] ==\
+        ['/docs/a.txt', '/docs/b.txt']
+    assert listing['entries'][0]['size'] == 10000
+
+    status, entry = get('/api/partitions/0/file?path=/docs/a.txt')
+    assert status == 200
+    assert entry['modify_time'] == '2018-01-01T00:00:00'
+    assert sum(end - start + 1 for start, end in entry['cluster_list']) == 3
+
+    # long names keep their case, lookups ignore it
+    status, listing = get('/api/partitions/0/dir?path=/DOCS2/')
+    assert [e['path'] for e in listing['entries']] ==\
+        ['/docs2/Report Final.TXT']
+    for path in ('/docs2/Report Final.TXT', '/Docs2/report final.txt'):
+        status, entry = get('/api/partitions/0/file?path=' + quote(path))
+        assert status == 200 and entry['path'] == '/docs2/Report Final.TXT'
+
+    assert get('/api/partitions/0/file?path=/nothing')[0] == 404
+    assert get('/api/partitions/0/file')[0] == 400
+
+
+@api.test
+def test_range(get, held):
+    get('/api/partitions/0/dir?wait=10')
+
+    status, entries = get('/api/partitions/0/range?since=2017-12-01'
+                          '&until=2018-06-01')
+    assert [e['path'] for e in entries] == ['/docs/a.txt']
+
+    _, entry = get('/api/partitions/0/file?path=/readme.txt')
+    cluster = entry['first_cluster']
+    status, entries = get('/api/partitions/0/range?first_cluster=%d'
+                          '&last_cluster=%d' % (cluster, cluster))
+    assert [e['path'] for e in entries] == ['/readme.txt']
+
+    assert get('/api/partitions/0/range')[0] == 400
+    assert get('/api/partitions/0/range?since=yesterday')[0] == 400
+
+
+@api.test
+def test_tiles(get, held):
+    get('/api/partitions/0/dir?wait=10')
+
+    status, tile = get('/api/partitions/0/tiles/0/0/0')
+    assert status == 200
+    # three clusters of /docs/a.txt and one of each other file, each counted
+    # for its creation and its modification time
+    assert sum(map(sum, tile['counts'])) == 2 * (3 + 1 + 1 + 1 + 50)
+    assert tile['cluster_range'][0] == 0
+
+    status, tile = get('/api/partitions/0/tiles/1/1/0?kind=create')
+    assert status == 200 and tile['level'] == 1
+
+    assert get('/api/partitions/0/tiles/9/0/0')[0] == 404
+    assert get('/api/partitions/0/tiles/0/0/0?kind=access')[0] == 400
+    assert get('/api/partitions/0/tiles')[0] == 404
+
+
+def _ndjson(body):
+    lines = [json.loads(line) for line in body.decode('utf-8').splitlines()]
+    return lines[:-1], lines[-1]['next_cursor']
+
+
+@api.test
+def test_entries_pages(get, held):
+    get('/api/partitions/0/dir?wait=10')
+
+    headers, body = get('/api/partitions/0/entries', raw=True)
+    assert headers['Content-Type'] == 'application/x-ndjson'
+    entries, cursor = _ndjson(body)
+    assert len(entries) == 54 and cursor is None
+    assert [e['path'] for e in entries] ==\
+        sorted(e['path'] for e in entries)
+
+    paths = []
+    url = '/api/partitions/0/entries?prefix=/many/&limit=20'
+    while True:
+        _, body = get(url, raw=True)
+        entries, cursor = _ndjson(body)
+        assert len(entries) <= 20
+        paths.extend(e['path'] for e in entries)
+        if cursor is None:
+            break
+        url = '/api/partitions/0/entries?prefix=/many/&limit=20&cursor=' + \
+              cursor
+    assert paths == ['/many/f%02d.txt' % i for i in range(50)]
+
+    # prefixes ignore case and only match whole names
+    for prefix, expected in (('/Docs', ['/docs/a.txt', '/docs/b.txt']),
+                             ('/DOCS2/', ['/docs2/Report Final.TXT']),
+                             ('/docs/A.txt', ['/docs/a.txt']),
+                             ('/doc', [])):
+        _, body = get('/api/partitions/0/entries?prefix=' + prefix, raw=True)
+        assert [e['path'] for e in _ndjson(body)[0]] == expected
+
+    status, page = get('/api/partitions/0/entries?format=json&limit=3'
+                       '&since=2020-01-01T00:10&until=2020-01-01T00:30')
+    assert status == 200
+    assert [e['path'] for e in page['entries']] ==\
+        ['/many/f10.txt', '/many/f11.txt', '/many/f12.txt']
+    assert page['next_cursor'] is not None
+    assert 'cluster_list' in page['entries'][0]
+
+    assert get('/api/partitions/0/entries?limit=0')[0] == 400
+    assert get('/api/partitions/0/entries?cursor=%25%25')[0] == 400
+
+
+@api.test
+def test_entries_compressed(get, held):
+    get('/api/partitions/0/dir?wait=10')
+    _, plain = get('/api/partitions/0/entries', raw=True)
+
+    headers, body = get('/api/partitions/0/entries', raw=True,
+                        headers={'Accept-Encoding': 'gzip'})
+    assert headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == plain
+
+    headers, body = get('/api/partitions/0/entries', raw=True,
+                        headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+    assert headers['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(body) == plain
+
+
+if __name__ == '__main__':
+    api.run()
@@ -1,19 +1,24 @@
 # encoding: utf-8
-from http.server import SimpleHTTPRequestHandler, HTTPServer
-import json
-from web.config import partitions, address, port
+from web.api import ApiServer
+from web.volumes import VolumeCatalog
 
-files = {}
+__all__ = ['make_server', 'serve_forever']
 
-class MyHandler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if not files:
-            for partition in partitions:
-                _ = partition.get_fdt()
-                files.update({path: (obj.cluster_list,
-                                     obj.create_time.timestamp())
-                              for path, obj in _.items()})
-        self.wfile.write(bytes(json.dumps(files), encoding='ascii'))
 
+def make_server(partitions, address, port, workers=1):
+    """
+    HTTP API server of `partitions', which are scanned in the background once
+    it is serving, see `VolumeCatalog' for `workers'
+    """
+    return ApiServer((address, port), VolumeCatalog(partitions, workers))
 
-httpd = HTTPServer((address, port), MyHandler)
+
+def serve_forever():
+    """serve the partitions of `web.config'"""
+    from web.config import partitions, address, port
+
+    httpd = make_server(partitions, address, port)
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
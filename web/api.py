@@ -0,0 +1,359 @@
+# encoding: utf-8
+"""
+HTTP API of the web interface
+
+    GET /api/partitions
+    GET /api/partitions/<n>/dir?path=/docs
+    GET /api/partitions/<n>/file?path=/docs/a.txt
+    GET /api/partitions/<n>/range?since=&until=&first_cluster=&last_cluster=
+    GET /api/partitions/<n>/entries?prefix=&since=&until=&first_cluster=
+        &last_cluster=&cursor=&limit=&format=ndjson|json
+    GET /api/partitions/<n>/tiles/<level>/<time_tile>/<cluster_tile>
+        ?kind=create|modify
+
+times are POSIX timestamps or ISO 8601 dates in UTC, paths are looked up
+ignoring case. every request is served
+by its own thread, partitions which are still being scanned answer 503 unless
+`wait' seconds are given
+
+`entries' is the map of all files and their clusters, streamed in path order
+straight from the index as NDJSON, or as a JSON object, and compressed if the
+client accepts it. its last line is `{"next_cursor": ...}', which is passed
+as `cursor' to get the next page, or null if there is none
+"""
+import base64
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import chain, islice, takewhile
+import json
+import re
+from urllib.parse import parse_qs, urlsplit
+from drive.fs import fold_path
+from web.streaming import ChunkedWriter, negotiate_encoding
+from web.volumes import Volume
+
+__all__ = ['ApiError', 'ApiHandler', 'ApiServer', 'parse_time',
+           'entry_json', 'encode_cursor', 'decode_cursor']
+
+_partition_route = re.compile(
+    r'^/api/partitions/(\d+)/(dir|file|range|entries|tiles)((?:/\d+){3})?$')
+
+# upper bound of the `limit' of a page of `entries'
+MAX_PAGE_SIZE = 100000
+
+
+class ApiError(Exception):
+
+    def __init__(self, status, message):
+        super(ApiError, self).__init__(message)
+        self.status = status
+
+
+def parse_time(value):
+    """POSIX timestamp of a timestamp or ISO 8601 date, naive ones are UTC"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        t = datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(400, 'invalid time %r' % value)
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+
+def _iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).\
+        replace(tzinfo=None).isoformat()
+
+
+def entry_json(entry, cluster_list=False):
+    """JSON object of a file entry of `get_fdt'"""
+    obj = {
+        'path': entry.full_path,
+        'is_directory': False,
+        'size': entry.file_length,
+        'create_time': _iso(entry.create_timestamp),
+        'modify_time': _iso(entry.modify_timestamp),
+        'first_cluster': entry.first_cluster,
+    }
+    if cluster_list:
+        obj['cluster_list'] = [list(extent) for extent in entry.cluster_list]
+    return obj
+
+
+def _directory_json(path, cluster_list=None):
+    obj = {'path': path, 'is_directory': True}
+    if cluster_list is not None:
+        obj['cluster_list'] = [list(extent) for extent in cluster_list]
+    return obj
+
+
+def _in_window(entry, since, until):
+    for timestamp in (entry.create_timestamp, entry.modify_timestamp):
+        if timestamp is not None and since <= timestamp <= until:
+            return True
+    return False
+
+
+def _overlaps(cluster_list, first, last):
+    return any(start <= last and end >= first for start, end in cluster_list)
+
+
+def encode_cursor(path):
+    return base64.urlsafe_b64encode(path.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor.encode('ascii'), b'-_',
+                                validate=True).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise ApiError(400, 'invalid cursor')
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+
+    server_version = 'createfile'
+    # streamed responses use chunked transfer encoding
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            if url.path == '/api/partitions':
+                result = [volume.summary()
+                          for volume in self.server.catalog.volumes]
+            else:
+                match = _partition_route.match(url.path)
+                if match is None:
+                    raise ApiError(404, 'no such endpoint %s' % url.path)
+                endpoint, arguments = match.group(2), match.group(3)
+                if (endpoint == 'tiles') != (arguments is not None):
+                    raise ApiError(404, 'no such endpoint %s' % url.path)
+                volume = self._ready_volume(int(match.group(1)))
+                arguments = [int(a) for a in (arguments or '').split('/')[1:]]
+                result = getattr(self, '_get_' + endpoint)(volume, *arguments)
+        except ApiError as e:
+            self._send_json(e.status, {'error': str(e)})
+            return
+
+        if result is not None:
+            # streamed responses have been sent already
+            self._send_json(200, result)
+
+    def _param(self, name, default=None, convert=str):
+        if name not in self.query:
+            if default is None:
+                raise ApiError(400, 'missing parameter %s' % name)
+            return default
+        try:
+            return convert(self.query[name])
+        except ValueError:
+            raise ApiError(400, 'invalid parameter %s' % name)
+
+    def _ready_volume(self, number):
+        try:
+            volume = self.server.catalog.volume(number)
+        except KeyError:
+            raise ApiError(404, 'no partition %d' % number)
+
+        volume.wait(self._param('wait', 0, float))
+        if volume.status == Volume.FAILED:
+            raise ApiError(500, 'scanning partition %d failed: %s' %
+                           (number, volume.error))
+        if volume.status != Volume.READY:
+            raise ApiError(503, 'partition %d is being scanned' % number)
+        return volume
+
+    @staticmethod
+    def _resolve(volume, path):
+        """path of the file or directory at `path' ignoring case, or None"""
+        return volume.index.get(fold_path(path))
+
+    def _get_dir(self, volume):
+        query = self._param('path', '/')
+        path = self._resolve(volume, query)
+        if path not in volume.directories:
+            raise ApiError(404, 'no directory %s' % query)
+
+        entries = []
+        for child in volume.children.get(path, ()):
+            if child in volume.directories:
+                entries.append(_directory_json(child))
+            else:
+                entries.append(entry_json(volume.files[child]))
+        return {'path': path, 'entries': entries}
+
+    def _get_file(self, volume):
+        query = self._param('path')
+        path = self._resolve(volume, query)
+        if path in volume.files:
+            return entry_json(volume.files[path], cluster_list=True)
+        if path in volume.directories:
+            return _directory_json(path, volume.directories[path])
+        raise ApiError(404, 'no file %s' % query)
+
+    def _filters(self, require=False):
+        """
+        predicate on file entries of the time window and cluster range of the
+        query, or None if there are no filters
+        """
+        by_time = 'since' in self.query or 'until' in self.query
+        by_cluster = 'first_cluster' in self.query or \
+                     'last_cluster' in self.query
+        if not by_time and not by_cluster:
+            if require:
+                raise ApiError(400, 'give a time or cluster range')
+            return None
+
+        since = self._param('since', float('-inf'), parse_time)
+        until = self._param('until', float('inf'), parse_time)
+        first = self._param('first_cluster', 0, int)
+        last = self._param('last_cluster', float('inf'), int)
+
+        def _matches(entry):
+            return (not by_time or _in_window(entry, since, until)) and \
+                (not by_cluster or _overlaps(entry.cluster_list, first, last))
+        return _matches
+
+    def _iter_matches(self, volume, matches, prefix='/', after=None):
+        """
+        entries of files at or below the path `prefix' in path order, after
+        the path `after', case is ignored
+        """
+        paths = volume.paths
+        prefix = fold_path(prefix)
+        below = prefix.rstrip('/') + '/'
+
+        # the file at `prefix' itself, then the files below it, paths like
+        # `/docs 2' sort in between
+        i, j = bisect_left(paths, (prefix,)), bisect_left(paths, (below,))
+        if after is not None:
+            after = bisect_right(paths, (fold_path(after), after))
+            i, j = max(i, after), max(j, after)
+        found = chain(takewhile(lambda p: p[0] == prefix, islice(paths, i, j)),
+                      takewhile(lambda p: p[0].startswith(below),
+                                islice(paths, j, None)))
+
+        for _, path in found:
+            entry = volume.files[path]
+            if matches is None or matches(entry):
+                yield entry
+
+    def _get_range(self, volume):
+        matches = self._filters(require=True)
+
+        writer = self._start_stream('application/json')
+        writer.write(b'[')
+        for i, entry in enumerate(self._iter_matches(volume, matches)):
+            writer.write((b', ' if i else b'') +
+                         json.dumps(entry_json(entry)).encode('utf-8'))
+        writer.write(b']')
+        writer.close()
+
+    def _get_entries(self, volume):
+        matches = self._filters()
+        prefix = self._param('prefix', '/')
+        after = None
+        if 'cursor' in self.query:
+            after = decode_cursor(self.query['cursor'])
+        limit = self._param('limit', MAX_PAGE_SIZE, int)
+        if not 0 < limit <= MAX_PAGE_SIZE:
+            raise ApiError(400, 'limit is not in 1..%d' % MAX_PAGE_SIZE)
+        format_ = self._param('format', 'ndjson')
+        if format_ not in ('ndjson', 'json'):
+            raise ApiError(400, 'unknown format %s' % format_)
+
+        entries = self._iter_matches(volume, matches, prefix, after)
+        if format_ == 'ndjson':
+            writer = self._start_stream('application/x-ndjson')
+        else:
+            writer = self._start_stream('application/json')
+            writer.write(b'{"entries": [')
+
+        next_cursor = None
+        last = None
+        for i, entry in enumerate(entries):
+            if i == limit:
+                # there is at least one more entry
+                next_cursor = encode_cursor(last.full_path)
+                break
+            data = json.dumps(entry_json(entry, cluster_list=True)).\
+                encode('utf-8')
+            if format_ == 'ndjson':
+                writer.write(data + b'\n')
+            else:
+                writer.write((b', ' if i else b'') + data)
+            last = entry
+
+        if format_ == 'ndjson':
+            writer.write(json.dumps({'next_cursor': next_cursor}).
+                         encode('ascii') + b'\n')
+        else:
+            writer.write(b'], "next_cursor": ' +
+                         json.dumps(next_cursor).encode('ascii') + b'}')
+        writer.close()
+
+    def _get_tiles(self, volume, level, time_tile, cluster_tile):
+        kind = self.query.get('kind')
+        try:
+            tile = volume.tiles.tile(level, time_tile, cluster_tile, kind)
+        except IndexError as e:
+            raise ApiError(404, str(e))
+        except ValueError as e:
+            raise ApiError(400, str(e))
+
+        (first_time, last_time), (first_cluster, last_cluster) = \
+            volume.tiles.bounds(level, time_tile, cluster_tile)
+        return {
+            'level': level,
+            'time_range': [first_time, last_time],
+            'cluster_range': [first_cluster, last_cluster],
+            # rows are time bins, columns cluster bins
+            'counts': [[int(c) for c in row] for row in tile],
+        }
+
+    def _start_stream(self, content_type):
+        """send the headers of a streamed response, returns its writer"""
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        return ChunkedWriter(self.wfile, encoding)
+
+    def _send_json(self, status, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 503:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ApiServer(ThreadingHTTPServer):
+
+    def __init__(self, server_address, catalog,
+                 handler_class=ApiHandler):
+        super(ApiServer, self).__init__(server_address, handler_class)
+        self.catalog = catalog
+
+    def serve_forever(self, poll_interval=0.5):
+        self.catalog.start()
+        super(ApiServer, self).serve_forever(poll_interval)
+
+    def server_close(self):
+        super(ApiServer, self).server_close()
+        self.catalog.shutdown()
@@ -1,13 +1,19 @@
 # encoding: utf-8
 from drive.disk import get_drive_obj
-from drive.fs.fat32 import FAT32
-from stream import ImageStream, WindowsPhysicalDriveStream
+from drive.fs.fat32 import FAT32, FAT32IndexCache
+from drive.fs.ntfs import NTFS
+from stream import CachedStream, ImageStream, WindowsPhysicalDriveStream
 
-stream = ImageStream('d:/edt.raw')
+# metadata read more than once, e.g. directory clusters, is only read from
+# the disk once
+stream = CachedStream(ImageStream('d:/edt.raw'))
 address, port = '127.0.0.1', 8000
 
+# parsed FATs and directory tables are kept here between runs
+cache = FAT32IndexCache('index.sqlite')
+
 partitions = []
-for partition in get_drive_obj(stream):
+for partition in get_drive_obj(stream, cache=cache):
     if partition:
-        if partition.type == FAT32.type:
+        if partition.type in (FAT32.type, NTFS.type):
             partitions.append(partition)
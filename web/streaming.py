@@ -0,0 +1,79 @@
+# encoding: utf-8
+"""
+streamed responses, written with chunked transfer encoding and compressed on
+the fly, so that neither the body nor its compressed form is ever held in
+memory as a whole
+"""
+import zlib
+
+__all__ = ['CHUNK_SIZE', 'ENCODINGS', 'negotiate_encoding', 'ChunkedWriter']
+
+# bytes gathered before a chunk is compressed and sent
+CHUNK_SIZE = 1024 * 64
+
+# `{content_coding: wbits}' of the zlib stream of each supported coding
+ENCODINGS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS,
+}
+
+
+def negotiate_encoding(accept_encoding):
+    """the content coding to use for an Accept-Encoding header, or None"""
+    offered = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        offered[coding.strip().lower()] = q
+
+    for coding in ENCODINGS:
+        if offered.get(coding, offered.get('*', 0)) > 0:
+            return coding
+    return None
+
+
+class ChunkedWriter:
+
+    """write a body as HTTP/1.1 chunks, compressed with `encoding' if given"""
+
+    def __init__(self, wfile, encoding=None, chunk_size=CHUNK_SIZE):
+        self.wfile = wfile
+        self.chunk_size = chunk_size
+        self._compressor = None
+        if encoding is not None:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                                ENCODINGS[encoding])
+        self._buf = []
+        self._buffered = 0
+
+    def write(self, data):
+        self._buf.append(data)
+        self._buffered += len(data)
+        if self._buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        data = b''.join(self._buf)
+        self._buf = []
+        self._buffered = 0
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._send(data)
+
+    def close(self):
+        self.flush()
+        if self._compressor is not None:
+            self._send(self._compressor.flush())
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+    def _send(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n' % len(data) + data + b'\r\n')
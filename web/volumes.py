@@ -0,0 +1,132 @@
+# encoding: utf-8
+"""
+directory trees of the partitions served by the web interface
+
+partitions are scanned in the background by an executor as soon as the
+server starts, requests only ever look at finished scans and never wait for
+the disk. the partitions of a disk share its stream, so a single worker
+scans them one after another
+"""
+from concurrent.futures import ThreadPoolExecutor
+import posixpath
+import threading
+from analysis import TimeClusterTiles
+from drive.fs import fold_path
+
+__all__ = ['Volume', 'VolumeCatalog']
+
+
+class Volume:
+
+    """a partition and the index of its directory tree once it is scanned"""
+
+    PENDING = 'pending'
+    SCANNING = 'scanning'
+    READY = 'ready'
+    FAILED = 'failed'
+
+    def __init__(self, number, partition):
+        self.number = number
+        self.partition = partition
+        self.status = Volume.PENDING
+        self.error = None
+        self.files = {}
+        self.directories = {}
+        # `{directory: [path, ...]}' of the entries right under a directory
+        self.children = {}
+        # `{folded path: path}' of files and directories, to look paths up
+        # ignoring case
+        self.index = {}
+        # `(folded path, path)' of the files in order, for paging through
+        # them
+        self.paths = []
+        # the time-cluster chart, see `TimeClusterTiles'
+        self.tiles = None
+        self._ready = threading.Event()
+
+    def scan(self):
+        self.status = Volume.SCANNING
+        try:
+            files, directories = self.partition.get_fdt()
+
+            children = {}
+            for path in list(directories) + list(files):
+                if path != '/':
+                    children.setdefault(posixpath.dirname(path), []).\
+                        append(path)
+            for paths in children.values():
+                paths.sort(key=fold_path)
+            index = {fold_path(path): path
+                     for path in list(directories) + list(files)}
+
+            self.files, self.directories, self.children, self.index = \
+                files, directories, children, index
+            self.paths = sorted((fold_path(path), path) for path in files)
+            self.tiles = TimeClusterTiles.from_files(
+                files, number_of_clusters=self.partition.number_of_clusters)
+            self.status = Volume.READY
+        except Exception as e:
+            self.error = '%s: %s' % (type(e).__name__, e)
+            self.status = Volume.FAILED
+            raise
+        finally:
+            self._ready.set()
+
+    def wait(self, timeout=None):
+        """whether the scan has finished, after waiting up to `timeout'"""
+        return self._ready.wait(timeout)
+
+    @property
+    def type(self):
+        return self.partition.type
+
+    def summary(self):
+        summary = {
+            'number': self.number,
+            'type': self.type,
+            'first_byte_address': self.partition.preceding_bytes,
+            'status': self.status,
+        }
+        if self.status == Volume.READY:
+            summary['files'] = len(self.files)
+            summary['directories'] = len(self.directories)
+        elif self.status == Volume.FAILED:
+            summary['error'] = self.error
+        return summary
+
+
+class VolumeCatalog:
+
+    def __init__(self, partitions, workers=1):
+        """
+        partitions: partition objects, e.g. from `get_drive_obj', None
+        entries are skipped
+        workers: number of partitions scanned at the same time, more than
+        one only if the partitions do not share a stream
+        """
+        self.volumes = [Volume(number, partition)
+                        for number, partition in enumerate(partitions)
+                        if partition is not None]
+        self._executor = ThreadPoolExecutor(workers,
+                                            thread_name_prefix='scan')
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """start scanning every partition in the background"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for volume in self.volumes:
+                self._executor.submit(volume.scan)
+
+    def volume(self, number):
+        """the volume of partition `number', raises KeyError if there is none"""
+        for volume in self.volumes:
+            if volume.number == number:
+                return volume
+        raise KeyError(number)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)